@@ -2259,6 +2259,8 @@ app.get('/api/biometrics/health', async (req, res) => {
 });
 
 app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'), async (req, res) => {
+    // The engine scans only the gallery partitions (site/door) assigned to this device
+    const deviceId = (req.body && req.body.device_id) || req.get('X-Device-Id') || 'terminal_01';
     try {
         console.log("🔍 [Verification] Checking face identity...");
 
@@ -2286,6 +2288,7 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                 filename: 'verify.jpg',
                 contentType: 'image/jpeg'
             });
+            form.append('device_id', deviceId);
 
             console.log("📡 Attempting Biometric Engine (Port 8001)...");
 
@@ -2315,7 +2318,19 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                 timeout: 120000 // 120s — Render Free/Starter tiers can be slow on first Cold-Start
             });
 
-            if (response.data.success) {
+            if (response.data.success && response.data.session && response.data.session.repeat) {
+                // Follow-up frame of a verify session the engine already accepted: logged and marked once
+                return res.json({
+                    success: true,
+                    message: `Authorized: Welcome ${response.data.name || response.data.employee_id}`,
+                    employeeId: response.data.employee_id,
+                    user: {
+                        name: response.data.name,
+                        employee_id: response.data.employee_id
+                    },
+                    session: response.data.session
+                });
+            } else if (response.data.success) {
                 const employeeId = response.data.employee_id;
                 console.log(`✅ Face Verified: ${employeeId}`);
 
@@ -2325,7 +2340,7 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                         employee_id: employeeId,
                         status: 'success',
                         confidence: response.data.confidence,
-                        device_id: 'terminal_01',
+                        device_id: deviceId,
                         method: 'FACE',
                         metadata: { unlock_source: 'BIOMETRIC' }
                     });
@@ -2340,7 +2355,7 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                 // We need the internal UUID for the attendance table
                 const { data: empRecord } = await supabase.from('employees').select('id').eq('employee_id', employeeId).single();
                 if (empRecord) {
-                    await recordAttendance(empRecord.id, 'face', 'terminal_01');
+                    await recordAttendance(empRecord.id, 'face', deviceId);
                 }
 
                 return res.json({
@@ -2359,7 +2374,7 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                     await supabase.from('access_logs').insert({
                         employee_id: response.data.id_hint,
                         status: 'ambiguous',
-                        device_id: 'terminal_01',
+                        device_id: deviceId,
                         method: 'face'
                     });
                 } catch (logError) {
@@ -2372,6 +2387,13 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                     message: "Ambiguous matching. Please use Fingerprint sensor for secondary verification.",
                     id_hint: response.data.id_hint
                 });
+            } else if (response.data.error_code === 'PENDING_CONFIRMATION') {
+                // Matched, waiting for the next frame of the session to confirm; the engine logs the outcome once
+                return res.status(401).json({
+                    success: false,
+                    error_code: response.data.error_code,
+                    message: response.data.message
+                });
             } else {
                 console.log(`🚫 Engine Rejection: ${response.data.message}`);
                 // Log failed attempt
@@ -2383,7 +2405,7 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                             employee_id: null,
                             status: 'failed',
                             confidence: response.data.confidence || null,
-                            device_id: 'terminal_01',
+                            device_id: deviceId,
                             method: 'FACE',
                             metadata: {
                                 reason: response.data.message,
@@ -2405,7 +2427,7 @@ app.post('/api/biometrics/face/verify', biometricLimiter, upload.single('file'),
                 await supabase.from('access_logs').insert({
                     employee_id: null,
                     status: 'failed',
-                    device_id: 'terminal_01',
+                    device_id: deviceId,
                     method: 'face',
                     metadata: { reason: 'Biometric engine offline', error: engineError.message }
                 });
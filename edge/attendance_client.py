@@ -0,0 +1,178 @@
+"""
+Attendance notifications over one app-lifetime HTTP client.
+
+mark_attendance_async used to build a new httpx.AsyncClient per verified
+scan (fresh DNS + TCP + TLS each time) and, with the backend down, every
+scan burned the full 5 s timeout in its own task. AttendanceClient keeps a
+pooled keep-alive client (HTTP/2 when the h2 package is installed), feeds
+marks through a bounded queue to a few workers, and guards the backend with
+a circuit breaker: after ATTENDANCE_BREAKER_FAILURES consecutive failures
+calls stop for ATTENDANCE_BREAKER_RESET seconds, then one trial call decides
+whether to close it again. Failed marks are retried with backoff up to
+ATTENDANCE_MAX_RETRIES times; when the queue is full new marks are dropped
+(and counted) rather than piling up tasks.
+"""
+import asyncio
+import os
+import time
+
+ATTENDANCE_QUEUE_MAX = int(os.getenv("ATTENDANCE_QUEUE_MAX", 200))
+ATTENDANCE_WORKERS = int(os.getenv("ATTENDANCE_WORKERS", 2))
+ATTENDANCE_TIMEOUT = float(os.getenv("ATTENDANCE_TIMEOUT", 5.0))
+ATTENDANCE_MAX_RETRIES = int(os.getenv("ATTENDANCE_MAX_RETRIES", 3))
+ATTENDANCE_BREAKER_FAILURES = int(os.getenv("ATTENDANCE_BREAKER_FAILURES", 5))
+ATTENDANCE_BREAKER_RESET = float(os.getenv("ATTENDANCE_BREAKER_RESET", 30.0))
+RETRY_BASE_DELAY = 1.0
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open after reset_timeout -> closed on success."""
+
+    def __init__(self, failure_threshold=ATTENDANCE_BREAKER_FAILURES, reset_timeout=ATTENDANCE_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def retry_in(self):
+        """Seconds until the breaker lets a trial call through (0 when closed)."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.time()
+        self._trial_in_flight = False
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class AttendanceClient:
+    def __init__(self, base_url, device_id="office_terminal", workers=ATTENDANCE_WORKERS,
+                 max_queue=ATTENDANCE_QUEUE_MAX, max_retries=ATTENDANCE_MAX_RETRIES, breaker=None,
+                 retry_delay=RETRY_BASE_DELAY):
+        if not base_url.startswith("http://") and not base_url.startswith("https://"):
+            base_url = f"http://{base_url}"
+        self.base_url = base_url
+        self.device_id = device_id
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self.http2 = False
+        self._queue = None
+        self._tasks = []
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "dropped": 0}
+
+    def start(self, client=None):
+        """Open the pooled client (or use ``client``) and start the workers; idempotent."""
+        if self._client is None:
+            if client is None:
+                import httpx
+                self.http2 = _http2_available()
+                client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    http2=self.http2,
+                    timeout=httpx.Timeout(ATTENDANCE_TIMEOUT, connect=2.0),
+                    limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
+                )
+            self._client = client
+        if not self._tasks:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def submit(self, employee_id, device_id=None):
+        """Queue a mark from ``device_id`` (default: this client's) without blocking; False if dropped."""
+        if not self._tasks:
+            self.start()
+        return self._enqueue((employee_id, device_id or self.device_id, 0))
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            print(f"[Attendance] Queue full, dropping mark for {item[0]}")
+            return False
+
+    def metrics(self):
+        return {
+            **self.stats,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "breaker": self.breaker.state,
+            "http2": self.http2,
+        }
+
+    async def _post(self, employee_id, device_id):
+        response = await self._client.post(
+            "/attendance/mark",
+            json={"employee_id": employee_id, "method": "face", "device_id": device_id},
+        )
+        if response.status_code >= 500:
+            raise RuntimeError(f"backend returned {response.status_code}")
+        return response
+
+    async def _worker(self):
+        while True:
+            employee_id, device_id, attempt = await self._queue.get()
+            while not self.breaker.allow():
+                await asyncio.sleep(max(self.breaker.retry_in(), 0.05))
+            try:
+                print(f"[Attendance] Sending mark request for {employee_id} to {self.base_url}...")
+                response = await self._post(employee_id, device_id)
+                self.breaker.record_success()
+                self.stats["sent"] += 1
+                print(f"[Attendance] Service responded: {response.text}")
+            except Exception as e:
+                self.breaker.record_failure()
+                print(f"[Attendance] API call failed: {str(e)}")
+                if attempt < self.max_retries:
+                    self.stats["retried"] += 1
+                    asyncio.get_running_loop().call_later(
+                        self.retry_delay * 2 ** attempt, self._enqueue, (employee_id, device_id, attempt + 1)
+                    )
+                else:
+                    self.stats["failed"] += 1
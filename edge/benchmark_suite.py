@@ -0,0 +1,288 @@
+"""
+Offline, in-process micro-benchmarks for the verify hot paths.
+
+Unlike benchmark_biometrics.py (which needs a running API and only hits the
+"No face detected" path) this exercises the real functions directly:
+
+    cache_json_load   legacy face_cache.json parse (json + embedding parse)
+    store_open        FaceTemplateStore open (header + journal replay)
+    refresh           store.iter_vectors()/metadata() + GallerySnapshot.build,
+                      i.e. the body of refresh_in_memory_cache
+    refresh_compact   the same with the int8 backend and a memory-mapped
+                      float32 re-rank file (compact gallery mode)
+    compare           matcher.search_groups(k=2) + threshold/ambiguity test,
+                      per query, for every configured matcher backend; the
+                      quantized backends also report top-1 agreement with exact
+    decode            JPEG bytes -> RGB ndarray at several resolutions, via
+                      the old full decode + convert + copy and via
+                      image_decode.decode_upload (draft-mode downscale)
+    encode            detection + encoding on the bundled sample faces
+                      (skipped when face_recognition is not installed)
+
+Results are written as JSON so runs can be diffed across commits:
+
+    python benchmark_suite.py --output bench_before.json
+    python benchmark_suite.py --output bench_after.json --compare bench_before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from gallery import GallerySnapshot
+from image_decode import decode_upload
+from matcher import IVF_MIN_SIZE, QUANTIZED_BACKENDS, ExactMatcher, build_matcher, classify_match
+from template_store import EMBEDDING_DIM, FaceTemplateStore, parse_embedding
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FACES = [os.path.join(HERE, "debug_verify.jpg"), os.path.join(HERE, "..", "backend", "bharat.jpg")]
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+DECODE_RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080), (3840, 2160), (4000, 3000))
+TEMPLATES_PER_EMPLOYEE = 2
+
+
+# --- Helpers ---
+def summarise(name, samples_s, **params):
+    ms = np.array(samples_s) * 1000.0
+    return {
+        "name": name,
+        "params": params,
+        "runs": len(ms),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "min_ms": round(float(ms.min()), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return samples, result
+
+
+def synthetic_gallery(n, seed=0):
+    """``n`` face-like 128-d vectors (dlib embeddings are roughly unit-norm) plus cache metadata."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, EMBEDDING_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadata = [
+        {"employee_id": f"EMP-{i // TEMPLATES_PER_EMPLOYEE:07d}", "template_id": f"t{i}",
+         "name": f"Employee {i // TEMPLATES_PER_EMPLOYEE}", "role": "employee", "updated_at": None}
+        for i in range(n)
+    ]
+    return vectors, metadata
+
+
+# --- Benchmarks ---
+def bench_cache_json_load(n, vectors, metadata, workdir, repeat):
+    path = os.path.join(workdir, f"face_cache_{n}.json")
+    with open(path, "w") as f:
+        json.dump([{**m, "face_embedding": json.dumps(v.tolist())} for m, v in zip(metadata, vectors)], f)
+
+    def load():
+        with open(path, "r") as f:
+            records = json.load(f)
+        return np.array([parse_embedding(r["face_embedding"]) for r in records])
+
+    samples, _ = timed(load, repeat)
+    os.remove(path)
+    return summarise("cache_json_load", samples, n=n)
+
+
+def bench_store(n, vectors, metadata, workdir, repeat):
+    prefix = os.path.join(workdir, f"templates_{n}")
+    store = FaceTemplateStore(prefix)
+    store.replace_all({**m, "face_embedding": v} for m, v in zip(metadata, vectors))
+    store.close()
+
+    def open_store():
+        s = FaceTemplateStore(prefix)
+        s.close()
+
+    open_samples, _ = timed(open_store, repeat)
+
+    store = FaceTemplateStore(prefix)
+    refresh_samples, snapshot = timed(
+        lambda: GallerySnapshot.build(store.iter_vectors(), store.metadata(), version=1), repeat
+    )
+    versions = iter(range(2, repeat + 2))  # One re-rank file per build
+    compact_samples, compact = timed(
+        lambda: GallerySnapshot.build(store.iter_vectors(), store.metadata(), version=next(versions),
+                                      backend="int8", rerank_prefix=prefix), repeat
+    )
+    del compact  # Drops the re-rank file
+    store.close()
+    return [
+        summarise("store_open", open_samples, n=n),
+        summarise("refresh", refresh_samples, n=n),
+        summarise("refresh_compact", compact_samples, n=n),
+    ], snapshot
+
+
+def bench_compare(n, vectors, metadata, queries, backends):
+    results = []
+    groups = GallerySnapshot(vectors, metadata, version=1).groups if backends else None
+    rng = np.random.default_rng(1)
+    # Probes: noisy copies of enrolled templates, so the ambiguity branch is exercised as well
+    probes = vectors[rng.integers(0, n, queries)] + rng.normal(scale=0.02, size=(queries, EMBEDDING_DIM)).astype(np.float32)
+    reference = None
+    if any(b in QUANTIZED_BACKENDS for b in backends):
+        reference = [r[0][:1] for r in ExactMatcher(vectors, groups=groups).search_groups_batch(probes)]
+    for backend in backends:
+        if backend == "ivf" and n < IVF_MIN_SIZE:
+            continue
+        t0 = time.perf_counter()
+        matcher = build_matcher(vectors, groups=groups, backend=backend)
+        build_s = time.perf_counter() - t0
+        samples, agree = [], 0
+        for i, probe in enumerate(probes):
+            t0 = time.perf_counter()
+            found, dist, _ = matcher.search_groups(probe, k=2)
+            classify_match(dist)
+            samples.append(time.perf_counter() - t0)
+            if reference is not None:
+                agree += found[:1].tolist() == reference[i].tolist()
+        extra = {"top1_agreement": round(agree / len(probes), 4)} if backend in QUANTIZED_BACKENDS else {}
+        results.append(summarise("compare", samples, n=n, backend=matcher.backend, **extra))
+        results.append(summarise("matcher_build", [build_s], n=n, backend=matcher.backend))
+    return results
+
+
+def bench_decode(repeat):
+    results = []
+    source = next((p for p in SAMPLE_FACES if os.path.exists(p)), None)
+    base = Image.open(source).convert("RGB") if source else Image.new("RGB", (640, 480), "gray")
+    for w, h in DECODE_RESOLUTIONS:
+        out = io.BytesIO()
+        base.resize((w, h)).save(out, format="JPEG", quality=90)
+        data = out.getvalue()
+        samples, _ = timed(lambda: np.array(Image.open(io.BytesIO(data)).convert("RGB")), repeat)
+        results.append(summarise("decode", samples, width=w, height=h, bytes=len(data)))
+        samples, _ = timed(lambda: decode_upload(data, "image/jpeg"), repeat)
+        results.append(summarise("decode_draft", samples, width=w, height=h, bytes=len(data)))
+    return results
+
+
+def bench_encode(repeat, detectors):
+    try:
+        import face_recognition  # noqa: F401
+    except ImportError:
+        return [{"name": "encode", "skipped": "face_recognition not installed"}]
+    from encoding_pool import _detect_and_encode
+
+    results = []
+    for path in SAMPLE_FACES:
+        if not os.path.exists(path):
+            continue
+        frame = np.array(Image.open(path).convert("RGB"))
+        for detector in detectors:
+            _detect_and_encode(frame, detector)  # warm-up (model load)
+            samples, (encodings, _) = timed(lambda: _detect_and_encode(frame, detector), repeat)
+            results.append(summarise("encode", samples, image=os.path.basename(path), detector=detector,
+                                     height=frame.shape[0], width=frame.shape[1], faces=len(encodings)))
+    return results
+
+
+# --- Runner ---
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def result_key(r):
+    return r["name"], json.dumps(r.get("params", {}), sort_keys=True)
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"] if "p50_ms" in r}
+    print(f"\n{'benchmark':<58} {'base p50':>10} {'now p50':>10} {'change':>8}")
+    for r in current:
+        old = baseline.get(result_key(r))
+        if old is None or "p50_ms" not in r:
+            continue
+        change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        label = f"{r['name']} {r['params']}"
+        print(f"{label[:58]:<58} {old['p50_ms']:>10.3f} {r['p50_ms']:>10.3f} {change:>+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-process biometric hot-path benchmarks")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated gallery sizes (synthetic templates)")
+    parser.add_argument("--max-io-size", type=int, default=100_000,
+                        help="largest N for the JSON/store/refresh benchmarks (disk + RAM bound)")
+    parser.add_argument("--queries", type=int, default=200, help="probes per compare benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions for load/refresh/decode/encode")
+    parser.add_argument("--backends", default="exact,ivf,int8,float16", help="matcher backends to compare")
+    parser.add_argument("--detectors", default="hog,opencv", help="detectors for the encode benchmark")
+    parser.add_argument("--skip", default="", help="comma-separated benchmark names to skip")
+    parser.add_argument("--output", default=None, help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", default=None, help="baseline JSON to diff p50 against")
+    args = parser.parse_args(argv)
+
+    skip = set(filter(None, args.skip.split(",")))
+    backends = [b for b in args.backends.split(",") if b]
+    results = []
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for n in (int(s) for s in args.sizes.split(",") if s):
+            print(f"[BENCH] N={n}", file=sys.stderr)
+            vectors, metadata = synthetic_gallery(n)
+            if n <= args.max_io_size:
+                if "cache_json_load" not in skip:
+                    results.append(bench_cache_json_load(n, vectors, metadata, workdir, args.repeat))
+                if "refresh" not in skip:
+                    store_results, _ = bench_store(n, vectors, metadata, workdir, args.repeat)
+                    results.extend(store_results)
+            if "compare" not in skip:
+                results.extend(bench_compare(n, vectors, metadata, args.queries, backends))
+            del vectors, metadata
+        if "decode" not in skip:
+            results.extend(bench_decode(args.repeat * 4))
+        if "encode" not in skip:
+            results.extend(bench_encode(args.repeat, [d for d in args.detectors.split(",") if d]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": environment(), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"[BENCH] Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import io
 import asyncio
 import subprocess
 import signal
@@ -6,25 +5,43 @@ import sys
 import socket
 import time
 import os
+IMPORT_STARTED = time.perf_counter()
+import importlib.util
+import threading
 import numpy as np
-import google.generativeai as genai
-try:
-    from bleak import BleakClient, BleakScanner
-    HAS_BLE = True
-except ImportError:
-    HAS_BLE = False
+# bleak and google.generativeai are imported on first use / by the start-up phases (slow imports)
+HAS_BLE = importlib.util.find_spec("bleak") is not None
+if not HAS_BLE:
     print("[WARNING] Bleak not found. BLE features will be disabled.")
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import face_recognition
-from supabase_client import supabase
+from fastapi.responses import JSONResponse, PlainTextResponse
+from supabase_client import supabase, get_client as get_supabase_client
+from encoding_pool import EncodingEngine, EngineBusy
+from face_detection import RoiTracker, parse_face_box, scale_box
+from image_decode import DecodeError, decode_upload, encode_jpeg
+from liveness import LivenessPipeline
+from pending_log import PendingLogQueue
+from log_writer import AccessLogWriter
+from ble_manager import BleakTransport, DoorLink
+from attendance_client import AttendanceClient
+from photo_upload import PhotoUploader
+from bulk_enroll import load_job, run_bulk_enrollment
+from startup import Startup
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, VerifyTrace
+from template_store import FaceTemplateStore, MAX_TEMPLATES_PER_EMPLOYEE
+from gallery import Gallery, GallerySnapshot
+from matcher import AMBIGUITY_GAP, CONFLICT_THRESHOLD, CONFLICT_TOP_K, MATCH_THRESHOLD, classify_match
+from template_sync import SyncState, fetch_all_templates, fetch_latest_deletion_mark, fetch_template_changes
+from partitions import DEFAULT_DEVICE_ID, PartitionState, Partitions, UnknownDevice
+from sessions import SessionTracker
 from datetime import datetime
 import json
 import uuid
 import os
-import httpx
 
 # Disable TensorFlow logging for cleaner output
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -42,59 +59,88 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure Gemini AI for Liveness Detection
+startup = Startup()
+
+# Configure Gemini AI for Liveness Detection (model attached by the "liveness" start-up phase)
 GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GEMINI_API_KEY:
+liveness = LivenessPipeline(model=None)
+
+def load_liveness_model():
+    if not GEMINI_API_KEY:
+        print("⚠️ GOOGLE_API_KEY not found. Liveness detection will be disabled.")
+        return
+    import google.generativeai as genai
     genai.configure(api_key=GEMINI_API_KEY)
-    liveness_model = genai.GenerativeModel('gemini-1.5-flash')
-else:
-    liveness_model = None
-    print("⚠️ GOOGLE_API_KEY not found. Liveness detection will be disabled.")
-
-async def check_liveness(image_bytes):
-    """Uses Gemini to detect if the subject is a real human or a photo/screen."""
-    if not liveness_model:
-        return True, "Disabled"
-    
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        prompt = (
-            "Analyze this security camera image. Is this a live, 3D physical human being "
-            "standing in front of the camera? Or is it a 2D photograph, a digital screen, "
-            "or a mask being held up to the camera? "
-            "Reply 'READY' if it is a definite live human. "
-            "Reply 'SPOOF' if you detect a screen, photo, or suspicious 2D artifact."
-        )
-        response = liveness_model.generate_content([prompt, img])
-        result = response.text.strip().upper()
-        
-        if "READY" in result:
-            return True, "Live Human Detected"
-        else:
-            return False, "Potential Spoofing Detected"
-    except Exception as e:
-        print(f"❌ Gemini Liveness Error: {e}")
-        return True, "Error-Skipped" # Fail open for reliability, but log error
+    liveness.model = genai.GenerativeModel('gemini-1.5-flash')
+
+async def check_liveness(image, device_id=DEFAULT_DEVICE_ID, embedding=None):
+    """Uses Gemini to detect if the subject is a real human or a photo/screen (see liveness.py)."""
+    return await liveness.check(image, device_id=device_id, embedding=embedding)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize system components and background tasks."""
     print("[STARTUP] Initializing Biometric Engine...")
     
-    # 1. Load initial cache from disk immediately
-    refresh_in_memory_cache()
+    # 1. Load the gallery, warm the encoder and attach optional clients in the background (see startup.py)
+    startup.start([
+        ("gallery", load_gallery, True),
+        ("encoder", encoder.warm_up, True),
+        ("liveness", load_liveness_model, False),
+        ("supabase", get_supabase_client, False),
+        ("door_link", start_door_link, False),
+    ])
     
     # 2. Start background synchronization tasks
+    access_log_writer.start()
+    attendance.start()
     asyncio.create_task(sync_task())
+    asyncio.create_task(session_reaper())
     # asyncio.create_task(ble_status_updater()) # Disabled in cloud - handled by Mobile App
-    print("[STARTUP] System ready.")
+    print("[STARTUP] Serving; /ready reports warm-up progress.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await startup.stop()
+    encoder.shutdown()
+    liveness.shutdown()
+    partition_warmer.shutdown(wait=False)
+    await access_log_writer.stop()
+    await attendance.close()
+    await photo_uploader.stop()
+    if door_link:
+        await door_link.stop()
+    pending_logs.close()
 
 CACHE_FILE = "face_cache.json"
-PENDING_LOGS_FILE = "pending_logs.json"
+PENDING_LOGS_FILE = "pending_logs.json" # Legacy format, imported once into the journal
+PENDING_LOGS_PREFIX = os.getenv("PENDING_LOGS_PATH", "pending_logs")
 MODEL_NAME = "face-recognition-default" 
-DETECTOR_BACKEND = "opencv" # Faster for real-time door lock response
+
+BATCH_MAX_FRAMES = int(os.getenv("BATCH_MAX_FRAMES", 8))
+
+# --- Face Encoding Worker Pool ---
+encoder = EncodingEngine()
+roi_tracker = RoiTracker() # Per-device face box reused as the next frame's detection ROI
+sessions = SessionTracker() # Per-device fusion of the frames of one approach (see sessions.py)
+
+def bad_image_response(error: DecodeError):
+    return {"success": False, "message": f"Invalid image: {error}", "error_code": "BAD_IMAGE"}
+
+async def decode_in_executor(contents, content_type):
+    """Decode one upload off the event loop (see image_decode.py)."""
+    return await asyncio.get_running_loop().run_in_executor(None, decode_upload, contents, content_type)
+
+def engine_busy_response(busy: EngineBusy):
+    """503 with Retry-After so terminals back off instead of piling onto the queue."""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(busy.retry_after)},
+        content={"success": False, "message": "Engine busy, please retry.", "error_code": "ENGINE_BUSY"}
+    )
 
 def load_face_cache():
+    """Legacy JSON cache reader, kept for one-time migration into the template store."""
     if os.path.exists(CACHE_FILE):
         with open(CACHE_FILE, "r") as f:
             return json.load(f)
@@ -104,179 +150,311 @@ def save_face_cache(data):
     with open(CACHE_FILE, "w") as f:
         json.dump(data, f)
 
-# --- Optimized Vector Cache ---
-IN_MEMORY_CACHE = []
-FACE_VECTORS = np.array([])
-FACE_METADATA = []
+# --- Binary Template Store ---
+TEMPLATE_STORE_PATH = os.getenv("TEMPLATE_STORE_PATH", "face_templates")
+template_store = FaceTemplateStore(TEMPLATE_STORE_PATH)
+
+def migrate_legacy_cache():
+    """Import face_cache.json into an empty template store (first boot after upgrade)."""
+    # Under gallery.lock like every other store writer, so a register or sync
+    # landing during start-up cannot be wiped by replace_all.
+    with gallery.lock:
+        if len(template_store) == 0 and os.path.exists(CACHE_FILE):
+            imported = template_store.replace_all(load_face_cache())
+            print(f"[CACHE] Migrated {imported} templates from {CACHE_FILE} to binary store.")
+
+# --- Optimized Vector Cache (immutable snapshots, see gallery.py) ---
+# With MATCHER_BACKEND=int8|float16 the float32 rows are memory-mapped next to the store.
+gallery = Gallery(rerank_prefix=TEMPLATE_STORE_PATH)
+# Per-site / per-door scopes over the gallery (see partitions.py)
+partitions = Partitions(PartitionState(f"{TEMPLATE_STORE_PATH}.partitions.json"))
+
+# Scopes are pre-built on one background thread, never under gallery.lock, and
+# back-to-back publishes (bulk registers, delta patches) coalesce into one pass.
+partition_warmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="partition-warm")
+partition_warm_queued = threading.Event()
+
+def _warm_partitions():
+    partition_warm_queued.clear()
+    try:
+        partitions.warm(gallery.current)
+    except Exception as e:
+        print(f"[WARNING] Partition warm-up failed: {e}")
+
+def warm_partitions():
+    if not partition_warm_queued.is_set():
+        partition_warm_queued.set()
+        partition_warmer.submit(_warm_partitions)
 
 def refresh_in_memory_cache():
-    global IN_MEMORY_CACHE, FACE_VECTORS, FACE_METADATA
+    """Build a fresh snapshot from the template store and publish it (safe to call off the loop)."""
     try:
-        raw_cache = load_face_cache()
-        parsed_metadata = []
-        vectors = []
-        
-        for emp in raw_cache:
-            emb = emp.get("face_embedding")
-            if isinstance(emb, str):
-                try: emb = json.loads(emb)
-                except: continue
-            
-            if emb and isinstance(emb, list) and len(emb) == 128:
-                vec = np.array(emb, dtype=np.float32)
-                # Ensure unit vector for cosine similarity via dot product
-                norm = np.linalg.norm(vec)
-                if norm > 0:
-                    vec = vec / norm
-                
-                vectors.append(vec)
-                parsed_metadata.append({
-                    "id": emp.get("id"),
-                    "employee_id": emp.get("employee_id"),
-                    "name": emp.get("name"),
-                    "role": emp.get("role")
-                })
-        
-        if vectors:
-            FACE_VECTORS = np.array(vectors, dtype=np.float32)
-            FACE_METADATA = parsed_metadata
-            IN_MEMORY_CACHE = raw_cache # Keep for compatibility if needed
-            print(f"[CACHE] Optimized cache loaded with {len(FACE_METADATA)} employees.")
+        with gallery.lock:
+            snapshot = GallerySnapshot.build(template_store.iter_vectors(), template_store.metadata(),
+                                             gallery.next_version(), previous=gallery.current)
+            gallery.publish(snapshot)
+            warm_partitions()
+        if len(snapshot):
+            print(f"[CACHE] Optimized cache loaded with {len(snapshot)} templates ({snapshot.matcher.backend} matcher, v{snapshot.version}).")
         else:
-            FACE_VECTORS = np.array([])
-            FACE_METADATA = []
             print("[CACHE] Cache is empty.")
-            
     except Exception as e:
         print(f"[ERROR] In-memory cache refresh failed: {e}")
 
+def load_gallery():
+    """Start-up phase: import a legacy JSON cache if needed, then publish the first snapshot."""
+    migrate_legacy_cache()
+    refresh_in_memory_cache()
+
+def patch_in_memory_cache(upserts, deletions):
+    """Publish a copy-on-write snapshot with delta-sync changes applied, without reloading the store."""
+    with gallery.lock:
+        current = gallery.current
+        if len(current) == 0:
+            return refresh_in_memory_cache()
+        snapshot = current.patched(upserts, deletions, gallery.next_version())
+        if len(snapshot) == 0:
+            return refresh_in_memory_cache()
+        gallery.publish(snapshot)
+        warm_partitions()
+
+def add_local_template(employee_id, embedding, name, role, template_id):
+    """Add a template to the store and republish the gallery (runs on a worker thread)."""
+    with gallery.lock:
+        template_store.add(employee_id, embedding, name=name, role=role, template_id=template_id)
+        refresh_in_memory_cache()
+
+def add_local_templates(records):
+    """Bulk variant of add_local_template: many store writes, one gallery rebuild."""
+    with gallery.lock:
+        for rec in records:
+            template_store.add(rec["employee_id"], rec["face_embedding"], name=rec.get("name"),
+                               role=rec.get("role"), template_id=rec.get("template_id"))
+        refresh_in_memory_cache()
+
+def delete_local_templates(employee_id):
+    with gallery.lock:
+        template_store.delete(employee_id)
+        refresh_in_memory_cache()
+
+# --- Delta Sync of face_templates ---
+sync_state = SyncState(f"{TEMPLATE_STORE_PATH}.sync.json")
+FULL_SYNC_EVERY = int(os.getenv("TEMPLATE_FULL_SYNC_EVERY", 60)) # Cycles between full reconciles
+
+def full_template_refresh(allow_empty=True):
+    """Pull every face_template, rewrite the local store and reset the delta marks."""
+    # Take the deletion mark first so deletes racing the full pull are replayed next cycle.
+    try:
+        deletions_mark = fetch_latest_deletion_mark(supabase)
+    except Exception:
+        deletions_mark = None
+    records, templates_mark = fetch_all_templates(supabase)
+    if records or allow_empty:
+        with gallery.lock:
+            template_store.replace_all(records)
+            refresh_in_memory_cache()
+    if templates_mark is None or deletions_mark is None:
+        sync_state.reset()
+    else:
+        sync_state.templates_since = templates_mark
+        sync_state.deletions_since = deletions_mark
+        sync_state.save()
+    return len(records)
+
+def delta_template_sync():
+    """Fetch only face_templates changed since the last mark, patch the store and publish a new snapshot."""
+    upserts, deletions, templates_mark, deletions_mark = fetch_template_changes(supabase, sync_state)
+
+    with gallery.lock:
+        # Deletions first: an employee-wide delete followed by a re-enrollment must keep the new template.
+        removed = []
+        for d in deletions:
+            if d["template_id"] is None:
+                dropped = template_store.delete(d["employee_id"])
+            else:
+                dropped = template_store.delete_template(d["template_id"])
+            if dropped:
+                removed.append(d)
+
+        changed = []
+        for rec in upserts:
+            current = template_store.get_template(rec["template_id"])
+            if current and rec.get("updated_at") and current.get("updated_at") == rec["updated_at"]:
+                continue # Boundary row re-read by the inclusive mark, already applied
+            try:
+                # The database prunes to MAX_TEMPLATES_PER_EMPLOYEE, so mirror it without a local cap.
+                template_store.add(rec["employee_id"], rec["face_embedding"], name=rec["name"], role=rec["role"],
+                                   updated_at=rec["updated_at"], template_id=rec["template_id"], max_templates=None)
+                changed.append(rec)
+            except ValueError as e:
+                print(f"[WARNING] Skipping template during delta sync: {e}")
+
+        if changed or removed:
+            patch_in_memory_cache(changed, removed)
+    sync_state.templates_since = templates_mark
+    sync_state.deletions_since = deletions_mark
+    sync_state.save()
+    return len(changed), len(removed)
+
+def save_face_template(biometric_data):
+    """
+    Insert a new face_templates row and prune the employee's oldest templates
+    beyond MAX_TEMPLATES_PER_EMPLOYEE. Returns the new template id.
+    """
+    employee_id = biometric_data["employee_id"]
+    try:
+        response = supabase.table("face_templates").insert(biometric_data).execute()
+    except Exception as e:
+        err_str = str(e).lower()
+        if "duplicate" not in err_str and "unique" not in err_str:
+            raise
+        # Pre-migration_v7 schema still allows a single template per employee
+        response = supabase.table("face_templates").upsert(biometric_data, on_conflict="employee_id").execute()
+        return response.data[0].get("id") if response.data else None
+
+    template_id = response.data[0].get("id") if response.data else None
+    try:
+        rows = supabase.table("face_templates") \
+            .select("id") \
+            .eq("employee_id", employee_id) \
+            .order("updated_at", desc=True) \
+            .execute().data or []
+        stale = [r["id"] for r in rows[MAX_TEMPLATES_PER_EMPLOYEE:]]
+        if stale:
+            supabase.table("face_templates").delete().in_("id", stale).execute()
+    except Exception as prune_err:
+        print(f"[WARNING] Template pruning failed for {employee_id}: {str(prune_err)}")
+    return template_id
+
+def upload_face_photo(path, data):
+    # upsert makes a retry after an ambiguous failure (stored, response lost) succeed
+    supabase.storage.from_("biometrics").upload(
+        path=path,
+        file=data,
+        file_options={"content-type": "image/jpeg", "upsert": "true"}
+    )
+
+def remove_face_photo(path):
+    supabase.storage.from_("biometrics").remove([path])
+
+def public_photo_url(path):
+    try:
+        return str(supabase.storage.from_("biometrics").get_public_url(path))
+    except Exception as url_err:
+        print(f"[WARNING] Could not resolve photo URL (Offline?): {str(url_err)}")
+        return ""
+
+photo_uploader = PhotoUploader(upload_face_photo, remove=remove_face_photo)
+
+pending_logs = PendingLogQueue(PENDING_LOGS_PREFIX, legacy_path=PENDING_LOGS_FILE)
+VALID_LOG_COLUMNS = {'id', 'employee_id', 'status', 'confidence', 'device_id', 'created_at', 'method'}
+
 def queue_pending_log(log_data):
-    logs = []
-    if os.path.exists(PENDING_LOGS_FILE):
-        with open(PENDING_LOGS_FILE, "r") as f:
-            try: logs = json.load(f)
-            except: logs = []
-    logs.append(log_data)
-    with open(PENDING_LOGS_FILE, "w") as f:
-        json.dump(logs, f)
-
-async def mark_attendance_async(employee_id: str):
-    """Notify the attendance service about a successful scan."""
-    backend_url = os.getenv("BACKEND_URL", "http://localhost:8000")
-    if not backend_url.startswith("http://") and not backend_url.startswith("https://"):
-        backend_url = f"http://{backend_url}"
-    
+    pending_logs.append(log_data)
+
+def insert_access_logs(rows):
+    """Idempotent insert keyed by the client-generated id, so replayed chunks never duplicate rows."""
+    rows = [{k: v for k, v in r.items() if k in VALID_LOG_COLUMNS} for r in rows]
     try:
-        async with httpx.AsyncClient() as client:
-            print(f"[Attendance] Sending mark request for {employee_id} to {backend_url}...")
-            response = await client.post(
-                f"{backend_url}/attendance/mark",
-                json={
-                    "employee_id": employee_id,
-                    "method": "face",
-                    "device_id": "office_terminal"
-                },
-                timeout=5.0
-            )
-            print(f"[Attendance] Service responded: {response.text}")
+        supabase.table("access_logs").upsert(rows, on_conflict="id", ignore_duplicates=True).execute()
     except Exception as e:
-        print(f"[Attendance] API call failed: {str(e)}")
+        if "method" not in str(e).lower():
+            raise
+        # Fallback for missing 'method' column
+        clean = [{k: v for k, v in r.items() if k != "method"} for r in rows]
+        supabase.table("access_logs").upsert(clean, on_conflict="id", ignore_duplicates=True).execute()
+
+def mark_attendance_async(employee_id: str, device_id: str):
+    """Notify the attendance service about a successful scan at ``device_id`` (queued on the shared client)."""
+    attendance.submit(employee_id, device_id)
+
+def spill_access_logs(records):
+    for rec in records:
+        pending_logs.append(rec, sync=False)
+    pending_logs.sync()
 
-async def background_log_access(employee_id, status, confidence, device_id):
+access_log_writer = AccessLogWriter(insert_access_logs, spill_access_logs)
+
+def background_log_access(employee_id, status, confidence, device_id):
     """
-    Log an access attempt to Supabase immediately.
+    Queue an access attempt for the batched Supabase writer (never blocks the request).
     """
-    log_data = {
+    access_log_writer.submit({
+        "id": str(uuid.uuid4()),
         "employee_id": employee_id,
         "status": status,
         "confidence": float(confidence),
         "device_id": device_id,
         "created_at": datetime.utcnow().isoformat(),
         "method": "face"
-    }
-    try:
-        supabase.table("access_logs").insert(log_data).execute()
-        print(f"[LOG] Access log synced for {employee_id}")
-    except Exception as e:
-        err_str = str(e).lower()
-        if "method" in err_str:
-            # Fallback for missing 'method' column
-            try:
-                smaller = {k: v for k, v in log_data.items() if k != "method"}
-                supabase.table("access_logs").insert(smaller).execute()
-                print(f"[LOG] Access log synced (no method) for {employee_id}")
-            except Exception as e2:
-                print(f"[ERROR] Final logging failure: {e2}")
-                queue_pending_log(log_data)
-        else:
-            print(f"[WARNING] Sync failed, queuing log: {e}")
-            queue_pending_log(log_data)
+    })
 
 async def sync_task():
-    """Background task to sync logs and refresh cache."""
+    """Background task to sync logs and refresh cache (network + snapshot builds run off the loop)."""
+    loop = asyncio.get_running_loop()
+    cycle = 0
     while True:
+        # 1. Drain the pending-log journal in idempotent chunks
         try:
-            # 1. Sync Pending Logs (strip any unknown columns before inserting)
-            VALID_LOG_COLUMNS = {'employee_id', 'status', 'confidence', 'device_id', 'created_at', 'method'}
-            if os.path.exists(PENDING_LOGS_FILE):
-                with open(PENDING_LOGS_FILE, "r") as f:
-                    try:
-                        pending = json.load(f)
-                    except:
-                        pending = []
-                
-                if pending:
-                    print(f"Syncing {len(pending)} pending logs to Supabase...")
-                    # Try syncing with 'method' first
-                    try:
-                        supabase.table("access_logs").insert(pending).execute()
-                        os.remove(PENDING_LOGS_FILE)
-                        print(f"[SUCCESS] {len(pending)} pending logs synced.")
-                    except Exception as e:
-                        err_str = str(e).lower()
-                        if "method" in err_str:
-                            clean = [{k: v for k, v in l.items() if k != 'method'} for l in pending]
-                            try:
-                                supabase.table("access_logs").insert(clean).execute()
-                                os.remove(PENDING_LOGS_FILE)
-                                print(f"[SUCCESS] {len(pending)} logs synced (fallback mode).")
-                            except Exception as e2:
-                                print(f"[ERROR] Sync retry failed: {e2}")
-                        else:
-                            print(f"[ERROR] Sync failed: {e}")
-            
-            # 2. Refresh Cache from normalized face_templates
-            print("[SYNC] Refreshing biometric cache from face_templates...")
-            response = supabase.table("face_templates") \
-                .select("employee_id, embedding, employees(name, role)") \
-                .execute()
-            
-            if response.data:
-                # Transform to the format expected by save_face_cache
-                flat_data = []
-                for entry in response.data:
-                    emp_meta = entry.get("employees", {})
-                    flat_data.append({
-                        "employee_id": entry.get("employee_id"),
-                        "face_embedding": entry.get("embedding"),
-                        "name": emp_meta.get("name"),
-                        "role": emp_meta.get("role")
-                    })
-                save_face_cache(flat_data)
-                refresh_in_memory_cache()
-                print(f"[SUCCESS] Biometric cache refreshed: {len(flat_data)} templates.")
+            sent = await loop.run_in_executor(None, pending_logs.flush, insert_access_logs)
+            PENDING_LOGS_SYNCED.inc(sent)
+            SYNC_RUNS.inc(kind="pending_logs", result="ok")
+            if sent:
+                print(f"[SUCCESS] {sent} pending logs synced.")
+        except Exception as e:
+            SYNC_RUNS.inc(kind="pending_logs", result="error")
+            print(f"[ERROR] Pending log sync stopped ({len(pending_logs)} queued): {e}")
 
+        # 2. Refresh Cache from normalized face_templates (delta when possible)
+        kind = "full" if not sync_state.ready or cycle % FULL_SYNC_EVERY == 0 else "delta"
+        try:
+            if kind == "full":
+                print("[SYNC] Full refresh of biometric cache from face_templates...")
+                count = await loop.run_in_executor(None, full_template_refresh, False)
+                print(f"[SUCCESS] Biometric cache refreshed: {count} templates.")
+            else:
+                changed, removed = await loop.run_in_executor(None, delta_template_sync)
+                SYNC_CHANGES.inc(changed, op="upsert")
+                SYNC_CHANGES.inc(removed, op="delete")
+                if changed or removed:
+                    print(f"[SUCCESS] Delta sync applied: {changed} changed, {removed} removed.")
+            SYNC_RUNS.inc(kind=kind, result="ok")
+            SYNC_LAST_SUCCESS.set(time.time(), kind=kind)
         except Exception as e:
+            SYNC_RUNS.inc(kind=kind, result="error")
             print(f"[WARNING] Sync failed (likely offline): {str(e)}")
 
+        # 3. Device -> partition map and partition membership (delta between full reconciles)
+        try:
+            changed = await loop.run_in_executor(None, partitions.sync, supabase, kind == "full")
+            if changed:
+                warm_partitions()
+                print(f"[SUCCESS] Partition sync applied: {changed} changes ({partitions.index.stats()}).")
+            SYNC_RUNS.inc(kind="partitions", result="ok")
+        except Exception as e:
+            SYNC_RUNS.inc(kind="partitions", result="error")
+            print(f"[WARNING] Partition sync failed: {str(e)}")
+
+        cycle += 1
         await asyncio.sleep(60) # Sync every 60 seconds
 
+async def session_reaper():
+    """End idle verify sessions so the aggregated log of an unaccepted approach is written promptly."""
+    while True:
+        await asyncio.sleep(sessions.idle_timeout)
+        try:
+            finish_sessions(sessions.expire())
+        except Exception as e:
+            print(f"[WARNING] Session sweep failed: {e}")
+
 # --- Environment Loader ---
 from dotenv import load_dotenv
 # Try loading from local, then parent (for shared config)
 load_dotenv()
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", "backend", ".env"))
 
+attendance = AttendanceClient(os.getenv("BACKEND_URL", "http://localhost:8000"))
+
 BLE_MAC = os.getenv("ESP32_BLE_MAC", "58:8C:81:CC:65:29")
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
 
@@ -298,8 +476,13 @@ async def ble_status_updater():
     global _last_ble_status
     while True:
         try:
-            # We don't use the lock here but check it to avoid interfering with active commands
-            if not ble_lock.locked():
+            # We don't use the lock here but check it to avoid interfering with active commands.
+            # A connected door stops advertising, so the persistent link is the status source then.
+            if door_link and door_link.connected:
+                _last_ble_status["online"] = True
+                _last_ble_status["timestamp"] = time.time()
+            elif not ble_lock.locked():
+                from bleak import BleakScanner
                 device = await BleakScanner.find_device_by_address(BLE_MAC, timeout=4.0)
                 if device:
                     print(f"[BLE] Device {BLE_MAC} found (RSSI: {getattr(device, 'rssi', 'N/A')})")
@@ -317,19 +500,23 @@ async def ble_status_updater():
             print(f"[BLE] Background status update failed: {e}")
         await asyncio.sleep(8)
 
+door_link = DoorLink(BleakTransport(BLE_MAC, CHARACTERISTIC_UUID)) if HAS_BLE else None
+
+async def start_door_link():
+    """Start-up phase: connect now so the first unlock after a boot skips the BLE scan + connect."""
+    if door_link is not None:
+        await door_link.connect_now()
+
 async def run_ble_op(command: str):
-    """Internal helper to send a command to the ESP32."""
+    """Internal helper to send a command to the ESP32 over the persistent link."""
     if not HAS_BLE:
+        BLE_OPS.inc(command=command, result="disabled")
         return {"success": False, "message": "Bluetooth features are disabled in this environment."}
-    async with ble_lock:
-        try:
-            async with BleakClient(BLE_MAC, timeout=10.0) as client:
-                if not client.is_connected:
-                    return {"success": False, "message": "Failed to connect to door hardware"}
-                await client.write_gatt_char(CHARACTERISTIC_UUID, command.encode(), response=True)
-                return {"success": True, "message": f"Command {command} executed"}
-        except Exception as e:
-            return {"success": False, "message": str(e)}
+    t0 = time.perf_counter()
+    result = await door_link.send(command)
+    BLE_OPS.inc(command=command, result="ok" if result["success"] else "error")
+    BLE_OP_SECONDS.observe(time.perf_counter() - t0, command=command)
+    return result
 
 @app.post("/api/door/unlock")
 async def unlock_door_endpoint():
@@ -361,13 +548,14 @@ async def lock_door_endpoint():
 async def door_status_endpoint():
     """Returns the cached BLE status maintained by the background task."""
     return {
-        "online": _last_ble_status["online"],
+        "online": _last_ble_status["online"] or bool(door_link and door_link.connected),
         "isLocked": _is_locked,
-        "isConnected": _last_ble_status["online"],
+        "isConnected": bool(door_link and door_link.connected) or _last_ble_status["online"],
         "mac": BLE_MAC,
         "name": _last_ble_status["name"],
         "rssi": _last_ble_status["rssi"],
-        "last_seen": int(time.time() - _last_ble_status["timestamp"]) if _last_ble_status["timestamp"] > 0 else -1
+        "last_seen": int(time.time() - _last_ble_status["timestamp"]) if _last_ble_status["timestamp"] > 0 else -1,
+        "link": door_link.metrics() if door_link else None
     }
 
 @app.get("/api/door/scan")
@@ -375,6 +563,7 @@ async def door_scan_endpoint():
     if not HAS_BLE:
         return {"success": False, "message": "Bluetooth scanning disabled."}
     async with ble_lock: # Prevent conflict with other BLE operations
+        from bleak import BleakScanner
         devices = await BleakScanner.discover(timeout=5.0)
         return [{
             "name": d.name or "Unknown",
@@ -388,9 +577,53 @@ async def scan_compatibility_endpoint():
     devices = await door_scan_endpoint()
     return {"success": True, "devices": devices}
 
+# --- Metrics (see metrics.py) ---
+SYNC_RUNS = REGISTRY.counter("sync_runs_total", "Background sync runs by kind and result.", ("kind", "result"))
+SYNC_CHANGES = REGISTRY.counter("template_sync_changes_total", "Templates applied by delta sync.", ("op",))
+SYNC_LAST_SUCCESS = REGISTRY.gauge("sync_last_success_timestamp_seconds", "Unix time of the last successful sync.", ("kind",))
+PENDING_LOGS_SYNCED = REGISTRY.counter("pending_logs_synced_total", "Access logs replayed from the pending journal.")
+BLE_OPS = REGISTRY.counter("ble_ops_total", "Door commands by result.", ("command", "result"))
+BLE_OP_SECONDS = REGISTRY.histogram("ble_op_seconds", "Door command latency including any reconnect.", ("command",))
+REGISTRY.callback("pending_logs_backlog", "Access logs waiting in the offline journal.", lambda: len(pending_logs))
+REGISTRY.callback("access_log_queue_depth", "Access logs buffered for the batched writer.", lambda: access_log_writer.pending())
+REGISTRY.callback("access_log_records_total", "Access log records by writer result.",
+                  lambda: {(k,): access_log_writer.stats[k] for k in ("inserted", "spilled")}, ("result",), kind="counter")
+REGISTRY.callback("gallery_templates", "Templates in the published gallery snapshot.", lambda: len(gallery.current))
+REGISTRY.callback("gallery_employees", "Employees in the published gallery snapshot.", lambda: gallery.current.employee_count())
+REGISTRY.callback("gallery_version", "Version of the published gallery snapshot.", lambda: gallery.current.version)
+REGISTRY.callback("verify_sessions_active", "Devices with an open verify session.", lambda: len(sessions))
+REGISTRY.callback("verify_sessions_total", "Verify session events (started, accepted, skipped_frames, ended).",
+                  lambda: {(k,): v for k, v in sessions.stats.items()}, ("event",), kind="counter")
+REGISTRY.callback("partition_devices", "Devices mapped to gallery partitions.", lambda: len(partitions.index.devices))
+REGISTRY.callback("partition_scope_cache", "Partition scopes built for the current snapshot.", lambda: partitions.stats()["cached_scopes"])
+REGISTRY.callback("encoder_pending", "Encode jobs running or queued.", lambda: encoder.stats()["pending"])
+REGISTRY.callback("encoder_rejected_total", "Encode jobs rejected with 503.", lambda: encoder.rejected, kind="counter")
+REGISTRY.callback("encoder_restarts_total", "Encoder pools replaced after a worker died.", lambda: encoder.restarts, kind="counter")
+REGISTRY.callback("liveness_checks_total", "Liveness checks by result.",
+                  lambda: {(k,): v for k, v in liveness.stats.items()}, ("result",), kind="counter")
+REGISTRY.callback("attendance_marks_total", "Attendance marks by result.",
+                  lambda: {(k,): attendance.stats[k] for k in ("sent", "failed", "retried", "dropped")}, ("result",), kind="counter")
+REGISTRY.callback("photo_uploads_total", "Enrolment photo uploads by result.",
+                  lambda: {(k,): v for k, v in photo_uploader.stats.items()}, ("result",), kind="counter")
+REGISTRY.callback("engine_ready", "1 once the start-up phases have completed.", lambda: int(startup.ready))
+REGISTRY.callback("startup_phase_seconds", "Wall time of each start-up phase.",
+                  lambda: {(n,): p["seconds"] for n, p in startup.phases.items() if p["seconds"] is not None}, ("phase",))
+REGISTRY.callback("ble_link_connected", "1 while the persistent door link is up.",
+                  lambda: int(bool(door_link and door_link.connected)))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of verify latencies, sync, queues, BLE and gallery state."""
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
-    return {"status": "ready", "engine": "face-recognition", "model": "HOG/CNN", "timestamp": datetime.utcnow()}
+    return {"status": "ready", "engine": "face-recognition", "model": "HOG/CNN", "encoder": encoder.stats(), "liveness": liveness.stats, "access_logs": {**access_log_writer.stats, "queued": access_log_writer.pending()}, "attendance": attendance.metrics(), "photo_uploads": {**photo_uploader.stats, "pending": photo_uploader.pending()}, "partitions": partitions.stats(), "sessions": {**sessions.stats, "active": len(sessions)}, "warm": startup.ready, "timestamp": datetime.utcnow()}
+
+@app.get("/ready")
+async def readiness_check():
+    """503 until the gallery is loaded and the encoder workers are warm; body is the start-up report."""
+    return JSONResponse(status_code=200 if startup.ready else 503, content=startup.report())
 
 @app.post("/api/biometrics/face/register")
 async def register_face(
@@ -402,97 +635,77 @@ async def register_face(
 ):
     """
     Register a face encoding for a specific employee.
-    Uploads photo to Supabase Storage and metadata to Database.
+    The photo upload to Supabase Storage starts right away and overlaps
+    encoding and the conflict guard; the template row and local cache are
+    committed first and the upload finishes (with retry) after we respond.
     """
     print(f"[INFO] Registering face for: {employeeId}")
+    loop = asyncio.get_running_loop()
+    photo_path = None
+    committed = False
     
     try:
-        # 1. Read image
+        # 1. Read + decode image (JPEG draft-mode downscale, raw frames, face chips)
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        frame = np.array(image)
+        try:
+            upload = await decode_in_executor(contents, file.content_type)
+        except DecodeError as e:
+            return bad_image_response(e)
+
+        # 2. Start the Storage upload now so it runs alongside encoding + the guard
+        photo_path = f"faces/{employeeId}_{uuid.uuid4().hex[:8]}.jpg"
+        photo = contents if upload.encoded else await loop.run_in_executor(None, encode_jpeg, upload.frame)
+        photo_uploader.begin(photo_path, photo)
 
-        # 2. Detect and encode using face-recognition
+        # 3. Detect (downscaled) and encode using face-recognition
         try:
-            encodings = face_recognition.face_encodings(frame)
+            encodings, _ = await encoder.detect_and_encode(upload.frame, detector="none" if upload.chip else None)
             if not encodings:
                 return {"success": False, "message": "No face detected.", "error_code": "NO_FACE"}
             encoding_list = encodings[0].tolist()
+        except EngineBusy as busy:
+            return engine_busy_response(busy)
         except Exception as e:
             return {"success": False, "message": f"Engine Error: {str(e)}", "error_code": "ENGINE_ERROR"}
 
-        # 3. Cross-Identity Conflict Guard
-        cache = load_face_cache()
-        if cache:
-            valid_cached = []
-            for emp in cache:
-                emb = emp.get("face_embedding")
-                if isinstance(emb, str):
-                    try: emb = json.loads(emb)
-                    except: continue
-                if emb and isinstance(emb, list) and len(emb) == 128:
-                    emp["face_embedding"] = emb
-                    valid_cached.append(emp)
-
-            if valid_cached:
-                existing_encodings = [np.array(emp["face_embedding"]) for emp in valid_cached]
-                # Calculate Euclidean distances
-                target = np.array(encoding_list)
-                existing_distances = [np.linalg.norm(target - exp) for exp in existing_encodings]
-                
-                min_conflict_dist = np.min(existing_distances)
-                if min_conflict_dist < 0.40:
-                    conflict_idx = np.argmin(existing_distances)
-                    conflicting_emp = valid_cached[conflict_idx]
-                    
-                    # Skip conflict if this is a re-enrollment of the SAME employee
-                    same_employee = (conflicting_emp.get("employee_id") == employeeId)
-                    is_re_enroll = re_enroll.lower() == "true"
-                    
-                    if same_employee or is_re_enroll:
-                        print(f"[INFO] Conflict guard bypassed for re-enrollment of {employeeId}")
-                    else:
-                        print(f"[REJECTED] Biometric Conflict! Face already registered to: {conflicting_emp['name']}")
-                        
-                        # Log security alert
-                        try:
-                            alert_data = {
-                                "alert_type": "biometric_conflict",
-                                "employee_id": employeeId,
-                                "severity": "medium",
-                                "details": {
-                                    "attempted_id": employeeId,
-                                    "conflicting_id": conflicting_emp['employee_id'],
-                                    "conflict_name": conflicting_emp['name'],
-                                    "distance": float(min_conflict_dist)
-                                },
-                                "device_id": "face_engine_01"
-                            }
-                            supabase.table("security_alerts").insert(alert_data).execute()
-                        except Exception as alert_err:
-                            print(f"[WARNING] Failed to log security alert: {str(alert_err)}")
-
-                        return {
-                            "success": False, 
-                            "message": f"Biometric Conflict: This person is already registered as {conflicting_emp['name']}.",
-                            "conflicting_id": conflicting_emp['employee_id']
-                        }
-
-        # 4. Upload Image to Supabase Storage
-        file_path = f"faces/{employeeId}_{uuid.uuid4().hex[:8]}.jpg"
-        image_url = ""
-        
-        try:
-            supabase.storage.from_("biometrics").upload(
-                path=file_path,
-                file=contents,
-                file_options={"content-type": "image/jpeg"}
-            )
-            image_url = str(supabase.storage.from_("biometrics").get_public_url(file_path))
-        except Exception as upload_err:
-            print(f"[WARNING] Storage Upload Failed (Offline?): {str(upload_err)}")
-        
-        # 5. Save Metadata to Normalized face_templates table
+        # 4. Cross-Identity Conflict Guard (same snapshot + matcher as verification)
+        is_re_enroll = re_enroll.lower() == "true"
+        nearest = gallery.current.nearest_employees(encodings[0], k=CONFLICT_TOP_K)
+        conflicts = [c for c in nearest if c["distance"] < CONFLICT_THRESHOLD and c["employee_id"] != employeeId]
+        if conflicts and is_re_enroll:
+            print(f"[INFO] Conflict guard bypassed for re-enrollment of {employeeId}")
+        elif conflicts:
+            conflicting_emp = conflicts[0]
+            print(f"[REJECTED] Biometric Conflict! Face already registered to: {conflicting_emp['name']}")
+
+            # Log security alert
+            try:
+                alert_data = {
+                    "alert_type": "biometric_conflict",
+                    "employee_id": employeeId,
+                    "severity": "medium",
+                    "details": {
+                        "attempted_id": employeeId,
+                        "conflicting_id": conflicting_emp['employee_id'],
+                        "conflict_name": conflicting_emp['name'],
+                        "distance": conflicting_emp['distance'],
+                        "conflicts": conflicts
+                    },
+                    "device_id": "face_engine_01"
+                }
+                await loop.run_in_executor(None, lambda: supabase.table("security_alerts").insert(alert_data).execute())
+            except Exception as alert_err:
+                print(f"[WARNING] Failed to log security alert: {str(alert_err)}")
+
+            return {
+                "success": False, 
+                "message": f"Biometric Conflict: This person is already registered as {conflicting_emp['name']}.",
+                "conflicting_id": conflicting_emp['employee_id'],
+                "conflicts": conflicts
+            }
+
+        # 5. Save Metadata to Normalized face_templates table (one row per template)
+        image_url = await loop.run_in_executor(None, public_photo_url, photo_path)
         biometric_data = {
             "employee_id": employeeId,
             "embedding": json.dumps(encoding_list),
@@ -500,31 +713,22 @@ async def register_face(
         }
 
         try:
-            supabase.table("face_templates").upsert(biometric_data, on_conflict="employee_id").execute()
+            template_id = await loop.run_in_executor(None, save_face_template, biometric_data)
             print(f"[SUCCESS] Registered in face_templates.")
         except Exception as db_err:
             print(f"[WARNING] Database registration failed: {str(db_err)}")
             raise HTTPException(status_code=500, detail=f"Database error: {str(db_err)}")
+        committed = True
 
-        # 6. Always Update Local Cache
-        cache = load_face_cache()
-        # Update or append
-        updated = False
-        local_entry = {
-            "employee_id": employeeId,
-            "face_embedding": encoding_list,
-            "name": name if name else employeeId,
-            "role": "employee" # Fallback if metadata refresh hasn't run
-        }
-        for i, emp in enumerate(cache):
-            if emp["employee_id"] == employeeId:
-                cache[i] = local_entry
-                updated = True
-                break
-        if not updated:
-            cache.append(local_entry)
-        save_face_cache(cache)
-        refresh_in_memory_cache()
+        # 6. Always Update Local Cache (adds a template, oldest evicted beyond the per-employee cap)
+        await loop.run_in_executor(
+            None, add_local_template,
+            employeeId,
+            encoding_list,
+            name if name else employeeId,
+            "employee", # Fallback if metadata refresh hasn't run
+            template_id
+        )
         print(f"[SUCCESS] Local cache updated for {employeeId}")
 
         return {
@@ -537,91 +741,228 @@ async def register_face(
     except Exception as e:
         print(f"[ERROR] Registration Error: {str(e)}")
         return {"success": False, "message": f"Engine Error: {str(e)}"}
+    finally:
+        if photo_path and not committed:
+            photo_uploader.discard(photo_path)
+
+bulk_enroll_lock = asyncio.Lock()
+
+@app.post("/api/biometrics/face/register/bulk")
+async def register_faces_bulk(
+    archive: UploadFile = File(...),
+    manifest: UploadFile = File(None),
+    re_enroll: str = Form("false"),
+    dry_run: str = Form("false")
+):
+    """
+    Enroll a whole zip of employee photos (manifest.csv inside it, or as
+    ``manifest``) in one pass: parallel encoding, one vectorised conflict
+    check against the batch and the gallery, chunked face_templates inserts
+    and a single gallery rebuild. Returns the per-row report (bulk_enroll.py).
+    The archive is read from the upload's spooled temp file, never as one
+    bytes object, and photos are encoded on the engine's own pool with at
+    most half of its queue, so live verifies keep priority.
+    """
+    if bulk_enroll_lock.locked():
+        return {"success": False, "message": "A bulk enrollment is already running.", "error_code": "BULK_IN_PROGRESS"}
+    async with bulk_enroll_lock:
+        manifest_text = (await manifest.read()).decode("utf-8-sig") if manifest else None
+        try:
+            source, rows = load_job(archive.file, manifest_text)
+        except Exception as e:
+            return {"success": False, "message": f"Invalid archive: {str(e)}", "error_code": "BAD_ARCHIVE"}
+
+        print(f"[BULK] Enrolling {len(rows)} manifest rows...")
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(
+            None, lambda: run_bulk_enrollment(
+                source, rows,
+                client=supabase,
+                snapshot=gallery.current,
+                add_local=add_local_templates,
+                executor=encoder.background(loop),
+                workers=max(1, encoder.workers),
+                threshold=CONFLICT_THRESHOLD,
+                top_k=CONFLICT_TOP_K,
+                re_enroll=re_enroll.lower() == "true",
+                dry_run=dry_run.lower() == "true"
+            )
+        )
+        print(f"[BULK] Done: {report['summary']}")
+        return {"success": True, **report}
+
+def verify_outcome(result):
+    """Outcome label for metrics: VERIFIED, ENGINE_BUSY or the response's error_code."""
+    if isinstance(result, JSONResponse):
+        return "ENGINE_BUSY"
+    if result.get("session", {}).get("repeat"):
+        return "SESSION_REPEAT"
+    if result.get("success"):
+        return "VERIFIED"
+    return result.get("error_code", "FAILED")
 
 @app.post("/api/biometrics/face/verify")
-async def verify_face(file: UploadFile = File(...)):
+async def verify_face(
+    file: UploadFile = File(...),
+    device_id: str = Form(None),
+    face_box: str = Form(None),
+    detector: str = Form(None),
+    x_device_id: str = Header(None)
+):
     """
     Verify a live frame against registered encodings.
-    Optimized for <2s response time.
+    Optimized for <2s response time. ``face_box`` ("top,right,bottom,left")
+    lets the terminal pass the box it already tracked; ``detector="none"``
+    marks the upload as a pre-cropped face. The device identity (form field
+    or X-Device-Id header) selects the gallery partitions that are scanned.
     """
-    import time
-    t_start = time.time()
-    
+    trace = VerifyTrace("verify")
+    result = await run_verify(trace, file, device_id or x_device_id or DEFAULT_DEVICE_ID, face_box, detector)
+    trace.finish(verify_outcome(result))
+    return result
+
+def unknown_device_response(device_id):
+    return {"success": False, "message": f"Device {device_id!r} is not assigned to any site or door.", "error_code": "UNKNOWN_DEVICE"}
+
+def session_response(session, repeat):
+    accepted = session.accepted
+    return {
+        "success": True,
+        "employee_id": accepted["employee_id"],
+        "name": accepted["name"],
+        "confidence": 1.0 - accepted["distance"],
+        "session": {**session.summary(), "repeat": repeat}
+    }
+
+def finish_sessions(ended):
+    """One aggregated "failed" log for each ended session that was never accepted."""
+    for session in ended:
+        if session is None or session.accepted or session.closest is None or session.end_reason == "spoof":
+            continue
+        distance, employee_id = session.closest
+        background_log_access(employee_id, "failed", 1.0 - distance, session.device_id)
+
+async def run_verify(trace, file, device_id, face_box, detector):
     try:
+        try:
+            partitions.resolve(device_id) # Strict mode: reject before paying for decode + encode
+        except UnknownDevice:
+            return unknown_device_response(device_id)
+        fuse = device_id != DEFAULT_DEVICE_ID # The shared fallback identity may be several terminals
+        finish_sessions(sessions.expire())
+
         # 1. Image Preprocessing
         contents = await file.read()
-        t_read = time.time()
+        trace.mark("read")
         
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        frame = np.array(image)
-        t_preprocess = time.time()
+        try:
+            upload = await decode_in_executor(contents, file.content_type)
+        except DecodeError as e:
+            return bad_image_response(e)
+        frame = upload.frame
+        if upload.chip:
+            detector = "none"
+        trace.mark("preprocess")
+
+        # 2a. Accepted session on this device: detection only while the same face stays in view
+        session = sessions.accepted(device_id) if fuse else None
+        roi = scale_box(parse_face_box(face_box), upload.scale) # The client's box is in original-image pixels
+        if session is not None and detector != "none": # A face chip carries no position to follow
+            box = roi
+            if box is None:
+                try:
+                    boxes = await encoder.detect(frame, detector=detector, roi=session.box)
+                except EngineBusy as busy:
+                    return engine_busy_response(busy)
+                box = boxes[0] if boxes else None
+            trace.mark("detect")
+            if sessions.follow(device_id, box):
+                roi_tracker.update(device_id, box)
+                return session_response(session, repeat=True)
+            finish_sessions([sessions.end(device_id, "face_left" if box is None else "new_face")])
+            session = None
+            if box is None:
+                roi_tracker.update(device_id, None)
+                return {"success": False, "message": "No face detected.", "error_code": "NO_FACE"}
+            roi = box
 
-        # 2. Single Embedding Generation
+        # 2. Detection (downscaled, ROI-first) + Single Embedding Generation
         try:
-            live_encodings = face_recognition.face_encodings(frame)
+            roi = roi or roi_tracker.get(device_id)
+            live_encodings, face_locations = await encoder.detect_and_encode(frame, detector=detector, roi=roi)
             if not live_encodings:
-                return {"success": False, "message": "No face detected."}
+                roi_tracker.update(device_id, None)
+                if fuse:
+                    finish_sessions([sessions.end(device_id, "face_left")])
+                return {"success": False, "message": "No face detected.", "error_code": "NO_FACE"}
             live_encoding = live_encodings[0]
+            roi_tracker.update(device_id, face_locations[0])
+        except EngineBusy as busy:
+            return engine_busy_response(busy)
         except Exception as e:
-            return {"success": False, "message": "Engine Error"}
+            return {"success": False, "message": "Engine Error", "error_code": "ENGINE_ERROR"}
         
-        t_encode = time.time()
+        trace.mark("encode")
 
-        # 3. Vectorized Comparison
-        global FACE_VECTORS, FACE_METADATA
-        if FACE_VECTORS.size == 0:
-            return {"success": False, "message": "No registered users found."}
+        # 3. Vectorized Comparison (top-2 people only: best match + runner-up for the ambiguity gap)
+        snapshot = gallery.current # One snapshot per request: rows and metadata always agree
+        searcher = partitions.searcher(snapshot, device_id) # Only the employees this door serves
+        if len(searcher) == 0:
+            return {"success": False, "message": "No registered users found.", "error_code": "NO_USERS"}
 
-        # Calculate Euclidean distances
-        distances = face_recognition.face_distance(FACE_VECTORS, live_encoding)
-        best_match_idx = np.argmin(distances)
-        min_distance = float(distances[best_match_idx])
+        # Euclidean distance of the two nearest *employees* (best template of each)
+        nearest_people, nearest_dist, nearest_rows = searcher.search_groups(live_encoding, k=2)
+        best_match_idx = int(nearest_rows[0])
+        min_distance = float(nearest_dist[0])
         
         # Convert distance to confidence (threshold for face-recognition is usually 0.6 distance)
         # We'll use 1.0 - distance as a similarity score
         max_similarity = 1.0 - min_distance
         
-        t_compare = time.time()
+        trace.mark("compare")
 
         # 4. Threshold & Ambiguity Logic
-        STRICT_THRESHOLD = 0.55 # Typical threshold for face_recognition (1 - 0.45 distance)
-        AMBIGUITY_GAP = 0.05
-        
-        matched_emp = FACE_METADATA[best_match_idx]
-        
-        # Ambiguity Detection
-        is_ambiguous = False
-        if len(distances) > 1:
-            sorted_distances = np.sort(distances)
-            gap = sorted_distances[1] - min_distance # Bigger gap means less ambiguity
-            if gap < AMBIGUITY_GAP and min_distance < 0.60:
-                is_ambiguous = True
-                print(f"[REJECTED] Ambiguity detected! Distance Gap: {gap:.4f} < {AMBIGUITY_GAP}")
-
-        if min_distance > 0.45: # Standard Face Recognition threshold is 0.6, we use 0.45 for STRICTness
-            print(f"[DENIED] Low confidence: {matched_emp['employee_id']} | Dist: {min_distance:.4f} > 0.45")
-            asyncio.create_task(background_log_access(matched_emp["employee_id"], "failed", max_similarity, "terminal_01"))
+        matched_emp = snapshot.metadata[best_match_idx]
+        status = classify_match(nearest_dist)
+        if session is not None: # Chip uploads of an accepted session: same person keeps it, anyone else ends it
+            if status == "MATCH" and matched_emp["employee_id"] == session.accepted["employee_id"]:
+                sessions.follow(device_id, session.box)
+                return session_response(session, repeat=True)
+            finish_sessions([sessions.end(device_id, "new_face")])
+
+        if status == "NOT_RECOGNIZED":
+            print(f"[DENIED] Low confidence: {matched_emp['employee_id']} | Dist: {min_distance:.4f} > {MATCH_THRESHOLD}")
+        elif status == "AMBIGUOUS_MATCH":
+            print(f"[REJECTED] Ambiguity detected! Distance Gap: {float(nearest_dist[1]) - min_distance:.4f} < {AMBIGUITY_GAP}")
+        if status != "MATCH":
+            if fuse:
+                sessions.fail(device_id, status, matched_emp["employee_id"], min_distance, face_locations[0])
+            else:
+                background_log_access(matched_emp["employee_id"], "failed", max_similarity, device_id)
             return {
-                "success": False, 
-                "message": "Unrecognized face.", 
-                "error_code": "NOT_RECOGNIZED",
+                "success": False,
+                "message": "Unrecognized face." if status == "NOT_RECOGNIZED" else "Ambiguous Match: Multiple users similar.",
+                "error_code": status,
                 "confidence": max_similarity
             }
-        
-        if is_ambiguous:
-            asyncio.create_task(background_log_access(matched_emp["employee_id"], "failed", max_similarity, "terminal_01"))
+
+        # 4b. Session fusion: accept after k consistent frames or one very close match
+        if fuse and not sessions.vote(device_id, matched_emp["employee_id"], min_distance, face_locations[0]):
             return {
                 "success": False,
-                "message": "Ambiguous Match: Multiple users similar.",
-                "error_code": "AMBIGUOUS_MATCH",
+                "message": "Hold still, confirming identity...",
+                "error_code": "PENDING_CONFIRMATION",
                 "confidence": max_similarity
             }
 
         # 5. Gemini Liveness Security Check (Anti-Spoofing)
-        is_live, liveness_msg = await check_liveness(contents)
+        is_live, liveness_msg = await check_liveness(frame, device_id, snapshot.vectors[best_match_idx])
+        trace.mark("liveness")
         if not is_live:
             print(f"[SECURITY] REJECTED: {liveness_msg} for {matched_emp['employee_id']}")
-            asyncio.create_task(background_log_access(matched_emp["employee_id"], "spoof_detected", max_similarity, "terminal_01"))
+            background_log_access(matched_emp["employee_id"], "failed", max_similarity, device_id) # access_logs CHECK has no spoof status
+            if fuse:
+                sessions.end(device_id, "spoof")
             return {
                 "success": False,
                 "message": f"Security Alert: {liveness_msg}",
@@ -629,30 +970,171 @@ async def verify_face(file: UploadFile = File(...)):
                 "confidence": max_similarity
             }
 
-        # Success: Verified
+        # Success: Verified (once per session; follow-up frames are answered above)
+        if fuse:
+            if sessions.accepted(device_id): # A concurrent frame of this approach got here first
+                return session_response(sessions.accepted(device_id), repeat=True)
+            session = sessions.accept(device_id, matched_emp["employee_id"], matched_emp["name"], min_distance)
         print(f"[VERIFIED] {matched_emp['employee_id']} | Sim: {max_similarity:.4f} | Liveness: {liveness_msg}")
-        asyncio.create_task(mark_attendance_async(matched_emp["employee_id"]))
-        asyncio.create_task(background_log_access(matched_emp["employee_id"], "success", max_similarity, "terminal_01"))
+        mark_attendance_async(matched_emp["employee_id"], device_id)
+        background_log_access(matched_emp["employee_id"], "success", max_similarity, device_id)
 
-        t_end = time.time()
+        trace.mark("respond")
         
         # Latency Logging
-        latencies = {
-            "read": int((t_read - t_start) * 1000),
-            "preprocess": int((t_preprocess - t_read) * 1000),
-            "encode": int((t_encode - t_preprocess) * 1000),
-            "compare": int((t_compare - t_encode) * 1000),
-            "total": int((t_end - t_start) * 1000)
-        }
-        print(f"[PERF] Performance: {latencies['total']}ms (Enc: {latencies['encode']}ms, Comp: {latencies['compare']}ms)")
+        latencies = trace.latencies_ms()
+        print(f"[PERF] Performance: {latencies['total']}ms (Enc: {latencies['encode']}ms, Comp: {latencies['compare']}ms, Live: {latencies['liveness']}ms)")
 
-        return {
+        result = {
             "success": True, 
             "employee_id": matched_emp["employee_id"],
             "name": matched_emp["name"],
             "confidence": max_similarity,
             "performance": latencies
         }
+        if session is not None:
+            result["session"] = {**session.summary(), "repeat": False}
+        return result
+
+    except Exception as e:
+        import traceback
+        error_msg = f"Engine Error: {str(e)}"
+        print(f"❌ {error_msg}")
+        traceback.print_exc()
+        return {"success": False, "message": error_msg, "error_code": "ENGINE_ERROR"}
+
+
+@app.post("/api/biometrics/face/verify/batch")
+async def verify_face_batch(
+    files: List[UploadFile] = File(...),
+    device_id: str = Form(None),
+    detector: str = Form(None),
+    x_device_id: str = Header(None)
+):
+    """
+    Verify several frames of one approach (or one frame with several faces).
+    All frames are encoded in a single pool job and every face is compared in
+    one [faces x gallery] distance computation; per-face results are fused
+    into a single decision, logged once.
+    """
+    trace = VerifyTrace("verify_batch")
+    result = await run_verify_batch(trace, files, device_id or x_device_id or DEFAULT_DEVICE_ID, detector)
+    trace.finish(verify_outcome(result))
+    return result
+
+async def run_verify_batch(trace, files, device_id, detector):
+    try:
+        if len(files) > BATCH_MAX_FRAMES:
+            return {"success": False, "message": f"At most {BATCH_MAX_FRAMES} frames per request.", "error_code": "BATCH_TOO_LARGE"}
+        try:
+            partitions.resolve(device_id)
+        except UnknownDevice:
+            return unknown_device_response(device_id)
+
+        # 1. Read + decode every frame
+        contents = [await f.read() for f in files]
+        trace.mark("read")
+        try:
+            uploads = await asyncio.gather(*(decode_in_executor(c, f.content_type) for c, f in zip(contents, files)))
+        except DecodeError as e:
+            return bad_image_response(e)
+        frames = [u.frame for u in uploads]
+        if all(u.chip for u in uploads):
+            detector = "none"
+        trace.mark("preprocess")
+
+        # 2. One encode pass for the whole batch
+        try:
+            per_frame = await encoder.encode_batch(frames, detector=detector)
+        except EngineBusy as busy:
+            return engine_busy_response(busy)
+        probes, owners = [], []
+        for frame_idx, encodings in enumerate(per_frame):
+            probes.extend(encodings)
+            owners.extend([frame_idx] * len(encodings))
+        if not probes:
+            return {"success": False, "message": "No face detected.", "error_code": "NO_FACE"}
+        trace.mark("encode")
+
+        # 3. Single matrix-matrix comparison against the gallery
+        snapshot = gallery.current
+        matcher, metadata = partitions.searcher(snapshot, device_id), snapshot.metadata
+        if len(matcher) == 0:
+            return {"success": False, "message": "No registered users found.", "error_code": "NO_USERS"}
+        results = matcher.search_groups_batch(np.array(probes, dtype=np.float32), k=2)
+        trace.mark("compare")
+
+        # 4. Per-face decisions
+        frame_results = [{"frame": i, "faces": []} for i in range(len(frames))]
+        support = {} # employee_id -> [(distance, frame_idx, row)]
+        best_overall = None
+        for (people, dist, rows), frame_idx in zip(results, owners):
+            status = classify_match(dist)
+            row = int(rows[0])
+            emp_id = metadata[row]["employee_id"]
+            frame_results[frame_idx]["faces"].append({
+                "status": status,
+                "employee_id": emp_id if status == "MATCH" else None,
+                "confidence": 1.0 - float(dist[0])
+            })
+            if status == "MATCH":
+                support.setdefault(emp_id, []).append((float(dist[0]), frame_idx, row))
+            if best_overall is None or float(dist[0]) < best_overall[0]:
+                best_overall = (float(dist[0]), status, row)
+
+        # 5. Fusion: the employee backed by the most faces wins; a tie between people is ambiguous
+        ranked = sorted(support.items(), key=lambda kv: (-len(kv[1]), min(kv[1])[0]))
+        fused = {"faces": len(probes), "frames": len(frames), "support": 0}
+        if not ranked or (len(ranked) > 1 and len(ranked[0][1]) == len(ranked[1][1])):
+            distance, status, row = best_overall
+            error_code = "AMBIGUOUS_MATCH" if ranked else status
+            confidence = 1.0 - distance
+            background_log_access(metadata[row]["employee_id"], "failed", confidence, device_id)
+            return {
+                "success": False,
+                "message": "Ambiguous Match: Multiple users similar." if error_code == "AMBIGUOUS_MATCH" else "Unrecognized face.",
+                "error_code": error_code,
+                "confidence": confidence,
+                "frames": frame_results,
+                "fused": fused
+            }
+
+        emp_id, hits = ranked[0]
+        distance, frame_idx, row = min(hits)
+        matched_emp = metadata[row]
+        confidence = 1.0 - distance
+        fused["support"] = len(hits)
+
+        # 6. Liveness once, on the frame holding the best match
+        is_live, liveness_msg = await check_liveness(frames[frame_idx], device_id, snapshot.vectors[row])
+        trace.mark("liveness")
+        if not is_live:
+            print(f"[SECURITY] REJECTED: {liveness_msg} for {emp_id}")
+            background_log_access(emp_id, "failed", confidence, device_id) # access_logs CHECK has no spoof status
+            return {
+                "success": False,
+                "message": f"Security Alert: {liveness_msg}",
+                "error_code": "SPOOF_DETECTED",
+                "confidence": confidence,
+                "frames": frame_results,
+                "fused": fused
+            }
+
+        print(f"[VERIFIED] {emp_id} | Sim: {confidence:.4f} | Batch support {len(hits)}/{len(probes)} | Liveness: {liveness_msg}")
+        mark_attendance_async(emp_id, device_id)
+        background_log_access(emp_id, "success", confidence, device_id)
+
+        trace.mark("respond")
+        latencies = trace.latencies_ms()
+        return {
+            "success": True,
+            "employee_id": emp_id,
+            "name": matched_emp["name"],
+            "confidence": confidence,
+            "frames": frame_results,
+            "fused": fused,
+            "performance": latencies
+        }
 
     except Exception as e:
         import traceback
@@ -670,13 +1152,12 @@ async def delete_face(employee_id: str):
     Remove a specific employee's face template from local cache and database.
     """
     print(f"[DELETE] Evicting face for: {employee_id}")
-    cache = load_face_cache()
-    new_cache = [emp for emp in cache if emp.get("employee_id") != employee_id]
-    save_face_cache(new_cache)
-    refresh_in_memory_cache()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, delete_local_templates, employee_id)
 
     try:
-        supabase.table("face_templates").delete().eq("employee_id", employee_id).execute()
+        await loop.run_in_executor(
+            None, lambda: supabase.table("face_templates").delete().eq("employee_id", employee_id).execute())
         print(f"[DELETE] Removed from database.")
     except Exception as e:
         print(f"[WARNING] Database removal failed: {str(e)}")
@@ -686,27 +1167,12 @@ async def delete_face(employee_id: str):
 @app.post("/api/biometrics/cache/rebuild")
 async def rebuild_cache():
     """
-    Force a full rebuild of face_cache.json from face_templates.
+    Force a full rebuild of the local template store from face_templates.
     """
     print("[CACHE] Rebuilding cache from face_templates...")
     try:
-        response = supabase.table("face_templates") \
-            .select("employee_id, embedding, employees(name, role)") \
-            .execute()
-        
-        flat_data = []
-        for entry in response.data:
-            emp_meta = entry.get("employees", {})
-            flat_data.append({
-                "employee_id": entry.get("employee_id"),
-                "face_embedding": entry.get("embedding"),
-                "name": emp_meta.get("name"),
-                "role": emp_meta.get("role")
-            })
-        
-        save_face_cache(flat_data)
-        refresh_in_memory_cache()
-        return {"success": True, "enrolled_count": len(flat_data)}
+        enrolled = await asyncio.get_running_loop().run_in_executor(None, full_template_refresh)
+        return {"success": True, "enrolled_count": enrolled}
     except Exception as e:
         print(f"[ERROR] Rebuild failed: {str(e)}")
         return {"success": False, "message": str(e)}
@@ -715,10 +1181,17 @@ async def rebuild_cache():
 @app.get("/api/biometrics/cache/status")
 async def cache_status():
     """Return current cache contents summary for diagnostics."""
-    cache = load_face_cache()
+    snapshot = gallery.current
+    cache = snapshot.metadata
+    employees = {}
+    for e in cache:
+        entry = employees.setdefault(e.get("employee_id"), {"employee_id": e.get("employee_id"), "name": e.get("name"), "templates": 0})
+        entry["templates"] += 1
     return {
-        "cached_employees": len(cache),
-        "entries": [{"employee_id": e.get("employee_id"), "name": e.get("name")} for e in cache]
+        "cached_employees": len(employees),
+        "cached_templates": len(cache),
+        "gallery_version": snapshot.version,
+        "entries": list(employees.values())
     }
 
 
@@ -726,6 +1199,8 @@ async def cache_status():
 async def root():
     return {"status": "online", "service": "Smart Door Biometric API", "version": "v2.6"}
 
+startup.record_imports(round(time.perf_counter() - IMPORT_STARTED, 3))
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8001))
@@ -0,0 +1,214 @@
+"""
+Persistent BLE link to the door controller.
+
+run_ble_op used to open a fresh BleakClient per ON/OFF write, so every
+unlock (and its auto-relock) paid discovery + GATT connection, usually 1-3 s.
+DoorLink owns one long-lived GATT session instead: a single worker task
+connects (with exponential backoff), serialises writes from a queue, checks
+the link every BLE_KEEPALIVE seconds and reconnects when it drops. A write
+that fails on a stale session is retried once after reconnecting. The engine
+opens the link during start-up (connect_now), so the first unlock after a
+boot does not pay for the scan and connect either.
+
+The radio is behind a small transport interface (connect / write /
+disconnect / is_connected); BleakTransport is the real one and tests pass a
+fake.
+
+Configuration (environment):
+    BLE_KEEPALIVE          seconds between link checks while idle
+    BLE_BACKOFF_MAX        cap on the reconnect delay
+    BLE_COMMAND_TIMEOUT    seconds a caller waits for its write (incl. reconnect)
+    BLE_IDLE_DISCONNECT    drop the link after this many idle seconds (0 = never),
+                           e.g. to let the mobile app connect to the same door
+"""
+import asyncio
+import os
+import time
+
+BLE_KEEPALIVE = float(os.getenv("BLE_KEEPALIVE", 15.0))
+BLE_BACKOFF_MIN = 0.5
+BLE_BACKOFF_MAX = float(os.getenv("BLE_BACKOFF_MAX", 30.0))
+BLE_COMMAND_TIMEOUT = float(os.getenv("BLE_COMMAND_TIMEOUT", 10.0))
+BLE_IDLE_DISCONNECT = float(os.getenv("BLE_IDLE_DISCONNECT", 0))
+
+
+class BleakTransport:
+    """GATT session to one characteristic via bleak."""
+
+    def __init__(self, address, characteristic, connect_timeout=10.0):
+        self.address = address
+        self.characteristic = characteristic
+        self.connect_timeout = connect_timeout
+        self._client = None
+
+    @property
+    def is_connected(self):
+        return self._client is not None and self._client.is_connected
+
+    async def connect(self):
+        from bleak import BleakClient
+        await self.disconnect()
+        self._client = BleakClient(self.address, timeout=self.connect_timeout)
+        await self._client.connect()
+
+    async def write(self, data):
+        await self._client.write_gatt_char(self.characteristic, data, response=True)
+
+    async def disconnect(self):
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+
+class DoorLink:
+    def __init__(self, transport, keepalive=BLE_KEEPALIVE, backoff_min=BLE_BACKOFF_MIN,
+                 backoff_max=BLE_BACKOFF_MAX, command_timeout=BLE_COMMAND_TIMEOUT,
+                 idle_disconnect=BLE_IDLE_DISCONNECT):
+        self.transport = transport
+        self.keepalive = keepalive
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.command_timeout = command_timeout
+        self.idle_disconnect = idle_disconnect
+        self.state = "disconnected"
+        self._queue = None
+        self._task = None
+        self._up = asyncio.Event()
+        self._retry = None
+        self._last_activity = time.time()
+        self.stats = {
+            "connects": 0, "connect_failures": 0, "disconnects": 0,
+            "writes": 0, "write_failures": 0,
+            "last_connect_ms": None, "last_write_ms": None, "last_error": None,
+            "connected_since": None,
+        }
+
+    @property
+    def connected(self):
+        return self.state == "connected" and self.transport.is_connected
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def connect_now(self, timeout=None):
+        """
+        Start the worker and wait for the first connection. Raises TimeoutError
+        when the door is not reachable in time; the worker keeps retrying.
+        """
+        self._last_activity = time.time()
+        self.start()
+        timeout = timeout or self.command_timeout
+        try:
+            await asyncio.wait_for(self._up.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"door not reachable within {timeout:g}s ({self.stats['last_error']}); "
+                                       f"still retrying in the background") from None
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._drop("stopped")
+
+    async def send(self, command, timeout=None):
+        """Queue ``command`` for the door; returns {"success", "message"} like the old run_ble_op."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((command, future))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.command_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            if self.state != "connected":
+                return {"success": False, "message": "Failed to connect to door hardware"}
+            return {"success": False, "message": f"Command {command} timed out"}
+
+    def metrics(self):
+        return {"state": self.state, "queued": self._queue.qsize() if self._queue else 0, **self.stats}
+
+    # --- Worker ---
+    async def _drop(self, reason):
+        if self.state == "connected":
+            self.stats["disconnects"] += 1
+            print(f"[BLE] Link dropped ({reason})")
+        self.state = "disconnected"
+        self.stats["connected_since"] = None
+        self._up.clear()
+        await self.transport.disconnect()
+
+    async def _connect(self):
+        self.state = "connecting"
+        t0 = time.perf_counter()
+        await self.transport.connect()
+        self.state = "connected"
+        self.stats["connects"] += 1
+        self.stats["last_connect_ms"] = int((time.perf_counter() - t0) * 1000)
+        self.stats["connected_since"] = time.time()
+        self._up.set()
+        print(f"[BLE] Link up in {self.stats['last_connect_ms']} ms")
+
+    async def _next_command(self):
+        if self._retry is not None:
+            item, self._retry = self._retry, None
+            return item
+        command, future = await asyncio.wait_for(self._queue.get(), self.keepalive)
+        return command, future, 0
+
+    async def _run(self):
+        delay = self.backoff_min
+        while True:
+            idle = time.time() - self._last_activity
+            if self.idle_disconnect and idle >= self.idle_disconnect and self._queue.empty() and self._retry is None:
+                if self.state == "connected":
+                    await self._drop("idle")
+                command, future = await self._queue.get()  # Stay down until the next command
+                self._retry = (command, future, 0)
+                continue
+
+            if not self.transport.is_connected:
+                if self.state == "connected":
+                    await self._drop("keepalive")
+                try:
+                    await self._connect()
+                    delay = self.backoff_min
+                except Exception as e:
+                    self.state = "disconnected"
+                    self.stats["connect_failures"] += 1
+                    self.stats["last_error"] = str(e)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.backoff_max)
+                    continue
+
+            try:
+                command, future, attempt = await self._next_command()
+            except asyncio.TimeoutError:
+                continue  # Idle: loop back round to the link check
+            if future.done():
+                continue  # Caller already gave up
+
+            self._last_activity = time.time()
+            t0 = time.perf_counter()
+            try:
+                await self.transport.write(command.encode())
+            except Exception as e:
+                self.stats["write_failures"] += 1
+                self.stats["last_error"] = str(e)
+                await self._drop(f"write failed: {e}")
+                if attempt == 0:
+                    self._retry = (command, future, 1)
+                elif not future.done():
+                    future.set_result({"success": False, "message": str(e)})
+                continue
+            self.stats["writes"] += 1
+            self.stats["last_write_ms"] = int((time.perf_counter() - t0) * 1000)
+            if not future.done():
+                future.set_result({"success": True, "message": f"Command {command} executed"})
@@ -0,0 +1,424 @@
+"""
+Bulk enrollment from a folder or zip of employee photos plus a CSV manifest.
+
+One register_face call per person costs a blocking encode, a storage upload,
+a database round trip and a gallery rebuild each; onboarding a whole site
+that way takes hours. run_bulk_enrollment does the same work once per batch:
+
+    1. read the manifest and every referenced photo
+    2. decode + detect + encode all photos in parallel on a process pool
+    3. one vectorised conflict check: batch x batch (two rows of different
+       employees that look alike) and batch x gallery (a row that looks like
+       someone already enrolled), same matcher and threshold as register_face
+    4. insert face_templates in chunks of BULK_UPSERT_CHUNK rows, then upload
+       the photos of the inserted rows on a thread pool (a failed chunk
+       is retried row by row, so only its bad rows become DB_ERROR, and
+       leaves no orphaned storage objects behind)
+    5. hand every committed template to ``add_local`` once, so the engine
+       rebuilds its gallery a single time
+
+and returns a per-row report (status, message, conflicts, template id).
+
+Manifest (``manifest.csv`` next to the photos, or passed explicitly):
+
+    employee_id,name,image[,role]
+    EMP-0001,Asha Rao,photos/asha.jpg,employee
+
+Inside the engine (POST /api/biometrics/face/register/bulk) the photos are
+encoded through the engine's own EncodingEngine (see EncodingEngine.background),
+so bulk jobs share its pool and queue limit with live verifies instead of
+starting a second process pool; the CLI uses a pool of its own.
+
+CLI (the engines pick the new templates up through delta sync):
+
+    python bulk_enroll.py site_photos/ --report report.csv
+    python bulk_enroll.py site.zip --dry-run --report report.json
+"""
+import argparse
+import csv
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from gallery import GallerySnapshot
+from image_decode import DecodeError, decode_upload
+from matcher import CONFLICT_THRESHOLD, CONFLICT_TOP_K
+from template_store import MAX_TEMPLATES_PER_EMPLOYEE
+
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+BULK_UPSERT_CHUNK = int(os.getenv("BULK_UPSERT_CHUNK", 200))
+BULK_UPLOAD_THREADS = int(os.getenv("BULK_UPLOAD_THREADS", 8))
+MANIFEST_NAME = "manifest.csv"
+REQUIRED_COLUMNS = ("employee_id", "image")
+CONFLICT_PROBE_BLOCK = 256  # probes per [block x gallery] distance matrix
+
+
+# --- Sources ---
+class DirectorySource:
+    def __init__(self, root):
+        self.root = root
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), "rb") as f:
+            return f.read()
+
+    def find_manifest(self):
+        path = os.path.join(self.root, MANIFEST_NAME)
+        return MANIFEST_NAME if os.path.exists(path) else None
+
+
+class ZipSource:
+    def __init__(self, file):
+        self.zip = zipfile.ZipFile(file)
+
+    def read(self, name):
+        return self.zip.read(name)
+
+    def find_manifest(self):
+        """manifest.csv at the root, or in the single top-level folder most archivers add."""
+        candidates = [n for n in self.zip.namelist() if posixpath.basename(n) == MANIFEST_NAME]
+        return min(candidates, key=lambda n: n.count("/")) if candidates else None
+
+
+def open_source(path_or_data):
+    """A folder path, a zip path, the bytes of a zip or an open zip file (e.g. an upload's spooled file)."""
+    if isinstance(path_or_data, bytes):
+        return ZipSource(io.BytesIO(path_or_data))
+    if isinstance(path_or_data, str) and os.path.isdir(path_or_data):
+        return DirectorySource(path_or_data)
+    return ZipSource(path_or_data)
+
+
+def read_manifest(text, base=""):
+    """Manifest rows as dicts (``row`` = 1-based data line, ``image`` resolved against ``base``)."""
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    columns = {c.strip().lower() for c in reader.fieldnames or []}
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"Manifest is missing column(s): {', '.join(missing)}")
+    rows = []
+    for number, raw in enumerate(reader, start=1):
+        row = {(k or "").strip().lower(): (v or "").strip() for k, v in raw.items()}
+        rows.append({
+            "row": number,
+            "employee_id": row.get("employee_id", ""),
+            "name": row.get("name") or row.get("employee_id", ""),
+            "role": row.get("role") or "employee",
+            "image": posixpath.join(base, row["image"]) if row.get("image") else "",
+        })
+    return rows
+
+
+# --- Encoding (runs inside pool workers) ---
+def _encode_photo(data, take_largest=False):
+    """
+    Photo bytes -> (status, embedding, faces). Several faces are rejected
+    unless ``take_largest`` (register_face's behaviour: largest face wins).
+    """
+    from encoding_pool import _detect_and_encode
+    try:
+        upload = decode_upload(data)
+    except DecodeError:
+        return "BAD_IMAGE", None, 0
+    encodings, _ = _detect_and_encode(upload.frame, "none" if upload.chip else None)
+    if not encodings:
+        return "NO_FACE", None, 0
+    if len(encodings) > 1 and not take_largest:
+        return "MULTIPLE_FACES", None, len(encodings)
+    return "OK", np.asarray(encodings[0], dtype=np.float32), len(encodings)
+
+
+def _pool(workers):
+    from encoding_pool import _init_worker
+    if workers > 0:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    return ThreadPoolExecutor(max_workers=1, initializer=_init_worker)
+
+
+def encode_rows(rows, source, workers=BULK_WORKERS, executor=None):
+    """
+    Encode every row's photo; sets ``status`` on failures and ``embedding`` on
+    success. Photos are read in windows so a large archive is never held in
+    memory all at once.
+    """
+    own = executor is None
+    executor = executor or _pool(workers)
+    window = max(1, workers) * 4
+    try:
+        for start in range(0, len(rows), window):
+            batch = []
+            for row in rows[start:start + window]:
+                try:
+                    batch.append((row, source.read(row["image"])))
+                except (OSError, KeyError):
+                    row["status"], row["message"] = "MISSING_IMAGE", f"{row['image']} not found"
+            futures = [(row, executor.submit(_encode_photo, data)) for row, data in batch]
+            for row, future in futures:
+                try:
+                    status, embedding, faces = future.result()
+                except Exception as e:
+                    status, embedding, faces = "ENGINE_ERROR", None, 0
+                    row["message"] = str(e)
+                row["faces"] = faces
+                if status == "OK":
+                    row["embedding"] = embedding
+                else:
+                    row["status"] = status
+    finally:
+        if own:
+            executor.shutdown(wait=True)
+    return rows
+
+
+# --- Validation / conflicts ---
+def validate_rows(rows):
+    """Flag rows without an id or photo and repeated employee ids (the first occurrence wins)."""
+    seen = {}
+    for row in rows:
+        if not row["employee_id"] or not row["image"]:
+            row["status"], row["message"] = "INVALID_ROW", "employee_id and image are required"
+        elif row["employee_id"] in seen:
+            row["status"], row["message"] = "DUPLICATE_ROW", f"employee_id already on row {seen[row['employee_id']]}"
+        else:
+            seen[row["employee_id"]] = row["row"]
+    return rows
+
+
+def _conflict(employee_id, name, distance, source):
+    return {"employee_id": employee_id, "name": name, "distance": round(float(distance), 4), "source": source}
+
+
+def find_conflicts(rows, snapshot, threshold=CONFLICT_THRESHOLD, top_k=CONFLICT_TOP_K):
+    """
+    Attach ``conflicts`` to every encoded row: other employees within
+    ``threshold`` in the batch (N x N) or the published gallery (N x M).
+    Each side is one matrix product per block of probes.
+    """
+    encoded = [r for r in rows if "embedding" in r]
+    if not encoded:
+        return rows
+    probes = np.array([r["embedding"] for r in encoded], dtype=np.float32)
+    for r in encoded:
+        r["conflicts"] = []
+
+    # N x N: the batch as a gallery of its own (normalised + grouped exactly like the real one)
+    batch = GallerySnapshot.build(probes, [{"employee_id": r["employee_id"], "name": r["name"],
+                                            "template_id": r["row"]} for r in encoded], version=0)
+    # N x M: against the enrolled gallery
+    sides = [("batch", batch, top_k + 1)] + ([("gallery", snapshot, top_k)] if snapshot is not None and len(snapshot) else [])
+    for side, gallery, k in sides:
+        for start in range(0, len(probes), CONFLICT_PROBE_BLOCK):
+            results = gallery.matcher.search_groups_batch(probes[start:start + CONFLICT_PROBE_BLOCK], k=k)
+            for row, (_, distances, best_rows) in zip(encoded[start:], results):
+                for d, best in zip(distances, best_rows):
+                    other = gallery.metadata[best]
+                    if d < threshold and other["employee_id"] != row["employee_id"]:
+                        row["conflicts"].append(_conflict(other["employee_id"], other.get("name"), d, side))
+    return rows
+
+
+# --- Commit ---
+def _insert_chunk(client, records):
+    try:
+        response = client.table("face_templates").insert(records).execute()
+    except Exception as e:
+        err_str = str(e).lower()
+        if "duplicate" not in err_str and "unique" not in err_str:
+            raise
+        # Pre-migration_v7 schema still allows a single template per employee
+        response = client.table("face_templates").upsert(records, on_conflict="employee_id").execute()
+    return response.data or []
+
+
+def _prune_chunk(client, employee_ids):
+    """Drop templates beyond MAX_TEMPLATES_PER_EMPLOYEE for the chunk's employees in two round trips."""
+    rows = client.table("face_templates") \
+        .select("id, employee_id") \
+        .in_("employee_id", employee_ids) \
+        .order("updated_at", desc=True) \
+        .execute().data or []
+    kept, stale = {}, []
+    for r in rows:
+        kept[r["employee_id"]] = kept.get(r["employee_id"], 0) + 1
+        if kept[r["employee_id"]] > MAX_TEMPLATES_PER_EMPLOYEE:
+            stale.append(r["id"])
+    if stale:
+        client.table("face_templates").delete().in_("id", stale).execute()
+
+
+def _upload_photo(client, source, row):
+    """Upload a committed row's photo and point its template at it; returns the public URL."""
+    ext = os.path.splitext(row["image"])[1].lower() or ".jpg"
+    content_type = mimetypes.guess_type(row["image"])[0] or "image/jpeg"
+    path = f"faces/{row['employee_id']}_bulk_{row['row']}{ext}"
+    bucket = client.storage.from_("biometrics")
+    bucket.upload(path=path, file=source.read(row["image"]),
+                  file_options={"content-type": content_type, "upsert": "true"})
+    url = str(bucket.get_public_url(path))
+    if row.get("template_id") is not None:
+        client.table("face_templates").update({"image_url": url}).eq("id", row["template_id"]).execute()
+    return url
+
+
+def upload_photos_for(rows, client, source):
+    """Upload the photos of committed rows on a thread pool; a failure only leaves that template without a photo."""
+    with ThreadPoolExecutor(max_workers=BULK_UPLOAD_THREADS) as pool:
+        futures = [(r, pool.submit(_upload_photo, client, source, r)) for r in rows]
+        for row, future in futures:
+            try:
+                row["image_url"] = future.result()
+            except Exception as e:
+                row["message"] = f"Photo upload failed: {e}"
+
+
+def _commit_chunk(client, chunk):
+    """Insert one chunk; if the batch fails, retry it row by row so only the bad rows become DB_ERROR."""
+    records = [{"employee_id": r["employee_id"], "embedding": json.dumps(r["embedding"].tolist()),
+                "image_url": ""} for r in chunk]
+    try:
+        inserted = _insert_chunk(client, records)
+    except Exception as e:
+        if len(chunk) == 1:
+            chunk[0]["status"], chunk[0]["message"] = "DB_ERROR", str(e)
+            return []
+        print(f"[WARNING] Insert failed for rows {chunk[0]['row']}-{chunk[-1]['row']} ({e}); retrying row by row.")
+        return [r for row in chunk for r in _commit_chunk(client, [row])]
+    ids = {d.get("employee_id"): d.get("id") for d in inserted}
+    for r in chunk:
+        r["status"], r["template_id"] = "ENROLLED", ids.get(r["employee_id"])
+    return chunk
+
+
+def commit_rows(rows, client, source, chunk_size=BULK_UPSERT_CHUNK, upload_photos=True):
+    """Insert face_templates chunk by chunk, then upload the inserted rows' photos; returns committed rows."""
+    accepted = [r for r in rows if r.get("status") == "ACCEPTED"]
+    committed = []
+    for start in range(0, len(accepted), chunk_size):
+        enrolled = _commit_chunk(client, accepted[start:start + chunk_size])
+        if not enrolled:
+            continue
+        committed.extend(enrolled)
+        try:
+            _prune_chunk(client, [r["employee_id"] for r in enrolled])
+        except Exception as prune_err:
+            print(f"[WARNING] Template pruning failed for rows {enrolled[0]['row']}-{enrolled[-1]['row']}: {prune_err}")
+    if upload_photos and committed:
+        upload_photos_for(committed, client, source)
+    return committed
+
+
+# --- Pipeline ---
+REPORT_FIELDS = ("row", "employee_id", "name", "image", "status", "message", "faces", "template_id",
+                 "image_url", "conflicts")
+
+
+def build_report(rows):
+    summary = {}
+    for r in rows:
+        summary[r["status"]] = summary.get(r["status"], 0) + 1
+    return {
+        "total": len(rows),
+        "summary": summary,
+        "rows": [{k: r.get(k) for k in REPORT_FIELDS if r.get(k) not in (None, "", [])} for r in rows],
+    }
+
+
+def run_bulk_enrollment(source, rows, client=None, snapshot=None, add_local=None, workers=BULK_WORKERS,
+                        executor=None, threshold=CONFLICT_THRESHOLD, top_k=CONFLICT_TOP_K, re_enroll=False,
+                        dry_run=False, upload_photos=True, chunk_size=BULK_UPSERT_CHUNK):
+    """
+    Run the whole pipeline over manifest ``rows`` and return the report.
+    ``add_local(records)`` receives the committed templates (template store
+    record format) once at the end; ``re_enroll`` reports conflicts but
+    enrolls anyway, like register_face's flag.
+    """
+    validate_rows(rows)
+    encode_rows([r for r in rows if "status" not in r], source, workers, executor)
+    find_conflicts(rows, snapshot, threshold, top_k)
+    for r in rows:
+        if "status" in r:
+            continue
+        if r["conflicts"] and not re_enroll:
+            nearest = min(r["conflicts"], key=lambda c: c["distance"])
+            r["status"] = "CONFLICT"
+            r["message"] = f"Looks like {nearest['name'] or nearest['employee_id']} ({nearest['source']})"
+        else:
+            r["status"] = "ACCEPTED"
+
+    if not dry_run and client is not None:
+        committed = commit_rows(rows, client, source, chunk_size, upload_photos)
+        if committed and add_local is not None:
+            add_local([{"employee_id": r["employee_id"], "face_embedding": r["embedding"], "name": r["name"],
+                        "role": r["role"], "template_id": r.get("template_id")} for r in committed])
+    return build_report(rows)
+
+
+def load_job(path_or_data, manifest_text=None):
+    """(source, rows) for a folder or zip, with the manifest found inside it unless given."""
+    source = open_source(path_or_data)
+    if manifest_text is not None:
+        return source, read_manifest(manifest_text)
+    name = source.find_manifest()
+    if name is None:
+        raise ValueError(f"No {MANIFEST_NAME} found in the photos; supply the manifest separately")
+    return source, read_manifest(source.read(name).decode("utf-8"), base=posixpath.dirname(name))
+
+
+def write_report(report, path):
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for r in report["rows"]:
+            writer.writerow({**r, "conflicts": json.dumps(r["conflicts"]) if r.get("conflicts") else ""})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-enroll employee photos from a folder or zip")
+    parser.add_argument("source", help="folder or .zip with photos (and manifest.csv)")
+    parser.add_argument("--manifest", help="CSV manifest (default: manifest.csv inside the source)")
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS, help="encoder processes (0 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=BULK_UPSERT_CHUNK, help="face_templates rows per insert")
+    parser.add_argument("--threshold", type=float, default=CONFLICT_THRESHOLD)
+    parser.add_argument("--re-enroll", action="store_true", help="enroll rows even if they conflict")
+    parser.add_argument("--dry-run", action="store_true", help="encode and check only; write nothing")
+    parser.add_argument("--no-photos", action="store_true", help="do not upload photos to storage")
+    parser.add_argument("--report", help="write the per-row report (.csv or .json)")
+    args = parser.parse_args(argv)
+
+    from supabase_client import get_client
+    from template_store import parse_embedding
+    from template_sync import fetch_all_templates
+
+    manifest_text = None
+    if args.manifest:
+        with open(args.manifest, "r", encoding="utf-8") as f:
+            manifest_text = f.read()
+    source, rows = load_job(args.source, manifest_text)
+    client = get_client()
+    # Conflict check against everyone already enrolled (the same snapshot shape the engine builds)
+    records, _ = fetch_all_templates(client)
+    records = [r for r in records if parse_embedding(r.get("face_embedding")) is not None]
+    snapshot = GallerySnapshot.build([parse_embedding(r["face_embedding"]) for r in records], records, version=0)
+    print(f"[BULK] {len(rows)} manifest rows, {len(snapshot)} enrolled templates to check against")
+    report = run_bulk_enrollment(source, rows, client=client, snapshot=snapshot, workers=args.workers,
+                                 threshold=args.threshold, re_enroll=args.re_enroll, dry_run=args.dry_run,
+                                 upload_photos=not args.no_photos, chunk_size=args.chunk_size)
+    print(f"[BULK] {json.dumps(report['summary'])}")
+    if args.report:
+        write_report(report, args.report)
+        print(f"[BULK] Report written to {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Worker-pool face encoding engine.
+
+dlib's HOG detector and ResNet encoder are CPU bound and hold the GIL, so
+calling them from an ``async def`` handler stalls every other request on the
+uvicorn event loop. EncodingEngine moves that work into a process pool whose
+workers load the dlib models once at start-up, and caps the number of
+in-flight jobs so a burst of scans is rejected early (503 + Retry-After)
+instead of queueing without bound. A worker that dies (OOM kill, dlib crash)
+breaks the whole ProcessPoolExecutor; the engine then replaces the pool so
+only the jobs in flight at the time fail.
+
+Configuration (environment):
+    ENCODER_WORKERS      process count; 0 runs encodes on a single in-process
+                         thread (useful on Windows dev boxes and in tests)
+    ENCODER_MAX_QUEUE    max jobs running + waiting before EngineBusy
+    ENCODER_RETRY_AFTER  seconds advertised to clients in Retry-After
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from face_detection import detect_faces, resolve_backend
+
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+ENCODER_MAX_QUEUE = int(os.getenv("ENCODER_MAX_QUEUE", max(1, ENCODER_WORKERS) * 4))
+ENCODER_RETRY_AFTER = int(os.getenv("ENCODER_RETRY_AFTER", 2))
+
+
+class EngineBusy(Exception):
+    """Raised when the encode queue is full; callers should answer 503."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Encoding queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+# --- Worker side (runs inside each pool process) ---
+_face_recognition = None
+
+def _init_worker():
+    """Import face_recognition and run one dummy pass so the dlib models are resident."""
+    global _face_recognition
+    import face_recognition
+    try:
+        resolve_backend()
+        face_recognition.face_encodings(np.zeros((64, 64, 3), dtype=np.uint8))
+    except Exception as e:
+        print(f"[ENCODER] Worker warm-up failed: {e}")
+    _face_recognition = face_recognition
+
+def _encode_frame(frame, known_face_locations=None):
+    if _face_recognition is None:
+        _init_worker()
+    return _face_recognition.face_encodings(frame, known_face_locations=known_face_locations)
+
+def _detect_and_encode(frame, detector=None, roi=None):
+    """Detection stage (downscaled, ROI-first) then encoding of the full-resolution boxes only."""
+    if _face_recognition is None:
+        _init_worker()
+    locations = detect_faces(frame, backend=detector, roi=roi)
+    if not locations:
+        return [], []
+    return _face_recognition.face_encodings(frame, known_face_locations=locations), locations
+
+def _detect(frame, detector=None, roi=None):
+    """Detection stage only (session follow-up frames): face boxes, largest first."""
+    return detect_faces(frame, backend=detector, roi=roi)
+
+def _encode_frames(frames, detector=None):
+    return [_detect_and_encode(frame, detector)[0] for frame in frames]
+
+def _warm_up():
+    """Synthetic detection + encoding pass; returns the worker pid."""
+    if _face_recognition is None:
+        _init_worker()
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    detect_faces(frame)
+    _face_recognition.face_encodings(frame, known_face_locations=[(40, 200, 200, 40)])
+    return os.getpid()
+
+
+# --- Event-loop side ---
+class EncodingEngine:
+    def __init__(self, workers=ENCODER_WORKERS, max_queue=ENCODER_MAX_QUEUE, retry_after=ENCODER_RETRY_AFTER):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            print(f"[ENCODER] Process pool started with {self.workers} workers (queue limit {self.max_queue}).")
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder", initializer=_init_worker)
+            print(f"[ENCODER] In-process encoder thread started (queue limit {self.max_queue}).")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def warm_up(self):
+        """
+        Start the pool and run one synthetic inference per worker, so every
+        process has spawned and loaded the dlib models before the first scan.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up)
+                                      for _ in range(max(1, self.workers))))
+        print(f"[ENCODER] Warm-up finished on {len(set(pids))} worker(s).")
+        return len(set(pids))
+
+    def _restart(self, broken):
+        """Replace a pool broken by a dead worker; fresh workers run _init_worker again."""
+        if self._executor is not broken:
+            return  # Another job that was in flight already replaced it
+        self.restarts += 1
+        print(f"[ENCODER] Worker pool broke; restarting it (restart #{self.restarts}).")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+
+    async def _submit(self, fn, *args, count_busy=True):
+        # Counters only touched from the event loop thread, so no lock is needed.
+        # count_busy=False for callers that wait and retry rather than answer 503.
+        if self._pending >= self.max_queue:
+            if count_busy:
+                self.rejected += 1
+            raise EngineBusy(self.retry_after)
+        self.start()
+        executor = self._executor
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(executor, fn, *args)
+            self.completed += 1
+            return result
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        finally:
+            self._pending -= 1
+
+    async def encode(self, frame, known_face_locations=None):
+        """Return the face_recognition encodings for ``frame`` without blocking the loop."""
+        return await self._submit(_encode_frame, frame, known_face_locations)
+
+    async def detect_and_encode(self, frame, detector=None, roi=None):
+        """Run the detection stage + encoder; returns (encodings, face boxes), largest face first."""
+        return await self._submit(_detect_and_encode, frame, detector, roi)
+
+    async def detect(self, frame, detector=None, roi=None):
+        """Face boxes only, no encoding; used to follow a face that was already verified."""
+        return await self._submit(_detect, frame, detector, roi)
+
+    async def encode_batch(self, frames, detector=None):
+        """Encode several frames as one pool job; returns one encodings list per frame."""
+        return await self._submit(_encode_frames, frames, detector)
+
+    def background(self, loop, share=0.5):
+        """
+        Executor-style handle for batch jobs running on another thread (bulk
+        enrollment). Jobs go through this engine's pool and queue limit rather
+        than a second pool, hold at most ``share`` of the queue so live
+        requests keep room, and wait instead of failing when the engine is busy.
+        """
+        return BackgroundSubmitter(self, loop, max(1, int(self.max_queue * share)))
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+        }
+
+
+class BackgroundSubmitter:
+    """See EncodingEngine.background; ``submit`` blocks the calling thread while all its slots are in use."""
+
+    def __init__(self, engine, loop, slots):
+        self.engine = engine
+        self.loop = loop
+        self.slots = slots
+        self._slots = threading.BoundedSemaphore(slots)
+
+    async def _run(self, fn, args):
+        while True:
+            try:
+                return await self.engine._submit(fn, *args, count_busy=False)
+            except EngineBusy as busy:
+                await asyncio.sleep(busy.retry_after)
+
+    def submit(self, fn, *args):
+        """Queue ``fn(*args)`` on the engine; returns a concurrent.futures.Future."""
+        self._slots.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._run(fn, args), self.loop)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
@@ -0,0 +1,263 @@
+"""
+Immutable gallery snapshots.
+
+The verify path used to read FACE_VECTORS, FACE_MATCHER and FACE_METADATA as
+separate globals that a refresh reassigned one after another, so a refresh
+landing between two reads could pair a row index from one gallery with the
+metadata of another (wrong identity or IndexError). A GallerySnapshot bundles
+everything a request needs (unit-normalised matrix, metadata, per-row id
+arrays, template-id -> row index, matcher, version) and is never mutated
+after it is built; Gallery publishes a new one with a single reference swap.
+Readers take ``gallery.current`` once per request and use only that.
+
+Compact mode (MATCHER_BACKEND int8 / float16 plus a ``rerank_prefix``): the
+matcher keeps only the quantized codes in RAM and the unit-normalised
+float32 rows go to ``<rerank_prefix>.rerank.<version>.f32``, mapped
+read-only and used for the exact re-rank of each query's candidates. Every
+snapshot owns its file (the template store's own matrix is remapped and
+replaced on grow/compaction, which an open mapping would block on Windows),
+and the file is deleted when the last reference to the snapshot goes away.
+Builds stream the store in chunks, so a refresh never materialises the whole
+float32 gallery in RAM either (~150 bytes per template instead of ~700).
+"""
+import glob
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from matcher import MATCHER_BACKEND, QUANTIZED_BACKENDS, build_matcher
+from template_store import EMBEDDING_DIM, META_FIELDS, parse_embedding
+
+CHUNK_ROWS = 65536
+
+
+def _normalise(vectors):
+    # Ensure unit vectors for cosine similarity via dot product
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def _frozen(array):
+    array.setflags(write=False)
+    return array
+
+
+def _chunks(raw_vectors):
+    """Row blocks of an array (or list of rows), or the blocks of an iterator such as FaceTemplateStore.iter_vectors()."""
+    if isinstance(raw_vectors, (np.ndarray, list, tuple)):
+        raw_vectors = np.asarray(raw_vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        return (raw_vectors[start:start + CHUNK_ROWS] for start in range(0, len(raw_vectors), CHUNK_ROWS))
+    return (np.asarray(chunk, dtype=np.float32).reshape(-1, EMBEDDING_DIM) for chunk in raw_vectors)
+
+
+def rerank_path(prefix, version):
+    return f"{prefix}.rerank.{version}.f32"
+
+
+def _release_rerank_file(mapping, path):
+    mapping.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _materialise(chunks, path=None):
+    """
+    Collect normalised row blocks into one matrix: in RAM, or written to
+    ``path`` and mapped read-only (the file is removed with the mapping).
+    """
+    if path is None:
+        blocks = list(chunks)
+        return np.concatenate(blocks) if blocks else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    count = 0
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+            count += len(chunk)
+    if count == 0:
+        os.remove(path)  # np.memmap cannot map an empty file
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    vectors = np.memmap(path, dtype=np.float32, mode="r", shape=(count, EMBEDDING_DIM))
+    weakref.finalize(vectors, _release_rerank_file, vectors._mmap, path)
+    return vectors
+
+
+class GallerySnapshot:
+    def __init__(self, vectors, metadata, version, previous=None, backend=None, rerank_prefix=None):
+        """
+        ``vectors`` must already be unit-normalised; use ``build`` for raw store
+        rows. ``backend`` and ``rerank_prefix`` default to those of ``previous``.
+        """
+        self.backend, self.rerank_prefix = self._layout(previous, backend, rerank_prefix)
+        if not isinstance(vectors, np.memmap):
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self.vectors = _frozen(vectors)
+        self.metadata = tuple(metadata)
+        self.version = version
+        self.built_at = time.time()
+        self.employee_ids = _frozen(np.array([m["employee_id"] for m in self.metadata], dtype=object))
+        self.row_by_template = {
+            m["template_id"]: row for row, m in enumerate(self.metadata) if m.get("template_id") is not None
+        }
+        if len(self.metadata):
+            # Segment index per template row so matching can reduce to one distance per employee.
+            group_keys, groups = np.unique(self.employee_ids.astype(str), return_inverse=True)
+        else:
+            group_keys, groups = np.empty(0, dtype=str), np.empty(0, dtype=np.int64)
+        self.group_keys = _frozen(group_keys)  # employee_id (as str) of each group, sorted
+        self.groups = _frozen(groups.reshape(-1))
+        self.matcher = build_matcher(self.vectors, groups=self.groups, backend=self.backend,
+                                     previous=previous.matcher if previous is not None else None)
+        # Set by patched(): {"base": previous version, "dropped": removed rows, "employees": touched ids}
+        self.delta = None
+
+    @property
+    def compact(self):
+        """Float32 rows live in a memory-mapped re-rank file rather than RAM."""
+        return isinstance(self.vectors, np.memmap)
+
+    @staticmethod
+    def _layout(previous, backend, rerank_prefix):
+        if previous is not None:
+            backend = backend or previous.backend
+            rerank_prefix = rerank_prefix or previous.rerank_prefix
+        return (backend or MATCHER_BACKEND).lower(), rerank_prefix
+
+    @classmethod
+    def _from_chunks(cls, chunks, metadata, version, previous, backend, rerank_prefix):
+        backend, rerank_prefix = cls._layout(previous, backend, rerank_prefix)
+        path = None
+        if backend in QUANTIZED_BACKENDS and rerank_prefix:
+            path = rerank_path(rerank_prefix, version)
+        return cls(_materialise(chunks, path), metadata, version, previous, backend, rerank_prefix)
+
+    @classmethod
+    def build(cls, raw_vectors, metadata, version, previous=None, backend=None, rerank_prefix=None):
+        """``raw_vectors``: store rows as one array or an iterable of row blocks (streamed)."""
+        chunks = (_normalise(chunk) for chunk in _chunks(raw_vectors) if len(chunk))
+        return cls._from_chunks(chunks, metadata, version, previous, backend, rerank_prefix)
+
+    @classmethod
+    def empty(cls, backend=None, rerank_prefix=None):
+        return cls(np.empty((0, EMBEDDING_DIM), dtype=np.float32), [], 0,
+                   backend=backend, rerank_prefix=rerank_prefix)
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def employee_count(self):
+        return len(set(self.employee_ids.tolist()))
+
+    def rows_for_employees(self, employee_ids):
+        """Rows (ascending) of every template belonging to ``employee_ids``."""
+        wanted = np.array(sorted({str(e) for e in employee_ids}), dtype=str)
+        if len(wanted) == 0 or len(self.group_keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.group_keys, wanted), len(self.group_keys) - 1)
+        present = idx[self.group_keys[idx] == wanted]
+        return np.flatnonzero(np.isin(self.groups, present))
+
+    def nearest_employees(self, probe, k=3):
+        """
+        The k closest employees to ``probe`` (best template each) via the same
+        matcher verification uses: [{"employee_id", "name", "template_id", "distance"}].
+        """
+        if len(self.metadata) == 0:
+            return []
+        _, distances, rows = self.matcher.search_groups(np.asarray(probe, dtype=np.float32), k=k)
+        return [
+            {
+                "employee_id": self.metadata[row]["employee_id"],
+                "name": self.metadata[row].get("name"),
+                "template_id": self.metadata[row].get("template_id"),
+                "distance": float(d),
+            }
+            for d, row in zip(distances, rows)
+        ]
+
+    def patched(self, upserts, deletions, version):
+        """
+        Copy-on-write delta: a new snapshot with ``deletions`` ({"employee_id",
+        "template_id"}; template_id None = every template of the employee)
+        removed and ``upserts`` (cache-format records) replaced or appended.
+        Rows are copied block by block, so a compact snapshot is never loaded
+        into RAM as a whole.
+        """
+        metadata = list(self.metadata)
+        dropped = set()
+        for d in deletions:
+            if d["template_id"] is None:
+                dropped.update(np.flatnonzero(self.employee_ids == d["employee_id"]).tolist())
+            elif d["template_id"] in self.row_by_template:
+                dropped.add(self.row_by_template[d["template_id"]])
+
+        touched = {self.metadata[row]["employee_id"] for row in dropped}
+        replaced = {}
+        new_vectors, new_metadata = [], []
+        for rec in upserts:
+            vec = parse_embedding(rec.get("face_embedding"))
+            if vec is None:
+                continue
+            norm = np.linalg.norm(vec)
+            vec = vec / norm if norm > 0 else vec
+            meta = {k: rec.get(k) for k in META_FIELDS}
+            row = self.row_by_template.get(rec.get("template_id"))
+            touched.add(meta["employee_id"])
+            if row is not None:
+                touched.add(self.metadata[row]["employee_id"])
+            if row is None or row in dropped:
+                new_vectors.append(vec)
+                new_metadata.append(meta)
+            else:
+                replaced[row] = vec
+                metadata[row] = meta
+
+        keep = np.ones(len(self.vectors), dtype=bool)
+        keep[sorted(dropped)] = False
+
+        def chunks():
+            for start in range(0, len(self.vectors), CHUNK_ROWS):
+                block = np.array(self.vectors[start:start + CHUNK_ROWS])
+                for row in [r for r in replaced if start <= r < start + len(block)]:
+                    block[row - start] = replaced[row]
+                yield block[keep[start:start + len(block)]]
+            if new_vectors:
+                yield np.array(new_vectors, dtype=np.float32)
+
+        if dropped:
+            metadata = [m for i, m in enumerate(metadata) if i not in dropped]
+        metadata = metadata + new_metadata
+        snapshot = GallerySnapshot._from_chunks(chunks(), metadata, version, self, None, None)
+        snapshot.delta = {"base": self.version, "dropped": np.array(sorted(dropped), dtype=np.int64),
+                          "employees": touched}
+        return snapshot
+
+
+class Gallery:
+    """Holder of the current snapshot. Builders serialise on ``lock``; readers never take it."""
+
+    def __init__(self, backend=None, rerank_prefix=None):
+        """``rerank_prefix`` enables compact mode for the int8 / float16 backends (see module docstring)."""
+        if rerank_prefix:
+            for stale in glob.glob(rerank_path(glob.escape(rerank_prefix), "*")):
+                try:
+                    os.remove(stale)  # Left behind by a previous process
+                except OSError:
+                    pass
+        self.current = GallerySnapshot.empty(backend, rerank_prefix)
+        self.lock = threading.RLock()
+        self._version = 0
+
+    def next_version(self):
+        with self.lock:
+            self._version += 1
+            return self._version
+
+    def publish(self, snapshot):
+        self.current = snapshot  # Single reference swap; in-flight requests keep their old snapshot
+        return snapshot
@@ -0,0 +1,107 @@
+"""
+Upload decode stage shared by register and verify.
+
+``Image.open(...).convert("RGB")`` followed by ``np.array`` fully decodes a
+5-12 MP phone photo and copies it twice before detection downscales it again.
+decode_upload instead:
+
+    * asks libjpeg for a DCT-domain downscale (PIL draft mode) so the frame
+      comes out with its longest side in [DECODE_MAX_SIDE, 2 * DECODE_MAX_SIDE)
+      rather than at full sensor resolution,
+    * skips ``convert`` when the decoder already produced RGB and hands the
+      pixels to numpy with a single copy,
+    * accepts raw frames from the terminal without any codec, selected by an
+      explicit content type:
+
+        application/x-raw-rgb; width=W; height=H    packed 8-bit RGB rows
+        application/x-raw-gray; width=W; height=H   8-bit luma (expanded to RGB)
+        image/x-face-chip                           JPEG/PNG of an already
+                                                    cropped face; detection is
+                                                    skipped (detector "none")
+
+Anything else is treated as an encoded image, as before.
+"""
+import io
+import os
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", 1280))
+RAW_RGB = "application/x-raw-rgb"
+RAW_GRAY = "application/x-raw-gray"
+FACE_CHIP = "image/x-face-chip"
+RAW_CHANNELS = {RAW_RGB: 3, RAW_GRAY: 1}
+
+
+class DecodeError(ValueError):
+    """The upload could not be turned into a frame (bad raw geometry, unreadable image)."""
+
+
+class DecodedUpload(NamedTuple):
+    frame: np.ndarray  # HxWx3 uint8 RGB
+    encoded: bool  # True when the upload bytes are a JPEG/PNG of ``frame``
+    chip: bool  # Pre-cropped face: run the encoder with detector "none"
+    scale: float = 1.0  # Frame pixels per original image pixel (< 1 after a draft downscale)
+
+
+def parse_content_type(content_type):
+    """"application/x-raw-rgb; width=640; height=480" -> ("application/x-raw-rgb", {"width": "640", ...})."""
+    media, _, rest = (content_type or "").partition(";")
+    params = {}
+    for part in rest.split(";"):
+        key, _, value = part.partition("=")
+        if key.strip():
+            params[key.strip().lower()] = value.strip().strip('"')
+    return media.strip().lower(), params
+
+
+def _decode_raw(data, channels, params):
+    try:
+        width, height = int(params["width"]), int(params["height"])
+    except (KeyError, ValueError):
+        raise DecodeError("Raw frames need integer width and height content-type parameters.")
+    if width <= 0 or height <= 0 or len(data) != width * height * channels:
+        raise DecodeError(f"Raw frame is {len(data)} bytes, expected {width}x{height}x{channels}.")
+    frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels) # Zero-copy view
+    if channels == 1:
+        frame = np.repeat(frame, 3, axis=2) # The encoder needs RGB
+    return frame
+
+
+def _decode_encoded(data, max_side):
+    """(frame, scale): ``scale`` maps original image coordinates onto the (possibly draft-reduced) frame."""
+    try:
+        img = Image.open(io.BytesIO(data))
+        original_width = img.size[0]
+        if max_side and img.format == "JPEG":
+            w, h = img.size
+            scale = max_side / max(w, h)
+            if scale < 1:
+                # libjpeg picks the largest 1/2, 1/4 or 1/8 reduction still covering this size
+                img.draft("RGB", (int(w * scale), int(h * scale)))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return np.asarray(img), img.size[0] / original_width
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise DecodeError(f"Unreadable image: {e}")
+
+
+def decode_upload(data, content_type=None, max_side=DECODE_MAX_SIDE):
+    """Turn upload bytes into an RGB frame according to ``content_type``."""
+    media, params = parse_content_type(content_type)
+    if media in RAW_CHANNELS:
+        return DecodedUpload(_decode_raw(data, RAW_CHANNELS[media], params), encoded=False, chip=False)
+    if media == FACE_CHIP:
+        frame, _ = _decode_encoded(data, None)
+        return DecodedUpload(frame, encoded=True, chip=True)
+    frame, scale = _decode_encoded(data, max_side)
+    return DecodedUpload(frame, encoded=True, chip=False, scale=scale)
+
+
+def encode_jpeg(frame, quality=90):
+    """JPEG bytes for a frame that arrived raw (e.g. to store the enrolment photo)."""
+    out = io.BytesIO()
+    Image.fromarray(frame).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
@@ -0,0 +1,161 @@
+"""
+Async liveness (anti-spoofing) pipeline stage.
+
+The Gemini call is synchronous, so it runs on a small thread pool under a
+hard latency budget, with a downscaled JPEG instead of the raw upload. A
+short-TTL cache keyed by device + embedding neighbourhood (random-hyperplane
+hash of the matched face) stops the several frames of one approach from
+each re-billing the model. When Gemini is not configured or unreachable, an
+optional local checker stands in.
+
+Configuration (environment):
+    LIVENESS_TIMEOUT      seconds before the stage gives up (fail open)
+    LIVENESS_MAX_SIDE     longest side of the JPEG sent to the model
+    LIVENESS_CACHE_TTL    seconds a device/face verdict is reused
+    LIVENESS_LOCAL        none | sharpness   built-in offline checker
+"""
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+LIVENESS_TIMEOUT = float(os.getenv("LIVENESS_TIMEOUT", 3.0))
+LIVENESS_MAX_SIDE = int(os.getenv("LIVENESS_MAX_SIDE", 512))
+LIVENESS_CACHE_TTL = float(os.getenv("LIVENESS_CACHE_TTL", 10.0))
+LIVENESS_LOCAL = os.getenv("LIVENESS_LOCAL", "none").lower()
+LIVENESS_WORKERS = int(os.getenv("LIVENESS_WORKERS", 4))
+NEIGHBOURHOOD_BITS = 16
+
+LIVENESS_PROMPT = (
+    "Analyze this security camera image. Is this a live, 3D physical human being "
+    "standing in front of the camera? Or is it a 2D photograph, a digital screen, "
+    "or a mask being held up to the camera? "
+    "Reply 'READY' if it is a definite live human. "
+    "Reply 'SPOOF' if you detect a screen, photo, or suspicious 2D artifact."
+)
+
+
+def prepare_payload(image, max_side=LIVENESS_MAX_SIDE):
+    """
+    Downscale and re-encode as a small JPEG. ``image`` is the upload bytes
+    (decoded in JPEG draft mode when possible) or an already decoded RGB frame.
+    """
+    if isinstance(image, np.ndarray):
+        img = Image.fromarray(image)
+    else:
+        img = Image.open(io.BytesIO(image))
+        img.draft("RGB", (max_side, max_side))
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    out.seek(0)
+    return Image.open(out)
+
+
+def sharpness_checker(img):
+    """
+    Crude offline stand-in: re-photographed prints and screens are usually
+    much blurrier than a live face at kiosk distance. Only meant to hold the
+    line while Gemini is unreachable.
+    """
+    grey = np.asarray(img.convert("L"), dtype=np.float32)
+    lap = grey[1:-1, 1:-1] * 4 - grey[:-2, 1:-1] - grey[2:, 1:-1] - grey[1:-1, :-2] - grey[1:-1, 2:]
+    if float(lap.var()) < 20.0:
+        return False, "Potential Spoofing Detected (local)"
+    return True, "Live Human Detected (local)"
+
+
+LOCAL_CHECKERS = {"sharpness": sharpness_checker}
+
+
+class LivenessPipeline:
+    def __init__(self, model=None, local_checker=None, timeout=LIVENESS_TIMEOUT,
+                 cache_ttl=LIVENESS_CACHE_TTL, workers=LIVENESS_WORKERS):
+        self.model = model
+        self.local_checker = local_checker if local_checker is not None else LOCAL_CHECKERS.get(LIVENESS_LOCAL)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="liveness")
+        self._cache = {}
+        self._planes = np.random.default_rng(1234).normal(size=(NEIGHBOURHOOD_BITS, 128)).astype(np.float32)
+        self.stats = {"calls": 0, "cache_hits": 0, "timeouts": 0, "errors": 0, "local": 0}
+
+    @property
+    def enabled(self):
+        return self.model is not None or self.local_checker is not None
+
+    def _cache_key(self, device_id, embedding):
+        if embedding is None:
+            return None
+        bits = (self._planes @ np.asarray(embedding, dtype=np.float32)) > 0
+        return device_id, int(np.packbits(bits).view(">u2")[0])
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry and time.time() - entry[0] <= self.cache_ttl:
+            return entry[1]
+        return None
+
+    def _remember(self, key, verdict):
+        if key is None:
+            return
+        now = time.time()
+        if len(self._cache) > 1024:
+            self._cache = {k: v for k, v in self._cache.items() if now - v[0] <= self.cache_ttl}
+        self._cache[key] = (now, verdict)
+
+    def _run_model(self, image):
+        img = prepare_payload(image)
+        if self.model is None:
+            self.stats["local"] += 1
+            return self.local_checker(img)
+        try:
+            response = self.model.generate_content([LIVENESS_PROMPT, img])
+        except Exception:
+            if self.local_checker is None:
+                raise
+            self.stats["local"] += 1
+            return self.local_checker(img)
+        if "READY" in response.text.strip().upper():
+            return True, "Live Human Detected"
+        return False, "Potential Spoofing Detected"
+
+    async def check(self, image, device_id="terminal_01", embedding=None):
+        """
+        Return (is_live, message) within the latency budget; fails open on
+        timeout/error. ``image`` is upload bytes or a decoded RGB frame.
+        """
+        if not self.enabled:
+            return True, "Disabled"
+
+        key = self._cache_key(device_id, embedding)
+        cached = self._cached(key) if key else None
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        self.stats["calls"] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            verdict = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._run_model, image), self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            print(f"⚠️ Liveness budget exceeded ({self.timeout}s), skipping.")
+            return True, "Timeout-Skipped"
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"❌ Gemini Liveness Error: {e}")
+            return True, "Error-Skipped" # Fail open for reliability, but log error
+
+        self._remember(key, verdict)
+        return verdict
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
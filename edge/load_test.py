@@ -1,54 +1,342 @@
+"""
+Open-loop load generator for the biometric engine (default port 8001).
+
+Requests are launched on a fixed arrival schedule (uniform or Poisson) no
+matter how slowly the server answers, and every latency is measured from the
+request's *scheduled* start, so queueing inside the engine shows up instead
+of being hidden by a closed loop (coordinated omission). The default workload
+mixes single-frame verify, batch verify, door-status, cache-status and health
+calls with real face images and never enrolls anyone.
+
+It is not read-only: a verify that matches a real employee writes an
+access_logs row and an attendance event, exactly as a scan at the door would.
+Point it at a staging project (or images of nobody enrolled) when that
+matters.
+
+Verify calls identify as --device-id, by default the engine's shared
+DEFAULT_DEVICE_ID. The engine never fuses frames of that identity into
+sessions (sessions.py), so every verify runs the full decode, encode and
+match path; it is also the id a PARTITION_STRICT engine is expected to map.
+Pass a terminal's own id to measure the session path instead.
+
+Modes:
+    constant   --rate R for --duration seconds
+    ramp       --ramp-from .. --ramp-to in --ramp-step increments, each step
+               held --step-duration seconds (finds the knee of the curve)
+    soak       --rate R for a long --duration, with a report every --interval
+
+Examples:
+    python load_test.py --rate 5 --duration 60
+    python load_test.py --mode ramp --ramp-from 1 --ramp-to 20 --ramp-step 2 --output ramp.json
+    python load_test.py --mode soak --rate 3 --duration 3600 --interval 300
+
+Register calls write LOADTEST-* rows to face_templates and photos to storage,
+so they only run with an explicit --register WEIGHT; their enrollments are
+deleted afterwards unless --keep-enrollments is given. Use --images with
+distinct faces for them: re-registering the same sample photos mostly hits
+the duplicate-face guard and measures that instead of an enrollment.
+"""
+import argparse
 import asyncio
-import httpx
-import time
 import io
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
 from PIL import Image
 
-API_URL = "http://localhost:8000"
-
-async def simulate_request(client, request_id):
-    """
-    Simulate a single face verification request with a dummy image.
-    """
-    # Create a small dummy image
-    img = Image.new('RGB', (100, 100), color='white')
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='JPEG')
-    img_byte_arr = img_byte_arr.getvalue()
-    
-    files = {"file": ("test.jpg", img_byte_arr, "image/jpeg")}
-    
-    start = time.time()
+API_URL = os.getenv("BIOMETRIC_API_URL", "http://localhost:8001")
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGES = [os.path.join(HERE, "debug_verify.jpg"), os.path.join(HERE, "..", "backend", "bharat.jpg")]
+DEFAULT_DEVICE_ID = os.getenv("DEFAULT_DEVICE_ID", "terminal_01")  # Same default as partitions.py
+DEFAULT_MIX = "verify=70,verify_batch=10,door_status=8,cache_status=7,health=5"
+BATCH_FRAMES = 3
+WRITE_ENDPOINTS = ("register",)
+
+
+# --- Workload ---
+def load_images(paths, max_side):
+    """JPEG payloads of the sample faces, resized like a kiosk camera frame."""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(load_images([os.path.join(path, f) for f in sorted(os.listdir(path))
+                                       if f.lower().endswith((".jpg", ".jpeg", ".png"))], max_side))
+            continue
+        if not os.path.exists(path):
+            continue
+        img = Image.open(path).convert("RGB")
+        img.thumbnail((max_side, max_side))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=90)
+        images.append((os.path.basename(path), out.getvalue()))
+    if not images:
+        sys.exit("No face images found; pass --images <files or folder>.")
+    return images
+
+
+def parse_mix(text, register=0.0):
+    """Endpoint weights from ``text``; enrolling endpoints only via ``register`` (the --register flag)."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name and float(weight or 0) > 0:
+            mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    writes = set(mix) & set(WRITE_ENDPOINTS)
+    if writes:
+        sys.exit(f"{', '.join(sorted(writes))} writes to Supabase; use --register WEIGHT instead of --mix.")
+    if register > 0:
+        mix["register"] = register
+    return mix
+
+
+async def call_verify(client, ctx):
+    name, data = random.choice(ctx["images"])
+    return await client.post("/api/biometrics/face/verify", files={"file": (name, data, "image/jpeg")},
+                             data={"device_id": ctx["device_id"]})
+
+
+async def call_verify_batch(client, ctx):
+    frames = [random.choice(ctx["images"]) for _ in range(BATCH_FRAMES)]
+    return await client.post("/api/biometrics/face/verify/batch",
+                             files=[("files", (name, data, "image/jpeg")) for name, data in frames],
+                             data={"device_id": ctx["device_id"]})
+
+
+async def call_register(client, ctx):
+    name, data = random.choice(ctx["images"])
+    employee_id = f"LOADTEST-{next(ctx['register_ids']):06d}"
+    ctx["registered"].append(employee_id)
+    return await client.post("/api/biometrics/face/register", files={"file": (name, data, "image/jpeg")},
+                             data={"employeeId": employee_id, "email": f"{employee_id.lower()}@loadtest.local",
+                                   "name": employee_id})
+
+
+async def call_door_status(client, ctx):
+    return await client.get("/api/door/status")
+
+
+async def call_cache_status(client, ctx):
+    return await client.get("/api/biometrics/cache/status")
+
+
+async def call_health(client, ctx):
+    return await client.get("/health")
+
+
+ENDPOINTS = {
+    "verify": call_verify,
+    "verify_batch": call_verify_batch,
+    "health": call_health,
+    "register": call_register,
+    "door_status": call_door_status,
+    "cache_status": call_cache_status,
+}
+
+
+def outcome_of(response):
+    """HTTP status plus the engine's own error_code, e.g. "200:NOT_RECOGNIZED" or "503"."""
+    if response.status_code != 200:
+        return str(response.status_code)
     try:
-        response = await client.post(f"{API_URL}/api/biometrics/face/verify", files=files)
-        latency = (time.time() - start) * 1000
-        status = response.status_code
-        print(f"Request {request_id}: Status {status}, Latency {latency:.2f}ms")
-        return latency
+        body = response.json()
+    except ValueError:
+        return "200:non_json"
+    if isinstance(body, dict) and body.get("success") is False:
+        return f"200:{body.get('error_code', 'failed')}"
+    return "200:ok"
+
+
+# --- Statistics ---
+class Stats:
+    def __init__(self):
+        self.samples = {}  # endpoint -> [latency_ms from scheduled start]
+        self.outcomes = {}  # endpoint -> {outcome: count}
+        self.lag_ms = []  # how late the generator itself launched requests
+        self.dropped = 0
+
+    def record(self, endpoint, latency_ms, outcome):
+        self.samples.setdefault(endpoint, []).append(latency_ms)
+        counts = self.outcomes.setdefault(endpoint, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    def report(self, elapsed):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "throughput_rps": round(len(ordered) / elapsed, 3) if elapsed else 0.0,
+                "p50_ms": round(percentile(ordered, 50), 1),
+                "p95_ms": round(percentile(ordered, 95), 1),
+                "p99_ms": round(percentile(ordered, 99), 1),
+                "max_ms": round(ordered[-1], 1),
+                "outcomes": dict(sorted(self.outcomes[endpoint].items())),
+            }
+        completed = sum(len(s) for s in self.samples.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "completed": completed,
+            "achieved_rps": round(completed / elapsed, 3) if elapsed else 0.0,
+            "dropped_client_side": self.dropped,
+            "generator_lag_p99_ms": round(percentile(sorted(self.lag_ms), 99), 1) if self.lag_ms else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def print_report(title, report):
+    print(f"\n== {title}: {report['completed']} requests in {report['elapsed_s']}s "
+          f"({report['achieved_rps']} rps, {report['dropped_client_side']} dropped client-side, "
+          f"generator lag p99 {report['generator_lag_p99_ms']}ms)")
+    print(f"{'endpoint':<14}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  outcomes")
+    for endpoint, r in report["endpoints"].items():
+        outcomes = ", ".join(f"{k}={v}" for k, v in r["outcomes"].items())
+        print(f"{endpoint:<14}{r['requests']:>7}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}  {outcomes}")
+
+
+# --- Open-loop driver ---
+async def fire(client, ctx, endpoint, scheduled, stats, semaphore):
+    try:
+        response = await ENDPOINTS[endpoint](client, ctx)
+        outcome = outcome_of(response)
+    except httpx.TimeoutException:
+        outcome = "timeout"
     except Exception as e:
-        print(f"Request {request_id} FAILED: {str(e)}")
-        return None
-
-async def run_crow_test(concurrency=10, total_requests=50):
-    """
-    Simulates high concurrent load on the Biometric API.
-    """
-    print(f"📦 Starting Crow Test: {concurrency} concurrent, {total_requests} total requests...")
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        tasks = []
-        for i in range(total_requests):
-            tasks.append(simulate_request(client, i))
-            
-            # Control concurrency
-            if len(tasks) >= concurrency:
-                await asyncio.gather(*tasks)
-                tasks = []
-        
-        if tasks:
-            results = await asyncio.gather(*tasks)
-            
-    print("\n✅ Crow Test Complete.")
+        outcome = f"error:{type(e).__name__}"
+    finally:
+        semaphore.release()
+    stats.record(endpoint, (time.perf_counter() - scheduled) * 1000.0, outcome)
+
+
+async def run_phase(client, ctx, rate, duration, stats, args, on_interval=None):
+    """Launch requests at ``rate``/s for ``duration`` s without waiting on responses."""
+    names, weights = zip(*ctx["mix"].items())
+    semaphore = asyncio.Semaphore(args.max_in_flight)
+    tasks = set()
+    start = time.perf_counter()
+    next_at = start
+    next_report = start + args.interval if on_interval else None
+    while next_at - start < duration:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.lag_ms.append(max(0.0, -delay) * 1000.0)
+        endpoint = random.choices(names, weights)[0]
+        if semaphore.locked():
+            stats.dropped += 1  # Client cap reached; counted, never silently queued
+        else:
+            await semaphore.acquire()
+            task = asyncio.create_task(fire(client, ctx, endpoint, next_at, stats, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if next_report and time.perf_counter() >= next_report:
+            on_interval(time.perf_counter() - start)
+            next_report += args.interval
+        gap = random.expovariate(rate) if args.arrival == "poisson" else 1.0 / rate
+        next_at += gap
+    if tasks:
+        await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+async def cleanup(client, ctx):
+    for employee_id in ctx["registered"]:
+        try:
+            await client.delete(f"/api/biometrics/face/{employee_id}")
+        except httpx.HTTPError as e:
+            print(f"Cleanup of {employee_id} failed: {e}")
+    print(f"Cleaned up {len(ctx['registered'])} LOADTEST enrollments.")
+
+
+async def run(args):
+    ctx = {
+        "images": load_images(args.images or DEFAULT_IMAGES, args.max_side),
+        "mix": parse_mix(args.mix, args.register),
+        "device_id": args.device_id,
+        "register_ids": itertools.count(int(time.time()) % 100000 * 10),
+        "registered": [],
+    }
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    results = {"url": args.url, "mode": args.mode, "mix": ctx["mix"], "arrival": args.arrival, "phases": []}
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        try:
+            (await client.get("/health")).raise_for_status()
+        except httpx.HTTPError as e:
+            sys.exit(f"Engine at {args.url} is not reachable: {e}")
+
+        if args.mode == "ramp":
+            rate = args.ramp_from
+            while rate <= args.ramp_to + 1e-9:
+                stats = Stats()
+                elapsed = await run_phase(client, ctx, rate, args.step_duration, stats, args)
+                report = {"target_rps": rate, **stats.report(elapsed)}
+                print_report(f"ramp step {rate} rps", report)
+                results["phases"].append(report)
+                rate += args.ramp_step
+        else:
+            stats = Stats()
+            on_interval = None
+            if args.mode == "soak":
+                on_interval = lambda t: print_report(f"soak t={int(t)}s (cumulative)", stats.report(t))
+            elapsed = await run_phase(client, ctx, args.rate, args.duration, stats, args, on_interval)
+            report = {"target_rps": args.rate, **stats.report(elapsed)}
+            print_report(f"{args.mode} {args.rate} rps", report)
+            results["phases"].append(report)
+
+        if not args.keep_enrollments and ctx["registered"]:
+            await cleanup(client, ctx)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load test for the biometric engine")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--mode", choices=("constant", "ramp", "soak"), default="constant")
+    parser.add_argument("--rate", type=float, default=2.0, help="arrivals per second (constant/soak)")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds (constant/soak)")
+    parser.add_argument("--interval", type=float, default=60.0, help="soak report interval, seconds")
+    parser.add_argument("--ramp-from", type=float, default=1.0)
+    parser.add_argument("--ramp-to", type=float, default=10.0)
+    parser.add_argument("--ramp-step", type=float, default=1.0)
+    parser.add_argument("--step-duration", type=float, default=30.0)
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="endpoint weights (verify, verify_batch, door_status, cache_status, health); "
+                             "verify still writes access logs and attendance for matched employees")
+    parser.add_argument("--register", type=float, default=0.0,
+                        help="weight of register calls; these enroll LOADTEST-* employees in Supabase")
+    parser.add_argument("--images", nargs="*", help="face images or folders (default: bundled samples)")
+    parser.add_argument("--max-side", type=int, default=1280, help="resize images so the longest side is this")
+    parser.add_argument("--device-id", default=DEFAULT_DEVICE_ID,
+                        help="device_id sent with verify; the default bypasses session fusion")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="client-side cap on open requests")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--keep-enrollments", action="store_true",
+                        help="do not delete the LOADTEST enrollments made by --register afterwards")
+    parser.add_argument("--output", help="write JSON results here")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
 
 if __name__ == "__main__":
-    asyncio.run(run_crow_test(concurrency=5, total_requests=25))
+    main()
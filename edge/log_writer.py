@@ -0,0 +1,124 @@
+"""
+Coalescing access-log writer.
+
+Verify handlers used to fire one synchronous Supabase insert per scan on the
+event loop. AccessLogWriter takes records through a bounded asyncio queue
+and a single background task sends them as bulk inserts, whenever
+LOG_BATCH_SIZE records are waiting or LOG_FLUSH_INTERVAL seconds have passed
+since the first one. The blocking client runs in a worker thread. A batch
+that fails, or a record that arrives while the queue is full, is spilled to
+the durable pending-log journal instead of being dropped.
+
+Configuration (environment):
+    LOG_QUEUE_MAX        records buffered in memory before spilling
+    LOG_BATCH_SIZE       max records per bulk insert
+    LOG_FLUSH_INTERVAL   max seconds a record waits for its batch
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", 1000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 50))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))
+
+
+class AccessLogWriter:
+    def __init__(self, insert, spill, max_queue=LOG_QUEUE_MAX, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        """``insert(records)`` sends one bulk insert; ``spill(records)`` persists records that could not be sent."""
+        self.insert = insert
+        self.spill = spill
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+        self._collecting = []  # Records taken off the queue for the batch being collected
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="access-log")
+        self.stats = {"submitted": 0, "inserted": 0, "batches": 0, "spilled": 0, "lost": 0}
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, record):
+        """Queue one record without blocking; spills straight to the journal when the queue is full."""
+        self.stats["submitted"] += 1
+        if self._queue is None:
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._executor.submit(self._spill, [record])
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _next_batch(self):
+        # Collected on self rather than a local, so stop() can still write out a half-built batch.
+        batch = self._collecting
+        batch.append(await self._queue.get())
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        self._collecting = []
+        return batch
+
+    def _drain_nowait(self):
+        batch = []
+        while self._queue is not None and not self._queue.empty() and len(batch) < self.batch_size:
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.insert(batch)
+            self.stats["inserted"] += len(batch)
+            self.stats["batches"] += 1
+            print(f"[LOG] {len(batch)} access logs synced")
+        except Exception as e:
+            print(f"[WARNING] Access log batch failed, queuing {len(batch)} logs: {e}")
+            self._spill(batch)
+
+    def _spill(self, batch):
+        # Must not raise: an exception here would end the _run task and stop all log writes.
+        try:
+            self.spill(batch)
+            self.stats["spilled"] += len(batch)
+        except Exception as e:
+            self.stats["lost"] += len(batch)
+            print(f"[ERROR] Could not journal {len(batch)} access logs, dropping them: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            await loop.run_in_executor(self._executor, self._write, batch)
+
+    async def stop(self):
+        """Cancel the background task and write out whatever is still buffered, including a half-built batch."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        loop = asyncio.get_running_loop()
+        if self._collecting:
+            batch, self._collecting = self._collecting, []
+            await loop.run_in_executor(self._executor, self._write, batch)
+        while True:
+            batch = self._drain_nowait()
+            if not batch:
+                break
+            await loop.run_in_executor(self._executor, self._write, batch)
+        self._executor.shutdown(wait=True)
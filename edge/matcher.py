@@ -0,0 +1,373 @@
+"""
+Pluggable 1:N face matchers.
+
+Every backend exposes the same ``search(probe, k)`` call returning the k
+nearest gallery rows and their Euclidean distances (ascending), and
+``search_groups(probe, k)`` which first reduces rows to one min distance per
+group (employee, when several templates are enrolled per person) so the
+ambiguity gap compares different people rather than two templates of the
+same person. ``classify_match`` turns that top-2 into the access decision;
+the thresholds live here so the API, bulk enrollment and the benchmarks
+share one copy. Both grouped searches take an optional ``subset`` (RowSubset) that
+restricts them to some rows of the gallery, e.g. one door's partition, without
+copying those rows out of the matcher.
+
+    exact  brute-force scan; top-k via np.argpartition instead of a full sort
+    ivf    inverted-file index: k-means coarse quantiser in pure NumPy, only
+           the ``nprobe`` closest cells are scanned exactly
+    int8 / float16
+           compact scan: scalar-quantized codes (int8 with a per-dimension
+           scale, or float16) rank every row approximately, then only the
+           ``RERANK_CANDIDATES`` best rows are re-scored in float32. The
+           float32 rows are only touched for those candidates, so they can
+           live in a memory-mapped file (see gallery.py) instead of RAM.
+
+Configuration (environment):
+    MATCHER_BACKEND   exact | ivf | int8 | float16     (default exact)
+    IVF_MIN_SIZE      galleries smaller than this always use exact
+    IVF_NPROBE        cells scanned per query
+    RERANK_CANDIDATES rows re-ranked exactly per query by int8 / float16
+    CONFLICT_TOP_K    nearest employees checked for enrollment conflicts
+"""
+import os
+
+import numpy as np
+
+MATCHER_BACKEND = os.getenv("MATCHER_BACKEND", "exact").lower()
+IVF_MIN_SIZE = int(os.getenv("IVF_MIN_SIZE", 5000))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+IVF_TRAIN_ITERATIONS = 10
+IVF_TRAIN_SAMPLE = 50000
+QUANTIZED_BACKENDS = ("int8", "float16")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 64))
+SCAN_CHUNK = 65536
+
+# --- Match Decision Thresholds ---
+MATCH_THRESHOLD = 0.45 # Standard Face Recognition threshold is 0.6, we use 0.45 for STRICTness
+AMBIGUITY_GAP = 0.05 # Min distance gap between the best and runner-up employee
+AMBIGUITY_MAX_DISTANCE = 0.60
+CONFLICT_THRESHOLD = 0.40 # Enrollment closer than this to another employee is a cross-identity conflict
+CONFLICT_TOP_K = int(os.getenv("CONFLICT_TOP_K", 3))
+
+
+def top_k(distances, k):
+    """Indices of the k smallest distances, sorted ascending (O(N) selection + O(k log k))."""
+    k = min(k, len(distances))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(distances):
+        idx = np.argpartition(distances, k - 1)[:k]
+    else:
+        idx = np.arange(len(distances))
+    return idx[np.argsort(distances[idx], kind="stable")]
+
+
+def group_starts(groups):
+    """Row order that makes each group contiguous, plus the start offset of every group."""
+    order = np.argsort(groups, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0])
+    return order, starts
+
+
+def _segment_top_k(distances, order, starts, k):
+    """Segment-min reduction over group-sorted rows; returns (k best minima, their rows)."""
+    sorted_d = distances[order]
+    mins = np.minimum.reduceat(sorted_d, starts)
+    best = top_k(mins, k)
+    ends = np.r_[starts[1:], len(order)]
+    rows = np.array([order[starts[g] + np.argmin(sorted_d[starts[g]:ends[g]])] for g in best], dtype=np.int64)
+    return mins[best], rows
+
+
+def group_top_k(distances, groups, k):
+    """
+    Reduce per-row distances to per-group minima and return the k best groups
+    as (group ids, min distances, row of each group's best template).
+    """
+    order, starts = group_starts(groups)
+    mins, rows = _segment_top_k(distances, order, starts, k)
+    return groups[rows], mins, rows
+
+
+def _sq_distances(vectors, sq_norms, probes):
+    """Squared Euclidean distances [len(probes) x len(vectors)] via one matrix product."""
+    probes = np.atleast_2d(probes).astype(np.float32, copy=False)
+    d = sq_norms[None, :] - 2.0 * (probes @ vectors.T) + np.sum(probes * probes, axis=1)[:, None]
+    return np.maximum(d, 0.0, out=d)
+
+
+class RowSubset:
+    """
+    Ascending gallery rows a search is restricted to, plus their group layout
+    (see group_starts) computed once. Matchers gather from their own vectors
+    or codes per query, so a subset is two index arrays rather than a copy of
+    the rows; on a compact gallery the float32 rows stay memory-mapped.
+    """
+
+    def __init__(self, rows, groups, layout=None):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.order, self.starts = layout or group_starts(np.asarray(groups)[self.rows])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def contains(self, rows):
+        """Boolean mask: which of ``rows`` belong to the subset."""
+        if len(self.rows) == 0:
+            return np.zeros(len(rows), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.rows, rows), len(self.rows) - 1)
+        return self.rows[idx] == rows
+
+
+class _GroupedMatcher:
+    """Shared group bookkeeping; ``groups[i]`` is the group id of row i (defaults to the row)."""
+
+    def _set_groups(self, groups):
+        self.groups = np.arange(len(self.vectors)) if groups is None else np.asarray(groups, dtype=np.int64)
+        self._group_order, self._group_starts = group_starts(self.groups)
+
+    def search_groups(self, probe, k=2, subset=None):
+        """Top-k groups by their best template: (group ids, distances, best rows)."""
+        rows, distances = self._candidate_distances(probe, subset=subset)
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), rows
+        groups, mins, best = group_top_k(distances, self.groups[rows], k)
+        return groups, mins, rows[best]
+
+    def search_groups_batch(self, probes, k=2, subset=None):
+        """search_groups for every row of ``probes``; returns a list of per-probe results."""
+        return [self.search_groups(p, k, subset) for p in np.atleast_2d(probes)]
+
+
+def _empty_result():
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+
+class ExactMatcher(_GroupedMatcher):
+    backend = "exact"
+
+    def __init__(self, vectors, groups=None):
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.sq_norms = np.sum(self.vectors * self.vectors, axis=1)
+        self._set_groups(groups)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def distances(self, probe, rows=None):
+        """Distance from ``probe`` to every gallery row, or to ``rows`` (same maths as face_recognition.face_distance)."""
+        return np.linalg.norm((self.vectors if rows is None else self.vectors[rows]) - probe, axis=1)
+
+    def _layout(self, subset):
+        """(rows or None for all, group order, group starts) of the rows a search scans."""
+        if subset is None:
+            return None, self._group_order, self._group_starts
+        return subset.rows, subset.order, subset.starts
+
+    def search(self, probe, k=2):
+        if len(self.vectors) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        distances = self.distances(probe)
+        idx = top_k(distances, k)
+        return idx, distances[idx]
+
+    def _candidate_distances(self, probe, subset=None):
+        rows = np.arange(len(self.vectors)) if subset is None else subset.rows
+        return rows, self.distances(probe, None if subset is None else rows)
+
+    def search_groups(self, probe, k=2, subset=None):
+        rows, order, starts = self._layout(subset)
+        if len(order) == 0:
+            return _empty_result()
+        # Full scan: reuse the precomputed group order instead of re-sorting per query.
+        mins, best = _segment_top_k(self.distances(probe, rows), order, starts, k)
+        best = best if rows is None else rows[best]
+        return self.groups[best], mins, best
+
+    def search_groups_batch(self, probes, k=2, subset=None):
+        """One [probes x gallery] matrix product, then a per-probe segment reduction."""
+        probes = np.atleast_2d(probes)
+        rows, order, starts = self._layout(subset)
+        if len(order) == 0:
+            return [_empty_result() for _ in probes]
+        if rows is None:
+            distances = np.sqrt(_sq_distances(self.vectors, self.sq_norms, probes))
+        else:
+            distances = np.sqrt(_sq_distances(self.vectors[rows], self.sq_norms[rows], probes))
+        results = []
+        for d in distances:
+            mins, best = _segment_top_k(d, order, starts, k)
+            best = best if rows is None else rows[best]
+            results.append((self.groups[best], mins, best))
+        return results
+
+
+class IVFMatcher(_GroupedMatcher):
+    backend = "ivf"
+
+    def __init__(self, vectors, groups=None, nlist=None, nprobe=IVF_NPROBE, centroids=None, seed=0):
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self._set_groups(groups)
+        self.sq_norms = np.sum(self.vectors * self.vectors, axis=1)
+        self.nprobe = nprobe
+        if centroids is None:
+            nlist = nlist or max(1, int(np.sqrt(len(self.vectors))))
+            centroids = self._train(nlist, seed)
+        self.centroids = centroids
+        self._build_lists()
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _train(self, nlist, seed):
+        rng = np.random.default_rng(seed)
+        sample = self.vectors
+        if len(sample) > IVF_TRAIN_SAMPLE:
+            sample = sample[rng.choice(len(sample), IVF_TRAIN_SAMPLE, replace=False)]
+        nlist = min(nlist, len(sample))
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assign = np.argmin(_sq_distances(centroids, np.sum(centroids * centroids, axis=1), sample), axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    def _build_lists(self):
+        c_sq = np.sum(self.centroids * self.centroids, axis=1)
+        assign = np.empty(len(self.vectors), dtype=np.int64)
+        for start in range(0, len(self.vectors), 65536):
+            chunk = self.vectors[start:start + 65536]
+            assign[start:start + len(chunk)] = np.argmin(_sq_distances(self.centroids, c_sq, chunk), axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+        self._order = order
+        self._bounds = bounds
+        self._c_sq = c_sq
+
+    def _candidate_distances(self, probe, k=2, subset=None):
+        if len(self.vectors) == 0 or (subset is not None and len(subset) == 0):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        cell_d = _sq_distances(self.centroids, self._c_sq, probe)[0]
+        cells = top_k(cell_d, self.nprobe)
+        candidates = np.concatenate([self._order[self._bounds[c]:self._bounds[c + 1]] for c in cells])
+        if subset is not None:
+            candidates = candidates[subset.contains(candidates)]
+        if len(candidates) < k:
+            candidates = np.arange(len(self.vectors)) if subset is None else subset.rows
+        return candidates, np.sqrt(_sq_distances(self.vectors[candidates], self.sq_norms[candidates], probe)[0])
+
+    def search(self, probe, k=2):
+        candidates, d = self._candidate_distances(probe, k)
+        idx = top_k(d, k)
+        return candidates[idx], d[idx]
+
+
+class QuantizedMatcher(_GroupedMatcher):
+    """
+    Approximate scan over compact codes, exact re-rank of the best candidates.
+
+    int8 codes are ``round(x / scale)`` with ``scale[d] = max|x[d]| / 127``;
+    float16 codes are the rows themselves. The scan ranks rows by
+    ``|x|^2 - 2 p.x' + |p|^2`` (x' the decoded code, |x| the exact norm), and
+    the final distances always come from the float32 ``vectors``, so results
+    differ from ExactMatcher only if a true neighbour falls outside the
+    ``rerank`` candidates. ``vectors`` is never copied: pass a read-only
+    np.memmap to keep the float32 gallery out of RAM.
+    """
+
+    def __init__(self, vectors, groups=None, dtype="int8", rerank=RERANK_CANDIDATES):
+        self.vectors = vectors
+        self.backend = dtype
+        self.rerank = rerank
+        self._set_groups(groups)
+        n, dim = len(vectors), vectors.shape[1]
+        if dtype == "int8":
+            max_abs = np.zeros(dim, dtype=np.float32)
+            for start in range(0, n, SCAN_CHUNK):
+                max_abs = np.maximum(max_abs, np.abs(vectors[start:start + SCAN_CHUNK]).max(axis=0))
+            self.scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        else:
+            self.scale = np.ones(dim, dtype=np.float32)
+        self.codes = np.empty((n, dim), dtype=np.int8 if dtype == "int8" else np.float16)
+        self.sq_norms = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCAN_CHUNK):
+            chunk = np.asarray(vectors[start:start + SCAN_CHUNK], dtype=np.float32)
+            scaled = chunk / self.scale
+            self.codes[start:start + len(chunk)] = np.rint(scaled) if dtype == "int8" else scaled
+            self.sq_norms[start:start + len(chunk)] = np.sum(chunk * chunk, axis=1)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def approximate_sq_distances(self, probes, rows=None):
+        """Squared distances [len(probes) x gallery, or x rows] from the codes alone, scanned chunk by chunk."""
+        probes = np.atleast_2d(probes).astype(np.float32, copy=False)
+        scaled = (probes * self.scale).T
+        n = len(self.codes) if rows is None else len(rows)
+        d = np.empty((len(probes), n), dtype=np.float32)
+        for start in range(0, n, SCAN_CHUNK):
+            block = self.codes[start:start + SCAN_CHUNK] if rows is None else self.codes[rows[start:start + SCAN_CHUNK]]
+            d[:, start:start + len(block)] = (block.astype(np.float32) @ scaled).T
+        d *= -2.0
+        d += (self.sq_norms if rows is None else self.sq_norms[rows])[None, :]
+        d += np.sum(probes * probes, axis=1)[:, None]
+        return d
+
+    def _rerank(self, probe, approx, rows=None):
+        best = np.sort(top_k(approx, self.rerank))  # Ascending rows: sequential reads from a memmap
+        best = best if rows is None else rows[best]
+        return best, np.linalg.norm(np.asarray(self.vectors[best], dtype=np.float32) - probe, axis=1)
+
+    def _candidate_distances(self, probe, subset=None):
+        rows = None if subset is None else subset.rows
+        if len(self.codes) == 0 or (rows is not None and len(rows) == 0):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return self._rerank(probe, self.approximate_sq_distances(probe, rows)[0], rows)
+
+    def search(self, probe, k=2):
+        rows, d = self._candidate_distances(probe)
+        idx = top_k(d, k)
+        return rows[idx], d[idx]
+
+    def search_groups_batch(self, probes, k=2, subset=None):
+        """One compact scan for all probes, then a per-probe exact re-rank."""
+        probes = np.atleast_2d(probes)
+        scope = None if subset is None else subset.rows
+        if len(self.codes) == 0 or (scope is not None and len(scope) == 0):
+            return [_empty_result() for _ in probes]
+        results = []
+        for probe, approx in zip(probes, self.approximate_sq_distances(probes, scope)):
+            rows, d = self._rerank(probe, approx, scope)
+            groups, mins, best = group_top_k(d, self.groups[rows], k)
+            results.append((groups, mins, rows[best]))
+        return results
+
+
+def build_matcher(vectors, groups=None, backend=None, previous=None):
+    """
+    Build the configured matcher for ``vectors`` (optionally grouped per
+    employee). When ``previous`` is an IVF index its centroids are reused, so
+    delta updates only reassign rows instead of re-running k-means.
+    """
+    backend = (backend or MATCHER_BACKEND).lower()
+    if backend in QUANTIZED_BACKENDS:
+        return QuantizedMatcher(vectors, groups=groups, dtype=backend)
+    if backend == "ivf" and len(vectors) >= IVF_MIN_SIZE:
+        centroids = previous.centroids if isinstance(previous, IVFMatcher) else None
+        return IVFMatcher(vectors, groups=groups, centroids=centroids)
+    return ExactMatcher(vectors, groups=groups)
+
+
+def classify_match(nearest_dist):
+    """Apply the threshold + ambiguity rules to a top-2 per-employee distance list."""
+    min_distance = float(nearest_dist[0])
+    if min_distance > MATCH_THRESHOLD:
+        return "NOT_RECOGNIZED"
+    if len(nearest_dist) > 1:
+        gap = float(nearest_dist[1]) - min_distance
+        if gap < AMBIGUITY_GAP and min_distance < AMBIGUITY_MAX_DISTANCE:
+            return "AMBIGUOUS_MATCH"
+    return "MATCH"
@@ -0,0 +1,362 @@
+"""
+Per-site / per-door gallery partitions.
+
+verify_face used to scan every enrolled template for every probe, whichever
+door sent it. Devices now identify themselves, and the devices table
+(supabase/migration_v8.sql) maps each one to the partitions it serves, e.g.
+"site:HQ" or "door:HQ-main". A membership index (partition_members) records
+which employees belong to which partitions. A verify from a mapped device
+only scans the templates of employees in its partitions. That means less
+compare work and far fewer look-alikes from other sites tripping the
+ambiguity gap.
+
+    PartitionIndex   immutable employee -> partitions and device -> partitions
+                     maps, replaced with one reference swap like GallerySnapshot
+    PartitionState   the published index plus delta-sync marks, persisted next
+                     to the template store so an offline restart keeps it
+    Partitions       resolves a device to a searcher over a gallery snapshot;
+                     one PartitionScope per partition set, built lazily and
+                     cached per (snapshot, index) version
+
+A scope is only an index array into the snapshot (matcher.RowSubset): it
+searches with the snapshot's own matcher, so a compact gallery keeps its
+float32 rows memory-mapped and overlapping scopes share one copy of the
+codes. When a snapshot is a delta of the cached one (GallerySnapshot.patched),
+scopes whose employees it does not touch are carried over with their rows
+shifted instead of being rebuilt.
+
+Membership and devices sync incrementally, like face_templates: rows past an
+updated_at mark, plus a serial-id deletion journal for memberships. Deleted
+devices are picked up by the periodic full reconcile.
+
+Devices without partitions scan the whole gallery unless PARTITION_STRICT=1,
+in which case they are rejected. This includes every device before
+migration_v8 is deployed.
+
+Configuration (environment):
+    PARTITION_STRICT    1 = reject verifies from devices without partitions
+    DEFAULT_DEVICE_ID   identity assumed when a request carries none
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from matcher import RowSubset
+from template_sync import _paged
+
+PARTITION_STRICT = os.getenv("PARTITION_STRICT", "0") == "1"
+DEFAULT_DEVICE_ID = os.getenv("DEFAULT_DEVICE_ID", "terminal_01")
+MEMBER_SELECT = "employee_id, partition, updated_at"
+DEVICE_SELECT = "device_id, site_id, door_id, partitions, updated_at"
+
+
+class UnknownDevice(Exception):
+    """Strict mode: the device has no partitions, so it may not match anyone."""
+
+
+def _device(row):
+    return {
+        "site_id": row.get("site_id"),
+        "door_id": row.get("door_id"),
+        "partitions": tuple(sorted(set(row.get("partitions") or ()))),
+    }
+
+
+def is_missing_table(error):
+    """True when PostgREST reports a migration_v8 table as absent."""
+    text = str(error)
+    return ("partition_members" in text or "devices" in text) and (
+        "does not exist" in text or "Could not find" in text or "42P01" in text or "PGRST205" in text)
+
+
+class PartitionIndex:
+    def __init__(self, members=None, devices=None, version=0):
+        """``members``: employee_id -> partitions; ``devices``: device_id -> {"site_id", "door_id", "partitions"}."""
+        self.members = {e: frozenset(p) for e, p in (members or {}).items() if p}
+        self.devices = dict(devices or {})
+        self.version = version
+        self._by_partition = {}
+        for employee_id, parts in self.members.items():
+            for partition in parts:
+                self._by_partition.setdefault(partition, set()).add(employee_id)
+
+    def device_partitions(self, device_id):
+        """Partitions scanned for ``device_id``; None when the device is unmapped."""
+        device = self.devices.get(device_id)
+        return device["partitions"] if device and device["partitions"] else None
+
+    def employees_in(self, partitions):
+        employees = set()
+        for partition in partitions:
+            employees |= self._by_partition.get(partition, set())
+        return employees
+
+    def patched(self, member_upserts, member_deletions, device_upserts, version):
+        """New index with (employee_id, partition) pairs removed/added and device rows replaced."""
+        members = {e: set(p) for e, p in self.members.items()}
+        for employee_id, partition in member_deletions:
+            members.get(employee_id, set()).discard(partition)
+        for employee_id, partition in member_upserts:
+            members.setdefault(employee_id, set()).add(partition)
+        devices = dict(self.devices)
+        for row in device_upserts:
+            devices[row["device_id"]] = _device(row)
+        return PartitionIndex(members, devices, version)
+
+    def to_json(self):
+        return {
+            "members": {e: sorted(p) for e, p in self.members.items()},
+            "devices": {d: {**v, "partitions": list(v["partitions"])} for d, v in self.devices.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data, version=0):
+        devices = {d: _device(v) for d, v in (data.get("devices") or {}).items()}
+        return cls(data.get("members") or {}, devices, version)
+
+    def stats(self):
+        return {
+            "devices": len(self.devices),
+            "employees": len(self.members),
+            "partitions": len(self._by_partition),
+            "version": self.version,
+        }
+
+
+class PartitionState:
+    """Published index + delta-sync marks, persisted as one small JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = PartitionIndex()
+        self.members_since = None
+        self.deletions_since = None
+        self.devices_since = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                self.index = PartitionIndex.from_json(data, version=1)
+                self.members_since = data.get("members_since")
+                self.deletions_since = data.get("deletions_since")
+                self.devices_since = data.get("devices_since")
+            except ValueError:
+                pass
+
+    @property
+    def ready(self):
+        return self.members_since is not None
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                **self.index.to_json(),
+                "members_since": self.members_since,
+                "deletions_since": self.deletions_since,
+                "devices_since": self.devices_since,
+            }, f)
+        os.replace(tmp, self.path)
+
+
+# --- Sync ---
+def fetch_all_partitions(client):
+    """Full pull: (members, devices, members_mark, devices_mark)."""
+    members, members_mark = {}, ""
+    for row in _paged(lambda: client.table("partition_members").select(MEMBER_SELECT)
+                     .order("employee_id").order("partition")):
+        members.setdefault(row["employee_id"], set()).add(row["partition"])
+        members_mark = max(members_mark, row.get("updated_at") or "")
+    devices, devices_mark = {}, ""
+    for row in _paged(lambda: client.table("devices").select(DEVICE_SELECT).order("device_id")):
+        devices[row["device_id"]] = _device(row)
+        devices_mark = max(devices_mark, row.get("updated_at") or "")
+    return members, devices, members_mark, devices_mark
+
+
+def fetch_latest_member_deletion_mark(client):
+    rows = client.table("partition_member_deletions").select("id").order("id", desc=True).limit(1).execute().data or []
+    return rows[0]["id"] if rows else 0
+
+
+def fetch_partition_changes(client, state):
+    """
+    Rows changed since the marks in ``state``: (member_upserts, member_deletions,
+    device_rows, members_mark, deletions_mark, devices_mark). A membership
+    added and removed inside one window keeps whichever event is newer, as in
+    template_sync.fetch_template_changes.
+    """
+    added, members_mark = {}, state.members_since or ""
+    members_query = lambda: client.table("partition_members") \
+        .select(MEMBER_SELECT) \
+        .gte("updated_at", state.members_since or "epoch") \
+        .order("updated_at") \
+        .order("employee_id") \
+        .order("partition")
+    for row in _paged(members_query):
+        added[(row["employee_id"], row["partition"])] = row.get("updated_at") or ""
+        members_mark = max(members_mark, row.get("updated_at") or "")
+
+    removed, deletions_since = {}, state.deletions_since or 0
+    deletions_mark = deletions_since
+    deletions_query = lambda: client.table("partition_member_deletions") \
+        .select("*") \
+        .gt("id", deletions_since) \
+        .order("id")
+    for row in _paged(deletions_query):
+        key = (row["employee_id"], row["partition"])
+        removed[key] = max(removed.get(key, ""), row["deleted_at"])
+        deletions_mark = max(deletions_mark, row["id"])
+    for key, deleted_at in removed.items():
+        if key in added and added[key] <= deleted_at:
+            del added[key]
+
+    devices, devices_mark = [], state.devices_since or ""
+    devices_query = lambda: client.table("devices") \
+        .select(DEVICE_SELECT) \
+        .gte("updated_at", state.devices_since or "epoch") \
+        .order("updated_at") \
+        .order("device_id")
+    for row in _paged(devices_query):
+        devices.append(row)
+        devices_mark = max(devices_mark, row.get("updated_at") or "")
+
+    deletions = [key for key in removed if key not in added]
+    return list(added), deletions, devices, members_mark, deletions_mark, devices_mark
+
+
+# --- Scoped search ---
+class PartitionScope:
+    """The rows of one snapshot visible to a set of employees, searched with the snapshot's matcher."""
+
+    def __init__(self, snapshot, employees, subset=None):
+        self.employees = frozenset(str(e) for e in employees)
+        self.matcher = snapshot.matcher
+        self.subset = subset or RowSubset(snapshot.rows_for_employees(self.employees), snapshot.groups)
+
+    @property
+    def rows(self):
+        return self.subset.rows
+
+    def __len__(self):
+        return len(self.subset)
+
+    def carried(self, snapshot):
+        """
+        This scope on ``snapshot``, a patched delta of the snapshot it was built
+        for, when none of its employees changed: rows are shifted past the
+        dropped ones and the group layout is kept. None when it must be rebuilt.
+        """
+        delta = snapshot.delta
+        if not self.employees.isdisjoint(str(e) for e in delta["employees"]):
+            return None
+        rows = self.rows - np.searchsorted(delta["dropped"], self.rows)
+        subset = RowSubset(rows, snapshot.groups, layout=(self.subset.order, self.subset.starts))
+        return PartitionScope(snapshot, self.employees, subset)
+
+    def search_groups(self, probe, k=2):
+        return self.matcher.search_groups(probe, k, subset=self.subset)
+
+    def search_groups_batch(self, probes, k=2):
+        return self.matcher.search_groups_batch(probes, k, subset=self.subset)
+
+
+class Partitions:
+    def __init__(self, state, strict=PARTITION_STRICT):
+        self.state = state
+        self.strict = strict
+        self.available = True  # False until migration_v8 is deployed
+        self._version = state.index.version
+        self._lock = threading.Lock()
+        self._scopes = {}
+        self._scopes_key = None
+
+    @property
+    def index(self):
+        return self.state.index
+
+    def publish(self, index):
+        self.state.index = index  # Single reference swap, like Gallery.publish
+
+    def resolve(self, device_id):
+        """Partitions for ``device_id``, None for the whole gallery; UnknownDevice in strict mode."""
+        partitions = self.index.device_partitions(device_id)
+        if partitions is None and self.strict:
+            raise UnknownDevice(device_id)
+        return partitions
+
+    def searcher(self, snapshot, device_id):
+        """The matcher a verify from ``device_id`` should use: the snapshot's own, or a PartitionScope."""
+        partitions = self.resolve(device_id)
+        return snapshot.matcher if partitions is None else self.scope(snapshot, partitions)
+
+    def scope(self, snapshot, partitions):
+        index = self.index
+        key = (snapshot.version, index.version)
+        with self._lock:
+            if self._scopes_key is None or key > self._scopes_key:
+                self._scopes, self._scopes_key = self._carry(snapshot, key), key
+            if key == self._scopes_key and partitions in self._scopes:
+                return self._scopes[partitions]
+            scope = PartitionScope(snapshot, index.employees_in(partitions))
+            if key == self._scopes_key:
+                self._scopes[partitions] = scope  # Requests still on an older snapshot are not cached
+            return scope
+
+    def _carry(self, snapshot, key):
+        """Scopes of the previous key still valid for ``snapshot`` (same index, snapshot patched from it)."""
+        delta = snapshot.delta
+        if self._scopes_key is None or delta is None or (delta["base"], key[1]) != self._scopes_key:
+            return {}
+        carried = {partitions: scope.carried(snapshot) for partitions, scope in self._scopes.items()}
+        return {partitions: scope for partitions, scope in carried.items() if scope is not None}
+
+    def warm(self, snapshot):
+        """Pre-build the scope of every mapped device so the first verify after a publish stays fast."""
+        for partitions in {d["partitions"] for d in self.index.devices.values() if d["partitions"]}:
+            self.scope(snapshot, partitions)
+
+    def sync(self, client, full=False):
+        """
+        Pull membership/device changes and publish a new index. Returns the
+        number of changed rows, or None while the migration_v8 tables are missing.
+        """
+        try:
+            if full or not self.state.ready:
+                # Take the deletion mark first so deletes racing the full pull are replayed next cycle.
+                deletions_mark = fetch_latest_member_deletion_mark(client)
+                members, devices, members_mark, devices_mark = fetch_all_partitions(client)
+                self._version += 1
+                self.publish(PartitionIndex(members, devices, self._version))
+                changed = sum(len(p) for p in members.values()) + len(devices)
+            else:
+                upserts, deletions, devices, members_mark, deletions_mark, devices_mark = \
+                    fetch_partition_changes(client, self.state)
+                # The inclusive marks re-read boundary rows; only real changes bump the version.
+                members = self.index.members
+                upserts = [(e, p) for e, p in upserts if p not in members.get(e, ())]
+                deletions = [(e, p) for e, p in deletions if p in members.get(e, ())]
+                devices = [r for r in devices if self.index.devices.get(r["device_id"]) != _device(r)]
+                changed = len(upserts) + len(deletions) + len(devices)
+                if changed:
+                    self._version += 1
+                    self.publish(self.index.patched(upserts, deletions, devices, self._version))
+        except Exception as e:
+            if not is_missing_table(e):
+                raise
+            if self.available:
+                print("[SYNC] Partition tables missing (run migration_v8.sql); every device scans the whole gallery.")
+            self.available = False
+            return None
+        self.available = True
+        self.state.members_since = members_mark
+        self.state.deletions_since = deletions_mark
+        self.state.devices_since = devices_mark
+        self.state.save()
+        return changed
+
+    def stats(self):
+        return {**self.index.stats(), "available": self.available, "strict": self.strict,
+                "cached_scopes": len(self._scopes)}
@@ -0,0 +1,242 @@
+"""
+Durable append-only queue for access logs that could not reach Supabase.
+
+Replaces the pending_logs.json read-modify-write (O(n) per failed insert,
+and a flush that deleted the file out from under concurrent appends) with:
+
+    <prefix>.jsonl    append-only journal, one log record per line
+    <prefix>.offset   byte offset of the first record not yet acknowledged
+    <prefix>.dead.jsonl
+                      records Supabase rejected for good (constraint or bad
+                      data), with the error, kept for inspection
+
+Appends are fsync'ed in batches (every PENDING_FSYNC_EVERY records or
+PENDING_FSYNC_INTERVAL seconds, whichever comes first). The flush reads
+chunks from the committed offset, hands them to an insert callable and only
+then advances the offset, so a crash between insert and commit replays the
+chunk. Every record carries a client-generated UUID in ``id`` (the
+access_logs primary key), which makes the replay an idempotent upsert.
+
+A chunk that fails with a transient error (network, 5xx) stays queued. One
+that fails permanently (a SQLSTATE class 22/23 error such as a CHECK or
+foreign-key violation) is split in halves until the offending records are
+isolated; those move to the dead-letter file so the rest of the journal
+keeps syncing.
+
+On open a torn final line is truncated and a legacy pending_logs.json is
+imported. Once everything is acknowledged the journal is truncated; a long
+acknowledged prefix is compacted away.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+PENDING_FSYNC_EVERY = int(os.getenv("PENDING_FSYNC_EVERY", 32))
+PENDING_FSYNC_INTERVAL = float(os.getenv("PENDING_FSYNC_INTERVAL", 1.0))
+PENDING_FLUSH_CHUNK = int(os.getenv("PENDING_FLUSH_CHUNK", 500))
+COMPACT_MIN_BYTES = 1 << 20
+PERMANENT_SQLSTATE_CLASSES = ("22", "23")  # data exception, integrity constraint violation
+PERMANENT_ERROR_TEXT = ("violates check constraint", "violates foreign key constraint",
+                        "violates not-null constraint", "invalid input syntax")
+
+
+def is_permanent_error(error):
+    """True when retrying ``error`` (a postgrest APIError or similar) can never succeed."""
+    code = str(getattr(error, "code", "") or "")
+    if len(code) == 5 and code[:2] in PERMANENT_SQLSTATE_CLASSES:
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in PERMANENT_ERROR_TEXT)
+
+
+class PendingLogQueue:
+    def __init__(self, prefix, legacy_path=None):
+        self.path = f"{prefix}.jsonl"
+        self.offset_path = f"{prefix}.offset"
+        self.dead_letter_path = f"{prefix}.dead.jsonl"
+        self.dead_lettered = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.time()
+        self._offset = 0
+        self._pending = 0
+        self._recover()
+        if legacy_path:
+            self._import_legacy(legacy_path)
+
+    # --- Recovery ---
+    def _recover(self):
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)  # Torn final line from a crash mid-append
+        self._offset = min(self._read_offset(), end)
+        self._pending = data.count(b"\n", self._offset, end)
+        self._file = open(self.path, "ab")
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+        self._offset = offset
+
+    def _import_legacy(self, legacy_path):
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r") as f:
+                records = json.load(f)
+        except ValueError:
+            records = []
+        for rec in records if isinstance(records, list) else []:
+            self.append(rec, sync=False)
+        self.sync()
+        os.remove(legacy_path)
+        print(f"[PENDING] Imported {len(records)} records from legacy {legacy_path}")
+
+    # --- Writes ---
+    def append(self, record, sync=None):
+        """Append one record (assigning its client UUID); fsync is batched unless ``sync`` is given."""
+        record = dict(record)
+        record.setdefault("id", str(uuid.uuid4()))
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            self._file.write(line)
+            self._pending += 1
+            self._unsynced += 1
+            due = self._unsynced >= PENDING_FSYNC_EVERY or time.time() - self._last_sync >= PENDING_FSYNC_INTERVAL
+            if sync or (sync is None and due):
+                self._sync_locked()
+        return record["id"]
+
+    def _sync_locked(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    # --- Reads / acknowledgement ---
+    def read_batch(self, max_records=PENDING_FLUSH_CHUNK):
+        """Up to ``max_records`` unacknowledged records plus the offset just past them."""
+        with self._lock:
+            self._file.flush()
+            offset = self._offset
+        records = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while len(records) < max_records:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # End of file (or a line still being written)
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Skip a corrupt line rather than wedging the queue
+        return records, offset
+
+    def commit(self, offset):
+        """Acknowledge everything before ``offset``; truncates/compacts the journal when worthwhile."""
+        with self._lock:
+            self._file.flush()
+            size = os.path.getsize(self.path)
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                self._pending -= f.read(max(0, offset - self._offset)).count(b"\n")
+            if offset >= size:
+                self._sync_locked()
+                self._file.truncate(0)
+                self._write_offset(0)
+            elif offset >= COMPACT_MIN_BYTES and offset * 2 >= size:
+                self._compact_locked(offset)
+            else:
+                self._write_offset(offset)
+
+    def _compact_locked(self, offset):
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            src.seek(offset)
+            dst.write(src.read())
+            dst.flush()
+            os.fsync(dst.fileno())
+        self._file.close()
+        # Offset 0 must be durable before the shorter journal replaces the old one
+        self._write_offset(0)
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "ab")
+
+    def _dead_letter(self, rejected):
+        with open(self.dead_letter_path, "ab") as f:
+            for record, error in rejected:
+                entry = {"record": record, "error": str(error), "at": time.time()}
+                f.write((json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += len(rejected)
+        print(f"[PENDING] {len(rejected)} log(s) rejected by the database moved to {self.dead_letter_path}: "
+              f"{rejected[0][1]}")
+
+    def _insert_isolating(self, insert, records, permanent, rejected):
+        """insert(records), halving on permanent errors until bad records are isolated; returns records sent."""
+        try:
+            insert(records)
+            return len(records)
+        except Exception as e:
+            if not permanent(e):
+                raise
+            if len(records) == 1:
+                rejected.append((records[0], e))
+                return 0
+        mid = len(records) // 2
+        return (self._insert_isolating(insert, records[:mid], permanent, rejected)
+                + self._insert_isolating(insert, records[mid:], permanent, rejected))
+
+    def flush(self, insert, chunk_size=PENDING_FLUSH_CHUNK, permanent=is_permanent_error):
+        """
+        Send the backlog in chunks via ``insert(records)``; stops at the first
+        transient failure (the chunk stays queued and is replayed, inserts are
+        idempotent). Records failing with a ``permanent`` error are
+        dead-lettered. Returns how many records were sent.
+        """
+        sent = 0
+        while True:
+            records, end = self.read_batch(chunk_size)
+            if end == self._offset:
+                return sent
+            rejected = []
+            if records:
+                sent += self._insert_isolating(insert, records, permanent, rejected)
+            if rejected:
+                self._dead_letter(rejected)  # Durable before the offset moves past them
+            self.commit(end)
+
+    def __len__(self):
+        """Records appended but not yet acknowledged (tracked, no file scan)."""
+        return self._pending
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync_locked()
+                self._file.close()
+                self._file = None
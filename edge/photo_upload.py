@@ -0,0 +1,103 @@
+"""
+Deferred enrolment-photo uploads.
+
+register_face used to upload the full photo to Supabase Storage on the
+event loop before it even wrote the template, so a slow uplink held the
+whole engine for seconds per registration. PhotoUploader starts the upload
+as soon as the image is decoded, so it overlaps encoding and the conflict
+guard, and runs it on its own worker threads with retry and exponential
+backoff. Registration commits the template row and the local cache without
+waiting for it and returns. A registration that is rejected after the upload
+started calls ``discard``: no further attempts are made and an object that
+already reached storage is removed.
+
+Configuration (environment):
+    PHOTO_UPLOAD_WORKERS      threads running the blocking storage client
+    PHOTO_UPLOAD_MAX_RETRIES  retries after the first failed attempt
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+PHOTO_UPLOAD_WORKERS = int(os.getenv("PHOTO_UPLOAD_WORKERS", 2))
+PHOTO_UPLOAD_MAX_RETRIES = int(os.getenv("PHOTO_UPLOAD_MAX_RETRIES", 4))
+RETRY_BASE_DELAY = 1.0
+
+
+class PhotoUploader:
+    def __init__(self, upload, remove=None, workers=PHOTO_UPLOAD_WORKERS,
+                 max_retries=PHOTO_UPLOAD_MAX_RETRIES, retry_delay=RETRY_BASE_DELAY):
+        """``upload(path, data)`` stores one object (idempotently); ``remove(path)`` deletes it."""
+        self.upload = upload
+        self.remove = remove
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photo-upload")
+        self._tasks = {}  # path -> task
+        self._discarded = set()
+        self.stats = {"uploaded": 0, "failed": 0, "retried": 0, "discarded": 0}
+
+    def begin(self, path, data):
+        """Start uploading ``data`` to ``path`` in the background; returns ``path`` as the handle."""
+        task = asyncio.create_task(self._run(path, data))
+        self._tasks[path] = task
+        task.add_done_callback(lambda _: self._finished(path))
+        return path
+
+    async def _run(self, path, data):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            if path in self._discarded:
+                return False
+            try:
+                await loop.run_in_executor(self._executor, self.upload, path, data)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    print(f"[WARNING] Photo upload of {path} failed after {attempt + 1} attempts: {e}")
+                    return False
+                self.stats["retried"] += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                continue
+            if path in self._discarded:
+                self._schedule_remove(path) # Rejected while this attempt was in flight
+                return False
+            self.stats["uploaded"] += 1
+            return True
+        return False
+
+    def discard(self, path):
+        """The registration was rejected: stop retrying ``path`` and delete it if it was stored."""
+        self.stats["discarded"] += 1
+        if path in self._tasks:
+            self._discarded.add(path) # _run cleans up once its current attempt settles
+        else:
+            self._schedule_remove(path)
+
+    def _schedule_remove(self, path):
+        if self.remove is None:
+            return
+
+        def remove():
+            try:
+                self.remove(path)
+            except Exception as e:
+                print(f"[WARNING] Could not remove discarded photo {path}: {e}")
+
+        self._executor.submit(remove)
+
+    def _finished(self, path):
+        self._tasks.pop(path, None)
+        self._discarded.discard(path)
+
+    def pending(self):
+        return len(self._tasks)
+
+    async def stop(self, timeout=10.0):
+        """Give in-flight uploads ``timeout`` seconds to finish, then abandon the rest."""
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+            for task in tasks:
+                task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
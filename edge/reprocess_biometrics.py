@@ -1,86 +1,295 @@
-import io
-import requests
-import sys
-from deepface import DeepFace
-import numpy as np
-from PIL import Image
-from supabase_client import supabase
+"""
+Fleet-wide re-encoding of face_templates from their stored photos.
+
+Run whenever the encoder (model, detector, preprocessing) changes, so every
+template is re-embedded with the same pipeline the engine now uses for live
+probes. This replaces the old one-employee script (hard-coded employee,
+sequential downloads, DeepFace into the legacy employees.face_embedding
+column).
+
+    1. enumerate face_templates rows that have an image_url (paged)
+    2. download photos through a bounded, keep-alive HTTP pool
+    3. decode + detect + encode on a process pool (bulk_enroll._encode_photo,
+       largest face wins, exactly like register_face)
+    4. write embeddings back in batches of update-only writes by id (the
+       updated_at trigger from migration_v6 makes delta sync deliver them to
+       every engine); a template deleted or pruned during the run is skipped,
+       never re-inserted
+    5. append every finished template id to a checkpoint file, so an
+       interrupted run resumes where it stopped
+
+Transient failures (download, encode crash, write) are not checkpointed and
+are retried by the next run; photos without a usable face and templates that
+no longer exist are recorded and skipped.
+
+    python reprocess_biometrics.py                       # everything, resumable
+    python reprocess_biometrics.py --employee EMP-961231 # one employee
+    python reprocess_biometrics.py --restart --dry-run   # re-encode, write nothing
+"""
+import argparse
+import json
 import os
-from dotenv import load_dotenv
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from bulk_enroll import _encode_photo
+from template_sync import _paged
+
+REENCODE_WORKERS = int(os.getenv("REENCODE_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+REENCODE_DOWNLOADS = int(os.getenv("REENCODE_DOWNLOADS", 16))
+REENCODE_BATCH = int(os.getenv("REENCODE_BATCH", 200))
+REENCODE_WRITERS = int(os.getenv("REENCODE_WRITERS", 8))
+REENCODE_CHECKPOINT = os.getenv("REENCODE_CHECKPOINT", "reencode_checkpoint.jsonl")
+DOWNLOAD_TIMEOUT = 15.0
+DOWNLOAD_RETRIES = 2
+PERMANENT = ("NO_FACE", "BAD_IMAGE", "TEMPLATE_GONE")
+
+
+# --- Enumeration / checkpoint ---
+def fetch_templates(client, employee_id=None):
+    """face_templates rows (id, employee_id, image_url) that have a photo, ordered by id."""
+    def query():
+        q = client.table("face_templates").select("id, employee_id, image_url").neq("image_url", "")
+        if employee_id:
+            q = q.eq("employee_id", employee_id)
+        return q.order("id")
+    return list(_paged(query))
+
+
+class Checkpoint:
+    """Append-only JSONL of finished template ids; fsync'ed once per written batch."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line from a crash
+                    self.done[entry["id"]] = entry["status"]
+        self._file = open(path, "a")
+
+    def record(self, entries):
+        for template_id, status in entries:
+            self._file.write(json.dumps({"id": template_id, "status": status}) + "\n")
+            self.done[template_id] = status
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# --- Download ---
+class Downloader:
+    """Thread-safe keep-alive HTTP client shared by the download threads; retries 5xx/transport errors."""
+
+    def __init__(self, concurrency):
+        import httpx
+        self._httpx = httpx
+        self.client = httpx.Client(
+            timeout=DOWNLOAD_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    def __call__(self, url):
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                response = self.client.get(url)
+            except self._httpx.TransportError:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+            else:
+                if response.status_code in (400, 404):
+                    raise FileNotFoundError(f"{url} returned {response.status_code}")
+                if response.status_code < 500 or attempt == DOWNLOAD_RETRIES:
+                    response.raise_for_status()
+                    return response.content
+            time.sleep(0.5 * 2 ** attempt)
 
-# Force UTF-8 encoding for Windows terminal
-if sys.stdout.encoding != 'utf-8':
-    import codecs
-    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.detach())
+    def close(self):
+        self.client.close()
 
-# Disable TensorFlow logging
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
-load_dotenv()
+# --- Job ---
+class Progress:
+    def __init__(self, total, every):
+        self.total = total
+        self.every = every
+        self.started = time.perf_counter()
+        self.counts = {}
+        self.bytes = 0
+        self._last = self.started
 
-MODEL_NAME = "Facenet"
-DETECTOR_BACKEND = "retinaface"
+    def add(self, status, n=1):
+        self.counts[status] = self.counts.get(status, 0) + n
 
-def reprocess_user(employee_id):
+    @property
+    def finished(self):
+        return sum(self.counts.values())
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.finished / elapsed if elapsed else 0.0
+        return {
+            "total": self.total,
+            "finished": self.finished,
+            "elapsed_s": round(elapsed, 1),
+            "templates_per_s": round(rate, 2),
+            "download_mb_per_s": round(self.bytes / 1e6 / elapsed, 2) if elapsed else 0.0,
+            "eta_s": round((self.total - self.finished) / rate, 0) if rate else None,
+            "counts": dict(sorted(self.counts.items())),
+        }
+
+    def maybe_print(self):
+        now = time.perf_counter()
+        if now - self._last >= self.every:
+            self._last = now
+            r = self.report()
+            print(f"[REENCODE] {r['finished']}/{r['total']} ({r['templates_per_s']}/s, "
+                  f"{r['download_mb_per_s']} MB/s, eta {r['eta_s']}s) {r['counts']}")
+
+
+def _write_one(client, template, embedding):
+    rows = client.table("face_templates") \
+        .update({"embedding": json.dumps(embedding.tolist())}) \
+        .eq("id", template["id"]) \
+        .execute().data
+    return "REENCODED" if rows else "TEMPLATE_GONE"
+
+
+def write_batch(client, batch, executor):
     """
-    Fetches the image for a user, generates a REAL encoding using DeepFace, and updates the DB.
+    Write re-encoded embeddings back, one update-only request per template on
+    ``executor``. An upsert would re-insert templates deleted or pruned since
+    they were listed. Returns {template id: REENCODED | TEMPLATE_GONE | WRITE_FAILED}.
     """
-    print(f"[PROCESS] Reprocessing biometrics for: {employee_id}")
-    
-    try:
-        # 1. Fetch user metadata
-        res = supabase.table("employees").select("image_url, name").eq("employee_id", employee_id).single().execute()
-        if not res.data:
-            print(f"[ERROR] User {employee_id} not found.")
-            return False
-        
-        image_url = res.data.get("image_url")
-        if not image_url:
-            print(f"[ERROR] No image_url found for {employee_id}. Cannot reprocess.")
-            return False
-        
-        print(f"[FETCH] Downloading image: {image_url}")
-        
-        # 2. Download image
-        response = requests.get(image_url, timeout=10)
-        if response.status_code != 200:
-            print(f"[ERROR] Failed to download image. Status: {response.status_code}")
-            return False
-            
-        # 3. Load into DeepFace
-        image_bytes = io.BytesIO(response.content)
-        image = Image.open(image_bytes).convert("RGB")
-        frame = np.array(image)
-        
-        # 4. Detect and encode
-        print(f"[AI] Running DeepFace AI Encoding ({MODEL_NAME})...")
+    futures = [(t["id"], executor.submit(_write_one, client, t, embedding)) for t, embedding in batch]
+    statuses = {}
+    for template_id, future in futures:
         try:
-            objs = DeepFace.represent(
-                img_path = frame,
-                model_name = MODEL_NAME,
-                detector_backend = DETECTOR_BACKEND,
-                enforce_detection = True,
-                align = True,
-                normalization = 'Facenet'
-            )
-            real_encoding = objs[0]["embedding"]
+            statuses[template_id] = future.result()
         except Exception as e:
-            print(f"[ERROR] AI detection failed: {repr(e)}")
-            return False
-            
-        # 5. Update Supabase
-        print(f"[DB] Updating database with real encoding (128 dimensions)...")
-        update_res = supabase.table("employees").update({
-            "face_embedding": real_encoding
-        }).eq("employee_id", employee_id).execute()
-        
-        print(f"[SUCCESS] User {employee_id} has been restored with a valid encoding.")
-        return True
-        
-    except Exception as e:
-        print(f"[FATAL] Error: {repr(e)}")
-        return False
+            print(f"[REENCODE] Write of template {template_id} failed (will retry next run): {e}")
+            statuses[template_id] = "WRITE_FAILED"
+    return statuses
+
+
+def reencode(templates, client, checkpoint, download, encode_executor, download_executor,
+             max_in_flight=32, batch_size=REENCODE_BATCH, dry_run=False, progress_every=10.0, write_executor=None):
+    """
+    Stream ``templates`` through download -> encode -> batched write with at
+    most ``max_in_flight`` photos held in memory; returns the throughput report.
+    Writes go to ``write_executor`` (default: ``download_executor``).
+    """
+    write_executor = write_executor or download_executor
+    todo = [t for t in templates if t["id"] not in checkpoint.done]
+    progress = Progress(len(todo), progress_every)
+    if len(todo) < len(templates):
+        print(f"[REENCODE] Resuming: {len(templates) - len(todo)} templates already done.")
+    downloads, encodes, ready, finished = {}, {}, [], []
+    pending = iter(todo)
+
+    def flush():
+        if ready:
+            if dry_run:
+                statuses = {t["id"]: "REENCODED" for t, _ in ready}
+            else:
+                statuses = write_batch(client, ready, write_executor)
+            for template_id, status in statuses.items():
+                progress.add(status)
+                if status != "WRITE_FAILED":
+                    finished.append((template_id, status))
+            ready.clear()
+        if finished and not dry_run:
+            checkpoint.record(finished)
+        finished.clear()
+
+    while True:
+        while len(downloads) + len(encodes) < max_in_flight:
+            template = next(pending, None)
+            if template is None:
+                break
+            downloads[download_executor.submit(download, template["image_url"])] = template
+        if not downloads and not encodes:
+            break
+        done, _ = wait(list(downloads) + list(encodes), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in downloads:
+                template = downloads.pop(future)
+                try:
+                    data = future.result()
+                except FileNotFoundError:
+                    progress.add("DOWNLOAD_MISSING")
+                    finished.append((template["id"], "DOWNLOAD_MISSING"))
+                    continue
+                except Exception:
+                    progress.add("DOWNLOAD_FAILED")
+                    continue
+                progress.bytes += len(data)
+                encodes[encode_executor.submit(_encode_photo, data, True)] = template
+            else:
+                template = encodes.pop(future)
+                try:
+                    status, embedding, _ = future.result()
+                except Exception:
+                    status, embedding = "ENGINE_ERROR", None
+                if status == "OK":
+                    ready.append((template, embedding))
+                    if len(ready) >= batch_size:
+                        flush()
+                else:
+                    progress.add(status)
+                    if status in PERMANENT:
+                        finished.append((template["id"], status))
+        progress.maybe_print()
+    flush()
+    return progress.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-encode every face template from its stored photo")
+    parser.add_argument("--employee", help="only this employee's templates")
+    parser.add_argument("--workers", type=int, default=REENCODE_WORKERS, help="encoder processes")
+    parser.add_argument("--downloads", type=int, default=REENCODE_DOWNLOADS, help="concurrent downloads")
+    parser.add_argument("--batch-size", type=int, default=REENCODE_BATCH, help="templates written back per batch")
+    parser.add_argument("--checkpoint", default=REENCODE_CHECKPOINT, help="progress file used to resume")
+    parser.add_argument("--restart", action="store_true", help="ignore (and reset) the checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="download and encode only")
+    parser.add_argument("--output", help="write the final report as JSON")
+    args = parser.parse_args(argv)
+
+    from encoding_pool import _init_worker
+    from supabase_client import get_client
+
+    client = get_client()
+    templates = fetch_templates(client, args.employee)
+    print(f"[REENCODE] {len(templates)} templates with photos.")
+    checkpoint = Checkpoint(args.checkpoint, restart=args.restart)
+    download = Downloader(args.downloads)
+    try:
+        with ThreadPoolExecutor(max_workers=args.downloads, thread_name_prefix="download") as downloads, \
+                ThreadPoolExecutor(max_workers=REENCODE_WRITERS, thread_name_prefix="write") as writers, \
+                ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as encoders:
+            report = reencode(templates, client, checkpoint, download, encoders, downloads,
+                              max_in_flight=args.downloads + 2 * args.workers,
+                              batch_size=args.batch_size, dry_run=args.dry_run, write_executor=writers)
+    finally:
+        download.close()
+        checkpoint.close()
+    print(f"[REENCODE] Done: {json.dumps(report)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
 
 if __name__ == "__main__":
-    # Reprocess Shiv Kumar specifically
-    reprocess_user("EMP-961231")
+    sys.exit(0 if main()["counts"].get("WRITE_FAILED", 0) == 0 else 1)
@@ -0,0 +1,177 @@
+"""
+Per-device verify sessions.
+
+A person walking up to a door produces several frames, and each verify call
+used to be handled on its own: encoded, matched, liveness-checked, logged
+and sent to attendance. SessionTracker fuses the frames of one approach:
+
+    collecting  MATCH frames vote for an employee. The session is accepted
+                after SESSION_ACCEPT_FRAMES consecutive matches of the same
+                employee within SESSION_WINDOW seconds, or at once when one
+                match is closer than SESSION_INSTANT_DISTANCE. Liveness runs
+                once, on the accepting frame.
+    accepted    follow-up frames run detection only. While the face stays in
+                place (IoU with the tracked box >= SESSION_MIN_IOU) they get
+                the accepted identity back without encoding, liveness, a log
+                or an attendance event.
+    ended       no face, a face somewhere else, SESSION_IDLE_TIMEOUT without
+                frames, or SESSION_MAX_SECONDS after acceptance. The next
+                frame starts a new session.
+
+One access log and one attendance event are written per accepted session. A
+session that never got accepted writes one aggregated "failed" log when it
+ends, instead of one per frame. Only devices with their own identity are
+tracked: requests on the shared DEFAULT_DEVICE_ID fallback could come from
+several terminals, so they are never fused.
+
+Configuration (environment):
+    SESSION_ACCEPT_FRAMES     consistent matches needed (1 = first match)
+    SESSION_INSTANT_DISTANCE  a match this close is accepted on its own
+    SESSION_WINDOW            seconds the votes of one streak may span
+    SESSION_IDLE_TIMEOUT      seconds without frames before a session ends
+    SESSION_MAX_SECONDS       accepted sessions are re-verified after this
+    SESSION_MIN_IOU           box overlap that counts as "the same face"
+"""
+import itertools
+import os
+import time
+
+SESSION_ACCEPT_FRAMES = int(os.getenv("SESSION_ACCEPT_FRAMES", 2))
+SESSION_INSTANT_DISTANCE = float(os.getenv("SESSION_INSTANT_DISTANCE", 0.30))
+SESSION_WINDOW = float(os.getenv("SESSION_WINDOW", 3.0))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", 2.0))
+SESSION_MAX_SECONDS = float(os.getenv("SESSION_MAX_SECONDS", 15.0))
+SESSION_MIN_IOU = float(os.getenv("SESSION_MIN_IOU", 0.3))
+
+_ids = itertools.count(1)
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area = lambda box: max(0, box[2] - box[0]) * max(0, box[1] - box[3])
+    union = area(a) + area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Session:
+    def __init__(self, device_id, now):
+        self.id = next(_ids)
+        self.device_id = device_id
+        self.started = now
+        self.last_seen = now
+        self.frames = 0
+        self.skipped = 0        # Follow-up frames answered without encoding or liveness
+        self.box = None
+        self.streak = []        # [(time, distance)] consecutive matches of streak_employee
+        self.streak_employee = None
+        self.failures = {}      # status -> frames
+        self.closest = None     # (distance, employee_id) of the closest frame, for the aggregated log
+        self.accepted = None    # {"employee_id", "name", "distance", "at"}
+        self.end_reason = None
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "state": "ended" if self.end_reason else "accepted" if self.accepted else "collecting",
+            "frames": self.frames,
+            "skipped": self.skipped,
+        }
+
+
+class SessionTracker:
+    def __init__(self, accept_frames=SESSION_ACCEPT_FRAMES, instant_distance=SESSION_INSTANT_DISTANCE,
+                 window=SESSION_WINDOW, idle_timeout=SESSION_IDLE_TIMEOUT, max_seconds=SESSION_MAX_SECONDS,
+                 min_iou=SESSION_MIN_IOU, clock=time.monotonic):
+        self.accept_frames = max(1, accept_frames)
+        self.instant_distance = instant_distance
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.max_seconds = max_seconds
+        self.min_iou = min_iou
+        self.clock = clock
+        self._sessions = {}  # device_id -> Session
+        self.stats = {"started": 0, "accepted": 0, "skipped_frames": 0, "ended": 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _session(self, device_id):
+        now = self.clock()
+        session = self._sessions.get(device_id)
+        if session is None:
+            session = self._sessions[device_id] = Session(device_id, now)
+            self.stats["started"] += 1
+        session.frames += 1
+        session.last_seen = now
+        return session
+
+    def accepted(self, device_id):
+        """The device's accepted session, if one is live."""
+        session = self._sessions.get(device_id)
+        return session if session is not None and session.accepted else None
+
+    def follow(self, device_id, box):
+        """
+        A detection-only follow-up frame of an accepted session: True when
+        ``box`` (None = no face) continues it, in which case the frame needs
+        no encode, liveness or log. Otherwise the caller ends the session.
+        """
+        session = self.accepted(device_id)
+        if session is None or box is None or session.box is None or box_iou(session.box, box) < self.min_iou:
+            return False
+        session.frames += 1
+        session.skipped += 1
+        session.last_seen = self.clock()
+        session.box = tuple(box)
+        self.stats["skipped_frames"] += 1
+        return True
+
+    def vote(self, device_id, employee_id, distance, box=None):
+        """Record a MATCH frame; True once the session may be accepted (liveness still pending)."""
+        session = self._session(device_id)
+        session.box = tuple(box) if box is not None else session.box
+        if employee_id != session.streak_employee:
+            session.streak_employee, session.streak = employee_id, []
+        session.streak = [(t, d) for t, d in session.streak if session.last_seen - t <= self.window]
+        session.streak.append((session.last_seen, distance))
+        if session.closest is None or distance < session.closest[0]:
+            session.closest = (distance, employee_id)
+        return distance <= self.instant_distance or len(session.streak) >= self.accept_frames
+
+    def accept(self, device_id, employee_id, name, distance):
+        session = self._sessions.get(device_id) or self._session(device_id)
+        session.accepted = {"employee_id": employee_id, "name": name, "distance": distance, "at": self.clock()}
+        self.stats["accepted"] += 1
+        return session
+
+    def fail(self, device_id, status, employee_id=None, distance=None, box=None):
+        """Record a non-matching frame; it breaks the current streak."""
+        session = self._session(device_id)
+        session.box = tuple(box) if box is not None else session.box
+        session.streak_employee, session.streak = None, []
+        session.failures[status] = session.failures.get(status, 0) + 1
+        if distance is not None and (session.closest is None or distance < session.closest[0]):
+            session.closest = (distance, employee_id)
+        return session
+
+    def end(self, device_id, reason):
+        """End the device's session (if any) and return it for the aggregated log."""
+        session = self._sessions.pop(device_id, None)
+        if session is not None:
+            session.end_reason = reason
+            self.stats["ended"] += 1
+        return session
+
+    def expire(self):
+        """End idle sessions and accepted sessions past SESSION_MAX_SECONDS; returns them."""
+        now = self.clock()
+        ended = []
+        for device_id, session in list(self._sessions.items()):
+            if now - session.last_seen > self.idle_timeout:
+                ended.append(self.end(device_id, "idle"))
+            elif session.accepted and now - session.accepted["at"] > self.max_seconds:
+                ended.append(self.end(device_id, "max_age"))
+        return ended
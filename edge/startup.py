@@ -0,0 +1,87 @@
+"""
+Background start-up with a readiness gate.
+
+On a scale-from-zero start the engine used to import every heavy dependency
+at module load and then load the gallery and (on the first scan) the dlib
+models, so the first person at the door paid for all of it. The app now
+imports optional components lazily, starts serving immediately and runs its
+start-up phases in the background:
+
+    gallery    templates store -> published snapshot
+    encoder    start the worker pool and run a synthetic inference per worker
+    liveness   import + configure the Gemini client
+    supabase   create the Supabase client
+    door_link  open the BLE link to the door controller (optional: a lock
+               that is out of range keeps being retried in the background)
+
+Phases run concurrently. The engine is *ready* once every required phase has
+succeeded; /ready answers 503 until then, so a start-up probe or load
+balancer keeps traffic away from a cold instance. ``report()`` gives the
+wall time of each phase plus the module import time.
+"""
+import asyncio
+import time
+
+
+class Startup:
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready_at = None
+        self.import_seconds = None
+        self.phases = {}  # name -> {"status", "required", "seconds", "error"}
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def record_imports(self, seconds):
+        self.import_seconds = seconds
+
+    def start(self, phases):
+        """Run ``phases`` ([(name, fn, required)]) in the background; ``fn`` may be sync or async."""
+        for name, _, required in phases:
+            self.phases[name] = {"status": "pending", "required": required, "seconds": None, "error": None}
+        self._task = asyncio.create_task(self._run(phases))
+        return self._task
+
+    async def _run(self, phases):
+        t0 = time.perf_counter()
+        await asyncio.gather(*(self._phase(name, fn) for name, fn, _ in phases))
+        failed = [n for n, p in self.phases.items() if p["required"] and p["status"] != "ok"]
+        if failed:
+            print(f"[STARTUP] Not ready, required phases failed: {', '.join(failed)}")
+            return
+        self.ready_at = time.time()
+        timings = ", ".join(f"{n} {p['seconds']}s" for n, p in self.phases.items())
+        print(f"[STARTUP] Ready in {time.perf_counter() - t0:.2f}s ({timings})")
+
+    async def _phase(self, name, fn):
+        entry = self.phases[name]
+        entry["status"] = "running"
+        t0 = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                await fn()
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, fn)
+            entry["status"] = "ok"
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+            print(f"[STARTUP] Phase {name} failed: {e}")
+        entry["seconds"] = round(time.perf_counter() - t0, 3)
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "imports_seconds": self.import_seconds,
+            "seconds_to_ready": round(self.ready_at - self.started_at, 3) if self.ready else None,
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "phases": self.phases,
+        }
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -1,5 +1,5 @@
 import os
-from supabase import create_client, Client
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,7 +7,28 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL", "https://wdtizlzfsijikcejerwq.supabase.co")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_KEY:
-    raise ValueError("SUPABASE_KEY not found in environment variables")
+_client = None
+_client_lock = threading.Lock()
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def get_client():
+    """Create the client on first use; importing the supabase package is a large share of cold start."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not SUPABASE_KEY:
+                    raise ValueError("SUPABASE_KEY not found in environment variables")
+                from supabase import create_client
+                _client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _client
+
+
+class _LazyClient:
+    """Stands in for the supabase Client; attribute access goes to the real client."""
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+
+supabase = _LazyClient()
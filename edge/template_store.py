@@ -0,0 +1,305 @@
+"""
+Binary, memory-mapped face template store.
+
+Replaces the face_cache.json round-trip (full JSON rewrite per register and
+delete, embeddings stored as JSON strings) with two files:
+
+    <prefix>.f32         fixed 64-byte header + float32 matrix [capacity x dim],
+                         opened with np.memmap and grown geometrically
+    <prefix>.meta.jsonl  append-only metadata journal, one line per change:
+                         {"op": "put", "row": 3, "employee_id": ..., "template_id": ..., "name": ...}
+                         {"op": "del", "row": 3}
+
+An employee may own several rows (one per enrolled template, see
+MAX_TEMPLATES_PER_EMPLOYEE).
+
+Appends write one matrix row plus one journal line; deletes only append a
+tombstone. Loading replays the (small) journal and never parses embeddings.
+When tombstones outnumber live rows the files are compacted in one atomic
+rewrite.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"FTS1"
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<4sIIQQ")  # magic, version, dim, capacity, count
+EMBEDDING_DIM = 128
+INITIAL_CAPACITY = 256
+COMPACT_MIN_TOMBSTONES = 64
+MAX_TEMPLATES_PER_EMPLOYEE = int(os.getenv("MAX_TEMPLATES_PER_EMPLOYEE", 5))
+META_FIELDS = ("employee_id", "template_id", "name", "role", "updated_at")
+
+
+def parse_embedding(emb, dim=EMBEDDING_DIM):
+    """Accept the list or JSON-string embeddings Supabase returns; None if unusable."""
+    if isinstance(emb, str):
+        try:
+            emb = json.loads(emb)
+        except ValueError:
+            return None
+    if emb is None or len(emb) != dim:
+        return None
+    return np.asarray(emb, dtype=np.float32)
+
+
+class FaceTemplateStore:
+    def __init__(self, prefix, dim=EMBEDDING_DIM):
+        self.matrix_path = f"{prefix}.f32"
+        self.meta_path = f"{prefix}.meta.jsonl"
+        self.dim = dim
+        self._mm = None
+        self._capacity = 0
+        self._count = 0
+        self._meta = {}         # row -> metadata dict, live rows only
+        self._rows_by_employee = {}  # employee_id -> rows, oldest first
+        self._row_by_template = {}
+        self._tombstones = 0
+        self._open()
+
+    # --- File handling ---
+    def _write_header(self, f, capacity, count):
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, self.dim, capacity, count).ljust(HEADER_SIZE, b"\0"))
+
+    def _map(self):
+        self._mm = np.memmap(self.matrix_path, dtype=np.float32, mode="r+",
+                             offset=HEADER_SIZE, shape=(self._capacity, self.dim))
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.flush()
+            # Drop the mapping before resizing/replacing the file (required on Windows).
+            self._mm._mmap.close()
+            self._mm = None
+
+    def _create_empty(self, capacity=INITIAL_CAPACITY):
+        with open(self.matrix_path, "wb") as f:
+            self._write_header(f, capacity, 0)
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+        open(self.meta_path, "w").close()
+
+    def _open(self):
+        if not os.path.exists(self.matrix_path):
+            self._create_empty()
+        with open(self.matrix_path, "rb") as f:
+            magic, version, dim, capacity, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION or dim != self.dim:
+            raise ValueError(f"{self.matrix_path} is not a v{FORMAT_VERSION} {self.dim}-d template store")
+        self._capacity, self._count = capacity, count
+        self._map()
+        self._replay_journal()
+
+    def _replay_journal(self):
+        self._meta, self._rows_by_employee, self._row_by_template = {}, {}, {}
+        if not os.path.exists(self.meta_path):
+            self._tombstones = 0
+            return
+        with open(self.meta_path, "r") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # Torn final line after a crash
+                row = rec.get("row")
+                if row is None or row >= self._count:
+                    continue
+                if rec.get("op") == "put":
+                    self._index(row, {k: rec.get(k) for k in META_FIELDS})
+                elif rec.get("op") == "del" and row in self._meta:
+                    self._drop([row])
+        # Every row that is not live is a tombstone (includes rows orphaned by a crash)
+        self._tombstones = self._count - len(self._meta)
+
+    def _journal(self, records):
+        with open(self.meta_path, "a") as f:
+            for rec in records:
+                f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+
+    def _grow(self, needed):
+        capacity = max(self._capacity, INITIAL_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+        self._unmap()
+        with open(self.matrix_path, "r+b") as f:
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+            self._write_header(f, capacity, self._count)
+        self._capacity = capacity
+        self._map()
+
+    def _set_count(self, count):
+        with open(self.matrix_path, "r+b") as f:
+            self._write_header(f, self._capacity, count)
+        self._count = count
+
+    # --- Mutations ---
+    def _index(self, row, meta):
+        self._meta[row] = meta
+        self._rows_by_employee.setdefault(meta["employee_id"], []).append(row)
+        if meta.get("template_id") is not None:
+            self._row_by_template[meta["template_id"]] = row
+
+    def _drop(self, rows):
+        for r in rows:
+            meta = self._meta.pop(r)
+            emp_rows = self._rows_by_employee[meta["employee_id"]]
+            emp_rows.remove(r)
+            if not emp_rows:
+                del self._rows_by_employee[meta["employee_id"]]
+            if self._row_by_template.get(meta.get("template_id")) == r:
+                del self._row_by_template[meta["template_id"]]
+            self._tombstones += 1
+
+    def _append(self, employee_id, embedding, meta, drop_rows):
+        vec = parse_embedding(embedding, self.dim)
+        if vec is None:
+            raise ValueError(f"Invalid embedding for {employee_id}")
+        row = self._count
+        if row >= self._capacity:
+            self._grow(row + 1)
+        self._mm[row] = vec
+        self._mm.flush()
+        self._set_count(row + 1)
+
+        meta = {"employee_id": employee_id, **meta}
+        self._journal([{"op": "del", "row": r} for r in drop_rows] + [{"op": "put", "row": row, **meta}])
+        self._drop(drop_rows)
+        self._index(row, meta)
+        self._maybe_compact()
+        return row
+
+    def put(self, employee_id, embedding, name=None, role=None, updated_at=None, template_id=None):
+        """Replace all of the employee's templates with ``embedding``; returns the new row."""
+        drop = list(self._rows_by_employee.get(employee_id, []))
+        meta = {"name": name, "role": role, "updated_at": updated_at, "template_id": template_id}
+        return self._append(employee_id, embedding, meta, drop)
+
+    def add(self, employee_id, embedding, name=None, role=None, updated_at=None, template_id=None,
+            max_templates=MAX_TEMPLATES_PER_EMPLOYEE):
+        """
+        Add a template for the employee. A row with the same ``template_id`` is
+        replaced; otherwise the oldest templates beyond ``max_templates`` are
+        evicted (None = no cap, used when the database already enforces it).
+        """
+        drop = []
+        if template_id is not None and template_id in self._row_by_template:
+            drop.append(self._row_by_template[template_id])
+        elif max_templates:
+            rows = self._rows_by_employee.get(employee_id, [])
+            drop = rows[:max(0, len(rows) - max_templates + 1)]
+        meta = {"name": name, "role": role, "updated_at": updated_at, "template_id": template_id}
+        return self._append(employee_id, embedding, meta, drop)
+
+    def delete(self, employee_id):
+        """Tombstone every template of ``employee_id``; returns how many rows were dropped."""
+        rows = list(self._rows_by_employee.get(employee_id, []))
+        if rows:
+            self._journal([{"op": "del", "row": r} for r in rows])
+            self._drop(rows)
+            self._maybe_compact()
+        return len(rows)
+
+    def delete_template(self, template_id):
+        """Tombstone a single template; returns True if it existed."""
+        row = self._row_by_template.get(template_id)
+        if row is None:
+            return False
+        self._journal([{"op": "del", "row": row}])
+        self._drop([row])
+        self._maybe_compact()
+        return True
+
+    def replace_all(self, records):
+        """
+        Atomically rewrite the store from cache-format records
+        ({"employee_id", "template_id", "face_embedding", "name", "role", "updated_at"}). Used for full
+        rebuilds and for migrating a legacy face_cache.json.
+        """
+        rows, meta = [], []
+        for rec in records:
+            vec = parse_embedding(rec.get("face_embedding"), self.dim)
+            if vec is None:
+                continue
+            rows.append(vec)
+            meta.append({k: rec.get(k) for k in META_FIELDS})
+        self._rewrite(np.array(rows, dtype=np.float32).reshape(-1, self.dim), meta)
+        return len(meta)
+
+    def _rewrite(self, matrix, meta):
+        count = len(meta)
+        capacity = max(INITIAL_CAPACITY, 1 << max(count - 1, 0).bit_length())
+        tmp_matrix, tmp_meta = self.matrix_path + ".tmp", self.meta_path + ".tmp"
+        with open(tmp_matrix, "wb") as f:
+            self._write_header(f, capacity, count)
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(tmp_meta, "w") as f:
+            for row, m in enumerate(meta):
+                f.write(json.dumps({"op": "put", "row": row, **m}, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._unmap()
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_meta, self.meta_path)
+        self._open()
+
+    def _maybe_compact(self):
+        if self._tombstones >= COMPACT_MIN_TOMBSTONES and self._tombstones > len(self._meta):
+            self.compact()
+
+    def compact(self):
+        rows = sorted(self._meta)
+        self._rewrite(np.array(self._mm[rows]), [self._meta[r] for r in rows])
+
+    # --- Reads ---
+    def __len__(self):
+        return len(self._meta)
+
+    def get(self, employee_id):
+        """Metadata of the employee's newest template, or None."""
+        rows = self._rows_by_employee.get(employee_id)
+        return dict(self._meta[rows[-1]]) if rows else None
+
+    def get_template(self, template_id):
+        row = self._row_by_template.get(template_id)
+        return dict(self._meta[row]) if row is not None else None
+
+    def template_count(self, employee_id):
+        return len(self._rows_by_employee.get(employee_id, []))
+
+    def live_rows(self):
+        return sorted(self._meta)
+
+    def vectors(self):
+        """Raw float32 embeddings of the live rows, in live_rows() order (a copy, not a view)."""
+        rows = self.live_rows()
+        if len(rows) == self._count:
+            return np.array(self._mm[:self._count])
+        return np.asarray(self._mm[rows])
+
+    def iter_vectors(self, chunk_rows=65536):
+        """
+        vectors() in blocks of ``chunk_rows`` copied rows, so a gallery build
+        never holds a second full matrix. Consume it before the next mutation
+        (grow and compaction remap the file).
+        """
+        rows = np.asarray(self.live_rows(), dtype=np.int64)
+        contiguous = len(rows) == self._count
+        for start in range(0, len(rows), chunk_rows):
+            if contiguous:
+                yield np.array(self._mm[start:start + chunk_rows])
+            else:
+                yield np.asarray(self._mm[rows[start:start + chunk_rows]])
+
+    def metadata(self):
+        """Metadata of the live rows in live_rows() order. The dicts are shared with the store: treat them as read-only."""
+        return [self._meta[r] for r in self.live_rows()]
+
+    def close(self):
+        self._unmap()
@@ -0,0 +1,159 @@
+"""
+Incremental (delta) sync of face_templates.
+
+Instead of pulling the whole table every cycle, the engine remembers a
+high-water mark on ``face_templates.updated_at`` and the last seen
+``face_template_deletions.id`` (see supabase/migration_v6.sql) and only
+fetches rows past those marks. The marks are persisted next to the
+template store so a restart resumes where it left off.
+
+The full pull stays available (fetch_all_templates) for first boot, the
+periodic reconcile and /api/biometrics/cache/rebuild.
+"""
+import json
+import os
+
+TEMPLATE_SELECT = "id, employee_id, embedding, updated_at, employees(name, role)"
+LEGACY_TEMPLATE_SELECT = "id, employee_id, embedding, employees(name, role)"
+PAGE_SIZE = 1000
+
+
+def flatten_template_row(entry):
+    """face_templates row (with joined employee) -> template store record."""
+    emp_meta = entry.get("employees") or {}
+    return {
+        "employee_id": entry.get("employee_id"),
+        "template_id": entry.get("id"),
+        "face_embedding": entry.get("embedding"),
+        "name": emp_meta.get("name"),
+        "role": emp_meta.get("role"),
+        "updated_at": entry.get("updated_at"),
+    }
+
+
+class SyncState:
+    """High-water marks for delta sync, persisted as a tiny JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.templates_since = None
+        self.deletions_since = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                self.templates_since = data.get("templates_since")
+                self.deletions_since = data.get("deletions_since")
+            except ValueError:
+                pass
+
+    @property
+    def ready(self):
+        return self.templates_since is not None
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"templates_since": self.templates_since, "deletions_since": self.deletions_since}, f)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.templates_since = None
+        self.deletions_since = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _paged(query_factory):
+    start = 0
+    while True:
+        rows = query_factory().range(start, start + PAGE_SIZE - 1).execute().data or []
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
+
+
+def fetch_all_templates(client):
+    """
+    Full pull of face_templates. Returns (records, high_water_mark); the mark
+    is None when the delta-sync columns are not deployed yet.
+    """
+    # Paged with a stable order: PostgREST caps one response at 1000 rows, and
+    # replace_all would otherwise drop every template past the first page.
+    query = lambda select: lambda: client.table("face_templates").select(select).order("id")
+    try:
+        rows = list(_paged(query(TEMPLATE_SELECT)))
+    except Exception as e:
+        if "updated_at" not in str(e):
+            raise
+        print("[SYNC] face_templates.updated_at missing (run migration_v6.sql); delta sync disabled.")
+        rows = list(_paged(query(LEGACY_TEMPLATE_SELECT)))
+        return [flatten_template_row(r) for r in rows], None
+    records = [flatten_template_row(r) for r in rows]
+    marks = [r["updated_at"] for r in records if r.get("updated_at")]
+    return records, max(marks) if marks else ""
+
+
+def fetch_latest_deletion_mark(client):
+    rows = client.table("face_template_deletions") \
+        .select("id") \
+        .order("id", desc=True) \
+        .limit(1) \
+        .execute().data or []
+    return rows[0]["id"] if rows else 0
+
+
+def fetch_template_changes(client, state):
+    """
+    Fetch rows changed or deleted since the stored marks.
+
+    Returns (upserts, deletions, templates_mark, deletions_mark), where each
+    deletion is {"employee_id", "template_id"}; a None template_id (rows
+    journalled before migration_v7) means every template of that employee.
+    ``gte`` is used on the timestamp mark so rows sharing the boundary
+    timestamp are re-read rather than skipped (re-applying them is
+    idempotent); deletions are journalled with a serial id, so that mark is
+    exact. Pages are ordered by (updated_at, id) so offsets stay stable when
+    a bulk write gives many rows the same timestamp.
+    """
+    upserts = {}
+    templates_mark = state.templates_since or ""
+    templates_query = lambda: client.table("face_templates") \
+        .select(TEMPLATE_SELECT) \
+        .gte("updated_at", state.templates_since or "epoch") \
+        .order("updated_at") \
+        .order("id")
+    for row in _paged(templates_query):
+        rec = flatten_template_row(row)
+        upserts[rec["template_id"]] = rec
+        templates_mark = max(templates_mark, rec["updated_at"] or "")
+
+    deleted = {}
+    deletions_since = state.deletions_since or 0
+    deletions_mark = deletions_since
+    deletions_query = lambda: client.table("face_template_deletions") \
+        .select("*") \
+        .gt("id", deletions_since) \
+        .order("id")
+    for row in _paged(deletions_query):
+        key = (row["employee_id"], row.get("template_id"))
+        deleted[key] = max(deleted.get(key, ""), row["deleted_at"])
+        deletions_mark = max(deletions_mark, row["id"])
+
+    # A template deleted and re-written inside one window keeps whichever event is newer.
+    deletions = []
+    for (emp_id, template_id), deleted_at in deleted.items():
+        if template_id is None:
+            stale = [tid for tid, rec in upserts.items()
+                     if rec["employee_id"] == emp_id and (rec.get("updated_at") or "") <= deleted_at]
+        else:
+            rec = upserts.get(template_id)
+            if rec is not None and (rec.get("updated_at") or "") > deleted_at:
+                continue
+            stale = [template_id] if rec is not None else []
+        for tid in stale:
+            upserts.pop(tid)
+        deletions.append({"employee_id": emp_id, "template_id": template_id})
+
+    return list(upserts.values()), deletions, templates_mark, deletions_mark
@@ -51,11 +51,11 @@ class TestOfflineLogic(unittest.TestCase):
         test_log = {"status": "success", "id": "emp_final_test"}
         biometric_api.queue_pending_log(test_log)
         
-        self.assertTrue(os.path.exists(PENDING_LOGS_FILE))
-        with open(PENDING_LOGS_FILE, "r") as f:
-            logs = json.load(f)
+        biometric_api.pending_logs.sync()
+        self.assertTrue(os.path.exists(biometric_api.pending_logs.path))
+        records, _ = biometric_api.pending_logs.read_batch()
         
-        self.assertEqual(logs[0]["id"], "emp_final_test")
+        self.assertEqual(records[-1]["id"], "emp_final_test")
         print("Log Queuing verified.")
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance_client import AttendanceClient, CircuitBreaker
+
+
+class FakeHttp:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.posts = []
+        self.devices = []
+
+    async def post(self, path, json):
+        self.posts.append(json["employee_id"])
+        self.devices.append(json["device_id"])
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("backend down")
+        return SimpleNamespace(status_code=200, text="ok")
+
+    async def aclose(self):
+        pass
+
+
+def test_breaker_opens_then_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.allow()          # one trial call
+    assert not breaker.allow()      # ...and only one
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_marks_share_client_and_retry_after_failure():
+    http = FakeHttp(fail=1)
+
+    async def run():
+        client = AttendanceClient("backend:8000", workers=1, retry_delay=0.01,
+                                  breaker=CircuitBreaker(failure_threshold=5))
+        client.start(client=http)
+        client.submit("E1")
+        client.submit("E2")
+        await asyncio.sleep(0.1)
+        await client.close()
+        return client
+
+    client = asyncio.run(run())
+    assert client.base_url == "http://backend:8000"
+    assert sorted(http.posts) == ["E1", "E1", "E2"]
+    assert client.stats == {"sent": 2, "failed": 0, "retried": 1, "dropped": 0}
+
+
+def test_full_queue_drops_instead_of_piling_up():
+    async def run():
+        client = AttendanceClient("http://backend", workers=1, max_queue=2)
+        client.start(client=FakeHttp())
+        results = [client.submit(f"E{i}") for i in range(4)]
+        await client.close()
+        return client, results
+
+    client, results = asyncio.run(run())
+    assert results == [True, True, False, False]
+    assert client.stats["dropped"] == 2
+
+
+def test_mark_carries_the_scanning_device():
+    http = FakeHttp(fail=1)
+
+    async def run():
+        client = AttendanceClient("http://backend", workers=1, retry_delay=0.01)
+        client.start(client=http)
+        client.submit("E1", "door-north")
+        client.submit("E2")
+        await asyncio.sleep(0.1)
+        await client.close()
+
+    asyncio.run(run())
+    assert sorted(zip(http.posts, http.devices)) == [
+        ("E1", "door-north"), ("E1", "door-north"), ("E2", "office_terminal")]
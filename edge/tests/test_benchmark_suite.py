@@ -0,0 +1,18 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark_suite
+
+
+def test_suite_emits_comparable_json(tmp_path):
+    out = tmp_path / "bench.json"
+    benchmark_suite.main(["--sizes", "200", "--repeat", "1", "--queries", "3", "--skip", "encode",
+                          "--output", str(out)])
+    report = json.loads(out.read_text())
+    names = {r["name"] for r in report["results"]}
+    assert {"cache_json_load", "store_open", "refresh", "compare", "decode"} <= names
+    assert all("p95_ms" in r for r in report["results"])
+    assert "commit" in report["environment"]
@@ -120,3 +120,24 @@ def test_verify_face_success(mock_face_rec, mock_db):
     assert response.status_code == 200
     assert response.json()["success"] is True
     assert response.json()["user"]["employeeId"] == "EMP123"
+
+
+def test_verify_scales_the_client_face_box_to_the_draft_decoded_frame():
+    import asyncio
+    from unittest.mock import AsyncMock
+    import biometric_api
+
+    img = Image.new('RGB', (4000, 3000), color='blue')
+    out = io.BytesIO()
+    img.save(out, format='JPEG')
+    upload = MagicMock(content_type="image/jpeg", read=AsyncMock(return_value=out.getvalue()))
+
+    detect = AsyncMock(return_value=([], []))
+    with patch.object(biometric_api.encoder, "detect_and_encode", detect):
+        result = asyncio.run(biometric_api.run_verify(
+            biometric_api.VerifyTrace("verify"), upload, biometric_api.DEFAULT_DEVICE_ID, "1000,2400,2000,1600", None))
+
+    assert result["error_code"] == "NO_FACE"
+    frame = detect.call_args.args[0]
+    assert frame.shape == (1500, 2000, 3)  # Draft-decoded at 1/2
+    assert detect.call_args.kwargs["roi"] == (500, 1200, 1000, 800)
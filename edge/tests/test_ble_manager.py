@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ble_manager import DoorLink
+
+
+class FakeTransport:
+    def __init__(self, fail_connects=0, fail_writes=0):
+        self.is_connected = False
+        self.fail_connects = fail_connects
+        self.fail_writes = fail_writes
+        self.connects = 0
+        self.written = []
+
+    async def connect(self):
+        self.connects += 1
+        if self.fail_connects:
+            self.fail_connects -= 1
+            raise OSError("device not found")
+        self.is_connected = True
+
+    async def write(self, data):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            self.is_connected = False
+            raise OSError("not connected")
+        self.written.append(data)
+
+    async def disconnect(self):
+        self.is_connected = False
+
+
+def run_link(transport, commands, **kwargs):
+    async def run():
+        link = DoorLink(transport, backoff_min=0.01, backoff_max=0.02, **kwargs)
+        results = [await link.send(c) for c in commands]
+        await link.stop()
+        return link, results
+
+    return asyncio.run(run())
+
+
+def test_commands_share_one_connection():
+    transport = FakeTransport()
+    link, results = run_link(transport, ["ON", "OFF", "ON"])
+    assert all(r["success"] for r in results)
+    assert transport.written == [b"ON", b"OFF", b"ON"]
+    assert transport.connects == 1
+    assert link.stats["writes"] == 3
+
+
+def test_reconnects_with_backoff_and_retries_failed_write():
+    transport = FakeTransport(fail_connects=2, fail_writes=1)
+    link, results = run_link(transport, ["ON"])
+    assert results == [{"success": True, "message": "Command ON executed"}]
+    assert link.stats["connect_failures"] == 2
+    assert link.stats["write_failures"] == 1
+    assert transport.connects == 4
+
+
+def test_unreachable_door_times_out():
+    transport = FakeTransport(fail_connects=1000)
+    link, results = run_link(transport, ["ON"], command_timeout=0.1)
+    assert results == [{"success": False, "message": "Failed to connect to door hardware"}]
+    assert link.metrics()["state"] == "disconnected"
+
+
+def test_connect_now_opens_the_link_before_the_first_command():
+    async def run():
+        transport = FakeTransport(fail_connects=1)
+        link = DoorLink(transport, backoff_min=0.01, backoff_max=0.02)
+        await link.connect_now(timeout=1)
+        assert link.connected and transport.connects == 2
+        assert (await link.send("ON"))["success"] and transport.connects == 2
+
+        unreachable = DoorLink(FakeTransport(fail_connects=1000), backoff_min=0.01, backoff_max=0.02)
+        try:
+            await unreachable.connect_now(timeout=0.05)
+            raise AssertionError("expected a timeout")
+        except asyncio.TimeoutError as e:
+            assert "device not found" in str(e)
+        assert unreachable._task is not None  # Still retrying in the background
+        await unreachable.stop()
+        await link.stop()
+
+    asyncio.run(run())
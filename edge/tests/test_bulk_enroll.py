@@ -0,0 +1,157 @@
+import io
+import os
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_enroll
+from bulk_enroll import load_job, run_bulk_enrollment
+from gallery import GallerySnapshot
+
+
+def face(seed):
+    v = np.random.default_rng(seed).normal(size=128).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+FACES = {b"asha": face(1), b"ravi": face(2), b"ravi-twin": face(2) + 0.01, b"meera": face(3), b"blank": None}
+
+
+def fake_encode(data):
+    vec = FACES[data]
+    return ("OK", vec, 1) if vec is not None else ("NO_FACE", None, 0)
+
+
+def archive(manifest, files, folder="site/"):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w") as z:
+        z.writestr(folder + "manifest.csv", manifest)
+        for name, data in files.items():
+            z.writestr(folder + name, data)
+    return out.getvalue()
+
+
+MANIFEST = """employee_id,name,image
+E1,Asha,asha.jpg
+E2,Ravi,ravi.jpg
+E3,Ravi Twin,twin.jpg
+E4,Meera,meera.jpg
+E5,Nobody,blank.jpg
+E1,Asha Again,asha.jpg
+E6,Missing,missing.jpg
+"""
+FILES = {"asha.jpg": b"asha", "ravi.jpg": b"ravi", "twin.jpg": b"ravi-twin", "meera.jpg": b"meera",
+         "blank.jpg": b"blank"}
+
+
+def fake_client():
+    client = MagicMock()
+    inserted = []
+
+    def insert(records):
+        inserted.extend(records)
+        query = MagicMock()
+        query.execute.return_value.data = [{"id": f"t-{r['employee_id']}", "employee_id": r["employee_id"]}
+                                           for r in records]
+        return query
+
+    client.table.return_value.insert.side_effect = insert
+    client.table.return_value.select.return_value.in_.return_value.order.return_value.execute.return_value.data = []
+    return client, inserted
+
+
+@pytest.fixture
+def run(monkeypatch):
+    monkeypatch.setattr(bulk_enroll, "_encode_photo", fake_encode)
+
+    def _run(**kwargs):
+        source, rows = load_job(archive(MANIFEST, FILES))
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            return run_bulk_enrollment(source, rows, executor=pool, workers=2, upload_photos=False, **kwargs)
+    return _run
+
+
+def test_manifest_inside_archive_folder():
+    _, rows = load_job(archive(MANIFEST, FILES))
+    assert len(rows) == 7 and rows[0]["image"] == "site/asha.jpg" and rows[0]["row"] == 1
+
+
+def test_per_row_report_and_single_local_commit(run):
+    enrolled_gallery = GallerySnapshot.build(
+        [face(3)], [{"employee_id": "E99", "name": "Existing", "template_id": "t99"}], version=1)
+    client, inserted = fake_client()
+    local_batches = []
+
+    report = run(client=client, snapshot=enrolled_gallery, add_local=local_batches.append, chunk_size=1)
+    status = {r["row"]: r["status"] for r in report["rows"]}
+    assert status == {1: "ENROLLED", 2: "CONFLICT", 3: "CONFLICT", 4: "CONFLICT", 5: "NO_FACE",
+                      6: "DUPLICATE_ROW", 7: "MISSING_IMAGE"}
+    rows = {r["row"]: r for r in report["rows"]}
+    assert [c["source"] for c in rows[2]["conflicts"]] == ["batch"] and rows[2]["conflicts"][0]["employee_id"] == "E3"
+    assert rows[4]["conflicts"][0] == {"employee_id": "E99", "name": "Existing", "distance": 0.0, "source": "gallery"}
+
+    assert [r["employee_id"] for r in inserted] == ["E1"]
+    assert len(local_batches) == 1 and local_batches[0][0]["template_id"] == "t-E1"
+    assert report["summary"]["CONFLICT"] == 3
+
+
+def test_re_enroll_and_dry_run(run):
+    client, inserted = fake_client()
+    report = run(client=client, re_enroll=True, dry_run=True)
+    assert report["summary"] == {"ACCEPTED": 4, "NO_FACE": 1, "DUPLICATE_ROW": 1, "MISSING_IMAGE": 1}
+    assert inserted == []
+
+
+def test_photos_are_uploaded_after_the_insert_with_their_own_content_type(monkeypatch):
+    monkeypatch.setattr(bulk_enroll, "_encode_photo", fake_encode)
+    files = {"asha.png": b"asha", "ravi.jpg": b"ravi"}
+    source, rows = load_job(io.BytesIO(archive("employee_id,name,image\nE1,Asha,asha.png\nE2,Ravi,ravi.jpg\n", files)))
+    client, inserted = fake_client()
+    calls = []
+    client.table.return_value.insert.side_effect = lambda records, insert=client.table.return_value.insert.side_effect: \
+        calls.append("insert") or insert(records)
+    bucket = client.storage.from_.return_value
+    bucket.upload.side_effect = lambda path, file, file_options: calls.append((path, file_options["content-type"]))
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        run_bulk_enrollment(source, rows, client=client, executor=pool, workers=1)
+    assert calls[0] == "insert" and all(r["image_url"] == "" for r in inserted)
+    assert sorted(calls[1:]) == [("faces/E1_bulk_1.png", "image/png"), ("faces/E2_bulk_2.jpg", "image/jpeg")]
+    client.table.return_value.update.assert_any_call({"image_url": str(bucket.get_public_url.return_value)})
+
+
+def test_failed_chunk_uploads_nothing(monkeypatch):
+    monkeypatch.setattr(bulk_enroll, "_encode_photo", fake_encode)
+    source, rows = load_job(archive(MANIFEST, FILES))
+    client, _ = fake_client()
+    client.table.return_value.insert.side_effect = RuntimeError("connection reset")
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        report = run_bulk_enrollment(source, rows, client=client, executor=pool, workers=1)
+    assert report["summary"]["DB_ERROR"] == 2  # Asha and Meera; the Ravi look-alikes conflict
+    client.storage.from_.return_value.upload.assert_not_called()
+
+
+def test_bad_row_in_a_chunk_only_fails_that_row(monkeypatch):
+    monkeypatch.setattr(bulk_enroll, "_encode_photo", fake_encode)
+    source, rows = load_job(archive(MANIFEST, FILES))
+    client, inserted = fake_client()
+    insert = client.table.return_value.insert.side_effect
+
+    def reject_meera(records):
+        if any(r["employee_id"] == "E4" for r in records):
+            raise RuntimeError('violates foreign key constraint "face_templates_employee_id_fkey"')
+        return insert(records)
+    client.table.return_value.insert.side_effect = reject_meera
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        report = run_bulk_enrollment(source, rows, client=client, executor=pool, workers=1, upload_photos=False)
+    status = {r["employee_id"]: r["status"] for r in report["rows"] if r["row"] in (1, 4)}
+    assert status == {"E1": "ENROLLED", "E4": "DB_ERROR"}
+    assert [r["employee_id"] for r in inserted] == ["E1"]
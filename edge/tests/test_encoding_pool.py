@@ -0,0 +1,133 @@
+import asyncio
+import os
+import sys
+import threading
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import encoding_pool
+from encoding_pool import EncodingEngine, EngineBusy
+
+
+@pytest.fixture
+def fake_face_rec():
+    mock = MagicMock()
+    previous = encoding_pool._face_recognition
+    encoding_pool._face_recognition = mock
+    yield mock
+    encoding_pool._face_recognition = previous
+
+
+def test_encode_runs_off_loop(fake_face_rec):
+    fake_face_rec.face_encodings.return_value = [np.ones(128)]
+    engine = EncodingEngine(workers=0, max_queue=2)
+    engine._executor = encoding_pool.ThreadPoolExecutor(max_workers=1)
+
+    result = asyncio.run(engine.encode(np.zeros((10, 10, 3), dtype=np.uint8)))
+
+    assert len(result) == 1
+    assert engine.stats()["completed"] == 1
+    engine.shutdown()
+
+
+def test_full_queue_raises_engine_busy(fake_face_rec):
+    release = threading.Event()
+    fake_face_rec.face_encodings.side_effect = lambda *a, **k: release.wait(5) and []
+    engine = EncodingEngine(workers=0, max_queue=1, retry_after=3)
+    engine._executor = encoding_pool.ThreadPoolExecutor(max_workers=1)
+
+    async def burst():
+        first = asyncio.create_task(engine.encode(np.zeros((10, 10, 3), dtype=np.uint8)))
+        await asyncio.sleep(0.05)
+        with pytest.raises(EngineBusy) as busy:
+            await engine.encode(np.zeros((10, 10, 3), dtype=np.uint8))
+        release.set()
+        await first
+        return busy.value
+
+    busy = asyncio.run(burst())
+    assert busy.retry_after == 3
+    assert engine.stats()["rejected"] == 1
+    engine.shutdown()
+
+
+def test_warm_up_runs_a_synthetic_inference(fake_face_rec, monkeypatch):
+    monkeypatch.setattr(encoding_pool, "detect_faces", lambda frame: [])
+    engine = EncodingEngine(workers=0)
+    engine._executor = encoding_pool.ThreadPoolExecutor(max_workers=1)
+
+    assert asyncio.run(engine.warm_up()) == 1
+    assert fake_face_rec.face_encodings.call_count == 1
+
+
+def test_detect_skips_the_encoder(fake_face_rec, monkeypatch):
+    monkeypatch.setattr(encoding_pool, "detect_faces", lambda frame, backend=None, roi=None: [(1, 9, 9, 1)])
+    engine = EncodingEngine(workers=0)
+    engine._executor = encoding_pool.ThreadPoolExecutor(max_workers=1)
+
+    assert asyncio.run(engine.detect(np.zeros((10, 10, 3), dtype=np.uint8))) == [(1, 9, 9, 1)]
+    assert fake_face_rec.face_encodings.call_count == 0
+    engine.shutdown()
+
+
+def test_background_submitter_shares_the_engine_queue_and_waits_when_busy(fake_face_rec):
+    engine = EncodingEngine(workers=0, max_queue=2, retry_after=0)
+    engine._executor = encoding_pool.ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        submitter = engine.background(loop)
+        assert submitter.slots == 1  # Half of the queue; the rest stays free for live requests
+        futures = await loop.run_in_executor(None, lambda: [submitter.submit(pow, n, 2) for n in range(4)])
+        return [await asyncio.wrap_future(f) for f in futures]
+
+    assert asyncio.run(scenario()) == [0, 1, 4, 9]
+    assert engine.completed == 4 and engine._pending == 0
+    engine.shutdown()
+
+
+class BrokenPool:
+    def submit(self, *args):
+        raise encoding_pool.BrokenProcessPool("worker died")
+
+    def shutdown(self, **kwargs):
+        pass
+
+
+def test_broken_pool_is_replaced(fake_face_rec, monkeypatch):
+    monkeypatch.setattr(encoding_pool, "_init_worker", lambda: None)
+    fake_face_rec.face_encodings.return_value = [np.ones(128)]
+    engine = EncodingEngine(workers=0)
+    engine._executor = BrokenPool()
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+
+    with pytest.raises(encoding_pool.BrokenProcessPool):
+        asyncio.run(engine.encode(frame))
+    assert engine.stats()["restarts"] == 1 and engine._pending == 0
+
+    assert len(asyncio.run(engine.encode(frame))) == 1
+    engine.shutdown()
+
+
+def test_background_retries_are_not_counted_as_rejections(fake_face_rec):
+    release = threading.Event()
+    engine = EncodingEngine(workers=0, max_queue=1, retry_after=0)
+    engine._executor = encoding_pool.ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        held = asyncio.create_task(engine._submit(release.wait, 5))
+        await asyncio.sleep(0.05)
+        waiting = asyncio.wrap_future(engine.background(loop).submit(pow, 3, 2))
+        await asyncio.sleep(0.05)
+        release.set()
+        await held
+        return await waiting
+
+    assert asyncio.run(scenario()) == 9
+    assert engine.rejected == 0
+    engine.shutdown()
@@ -0,0 +1,72 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_detection
+from face_detection import RoiTracker, detect_faces, downscale, parse_face_box
+
+
+def test_downscale_caps_longest_side():
+    small, factor = downscale(np.zeros((1080, 1920, 3), dtype=np.uint8), 640)
+    assert factor == 3
+    assert max(small.shape[:2]) <= 640
+
+
+def test_none_detector_treats_frame_as_crop():
+    assert detect_faces(np.zeros((150, 120, 3), dtype=np.uint8), backend="none") == [(0, 120, 150, 0)]
+
+
+def test_boxes_are_scaled_back_and_roi_offset(monkeypatch):
+    seen = []
+
+    def fake_detect(image, backend):
+        seen.append(image.shape[:2])
+        return [(10, 40, 40, 10)]
+
+    monkeypatch.setattr(face_detection, "_detect", fake_detect)
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    full = detect_faces(frame, backend="hog", max_side=640)
+    assert full == [(30, 120, 120, 30)]
+
+    roi = detect_faces(frame, backend="hog", max_side=640, roi=(500, 900, 600, 800))
+    top, right, bottom, left = roi[0]
+    assert top >= 440 and left >= 740  # searched inside the expanded ROI only
+    assert seen[-1][0] < 1080
+
+
+def test_roi_falls_back_to_full_frame(monkeypatch):
+    calls = []
+
+    def fake_detect(image, backend):
+        calls.append(image.shape[:2])
+        return [] if len(calls) == 1 else [(1, 5, 5, 1)]
+
+    monkeypatch.setattr(face_detection, "_detect", fake_detect)
+    assert detect_faces(np.zeros((100, 100, 3), dtype=np.uint8), backend="hog", roi=(10, 20, 20, 10))
+    assert len(calls) == 2
+
+
+def test_parse_face_box_and_tracker_ttl(monkeypatch):
+    assert parse_face_box("10,50,60,5") == (10, 50, 60, 5)
+    assert parse_face_box("bad") is None
+    assert parse_face_box("60,50,10,5") is None
+    assert parse_face_box("inf,1,2,0") is None
+    assert parse_face_box("1e999,50,60,5") is None
+    assert parse_face_box("nan,50,60,5") is None
+
+    tracker = RoiTracker(ttl=1.0)
+    monkeypatch.setattr(face_detection.time, "time", lambda: 100.0)
+    tracker.update("door-1", (1, 2, 3, 0))
+    assert tracker.get("door-1") == (1, 2, 3, 0)
+    monkeypatch.setattr(face_detection.time, "time", lambda: 102.0)
+    assert tracker.get("door-1") is None
+
+
+def test_scale_box_maps_client_boxes_onto_the_decoded_frame():
+    assert face_detection.scale_box((400, 1200, 1000, 600), 0.5) == (200, 600, 500, 300)
+    assert face_detection.scale_box((1, 2, 3, 0), 1.0) == (1, 2, 3, 0)
+    assert face_detection.scale_box(None, 0.25) is None
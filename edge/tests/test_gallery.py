@@ -0,0 +1,87 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import Gallery, GallerySnapshot
+
+
+def meta(emp, tid):
+    return {"employee_id": emp, "template_id": tid, "name": emp, "role": "employee", "updated_at": None}
+
+
+def record(emp, tid, vec):
+    return {**meta(emp, tid), "face_embedding": vec.tolist()}
+
+
+@pytest.fixture
+def snapshot():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3, 128)).astype(np.float32) * 3
+    return GallerySnapshot.build(vectors, [meta("A", "a1"), meta("A", "a2"), meta("B", "b1")], version=1)
+
+
+def test_build_normalises_and_freezes(snapshot):
+    assert np.allclose(np.linalg.norm(snapshot.vectors, axis=1), 1.0)
+    assert snapshot.row_by_template == {"a1": 0, "a2": 1, "b1": 2}
+    assert snapshot.employee_count() == 2
+    with pytest.raises(ValueError):
+        snapshot.vectors[0, 0] = 1.0
+
+
+def test_patched_is_copy_on_write(snapshot):
+    new_vec = np.ones(128, dtype=np.float32)
+    patched = snapshot.patched(
+        [record("C", "c1", new_vec)],
+        [{"employee_id": "A", "template_id": None}],
+        version=2,
+    )
+    assert [m["template_id"] for m in patched.metadata] == ["b1", "c1"]
+    assert patched.version == 2
+    people, dist, rows = patched.matcher.search_groups(new_vec / np.linalg.norm(new_vec), k=1)
+    assert patched.metadata[rows[0]]["employee_id"] == "C" and dist[0] < 1e-5
+    # The published-before snapshot that in-flight requests hold is untouched
+    assert len(snapshot) == 3 and snapshot.metadata[0]["template_id"] == "a1"
+
+
+def test_publish_swaps_reference(snapshot):
+    gallery = Gallery()
+    held = gallery.current
+    gallery.publish(snapshot)
+    assert len(held) == 0 and gallery.current is snapshot
+    assert gallery.next_version() < gallery.next_version()
+
+
+def test_nearest_employees_reduces_templates_per_person(snapshot):
+    probe = snapshot.vectors[1]
+    nearest = snapshot.nearest_employees(probe, k=3)
+    assert [c["employee_id"] for c in nearest] == ["A", "B"]
+    assert nearest[0]["template_id"] == "a2" and nearest[0]["distance"] < 1e-5
+    assert GallerySnapshot.empty().nearest_employees(probe) == []
+
+
+def test_compact_snapshot_maps_rerank_file_and_removes_it(tmp_path):
+    prefix = str(tmp_path / "templates")
+    (tmp_path / "templates.rerank.7.f32").write_bytes(b"stale")
+    gallery = Gallery(backend="int8", rerank_prefix=prefix)
+    assert not (tmp_path / "templates.rerank.7.f32").exists()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 128)).astype(np.float32)
+    metadata = [meta(f"E{i}", f"t{i}") for i in range(200)]
+    chunks = iter([vectors[:150], vectors[150:]])
+    first = GallerySnapshot.build(chunks, metadata, version=1, previous=gallery.current)
+    assert first.compact and first.matcher.backend == "int8"
+    assert np.allclose(first.vectors, vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+    assert first.nearest_employees(first.vectors[42], k=1)[0]["employee_id"] == "E42"
+
+    second = first.patched([record("E0", "t0", vectors[1])], [{"employee_id": "E5", "template_id": None}], version=2)
+    assert second.compact and len(second) == 199
+    assert np.allclose(second.vectors[second.row_by_template["t0"]], first.vectors[1])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["templates.rerank.1.f32", "templates.rerank.2.f32"]
+
+    del first
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["templates.rerank.2.f32"]
@@ -0,0 +1,60 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_decode import DecodeError, decode_upload, encode_jpeg, parse_content_type
+
+
+def jpeg(w, h, mode="RGB"):
+    out = io.BytesIO()
+    Image.new(mode, (w, h), 128).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def test_large_jpeg_is_draft_downscaled():
+    upload = decode_upload(jpeg(4000, 3000), "image/jpeg", max_side=1280)
+    assert upload.frame.shape == (1500, 2000, 3)  # 1/2 DCT scale, still covers 1280
+    assert upload.encoded and not upload.chip
+    assert upload.scale == 0.5
+    assert decode_upload(jpeg(640, 480), "image/jpeg").scale == 1.0
+
+
+def test_small_and_grey_jpegs_come_out_rgb_full_size():
+    assert decode_upload(jpeg(640, 480), "image/jpeg").frame.shape == (480, 640, 3)
+    assert decode_upload(jpeg(320, 240, "L"), None).frame.shape == (240, 320, 3)
+
+
+def test_raw_frames_need_no_codec():
+    rgb = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+    upload = decode_upload(rgb.tobytes(), "application/x-raw-rgb; width=6; height=4")
+    assert np.array_equal(upload.frame, rgb) and not upload.encoded
+
+    grey = decode_upload(bytes(range(24)), "application/x-raw-gray; width=6; height=4").frame
+    assert grey.shape == (4, 6, 3) and np.array_equal(grey[..., 0], grey[..., 2])
+
+
+def test_bad_uploads_raise_decode_error():
+    with pytest.raises(DecodeError):
+        decode_upload(b"\x00" * 10, "application/x-raw-rgb; width=6; height=4")
+    with pytest.raises(DecodeError):
+        decode_upload(b"\x00" * 10, "application/x-raw-rgb")
+    with pytest.raises(DecodeError):
+        decode_upload(b"not an image", "image/jpeg")
+
+
+def test_face_chip_is_flagged_and_not_downscaled():
+    upload = decode_upload(jpeg(2000, 2000), "image/x-face-chip", max_side=640)
+    assert upload.chip and upload.frame.shape == (2000, 2000, 3)
+
+
+def test_content_type_parameters_and_jpeg_roundtrip():
+    assert parse_content_type('Application/X-Raw-RGB; width="6";height=4') == (
+        "application/x-raw-rgb", {"width": "6", "height": "4"})
+    frame = np.zeros((8, 8, 3), dtype=np.uint8)
+    assert decode_upload(encode_jpeg(frame), "image/jpeg").frame.shape == (8, 8, 3)
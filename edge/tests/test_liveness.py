@@ -0,0 +1,57 @@
+import asyncio
+import io
+import os
+import sys
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from liveness import LivenessPipeline, prepare_payload
+
+
+def jpeg(w=1920, h=1080):
+    out = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (h, w, 3), dtype=np.uint8)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def test_payload_is_downscaled():
+    assert max(prepare_payload(jpeg(), max_side=512).size) <= 512
+
+
+def test_verdict_cached_per_device_and_face():
+    model = MagicMock()
+    model.generate_content.return_value.text = "READY"
+    pipeline = LivenessPipeline(model=model)
+    face = np.ones(128, dtype=np.float32)
+
+    async def run():
+        first = await pipeline.check(jpeg(), "door_a", face)
+        again = await pipeline.check(jpeg(), "door_a", face * 1.01)
+        other_door = await pipeline.check(jpeg(), "door_b", face)
+        return first, again, other_door
+
+    first, again, other_door = asyncio.run(run())
+    assert first == again == other_door == (True, "Live Human Detected")
+    assert model.generate_content.call_count == 2
+    assert pipeline.stats["cache_hits"] == 1
+
+
+def test_budget_exceeded_fails_open():
+    model = MagicMock()
+    model.generate_content.side_effect = lambda *_: time.sleep(0.5)
+    pipeline = LivenessPipeline(model=model, timeout=0.05)
+    assert asyncio.run(pipeline.check(jpeg(64, 64))) == (True, "Timeout-Skipped")
+    assert pipeline.stats["timeouts"] == 1
+
+
+def test_local_checker_stands_in_when_model_fails():
+    model = MagicMock()
+    model.generate_content.side_effect = ConnectionError("offline")
+    pipeline = LivenessPipeline(model=model, local_checker=lambda img: (False, "local spoof"))
+    assert asyncio.run(pipeline.check(jpeg(64, 64))) == (False, "local spoof")
+    assert pipeline.stats["local"] == 1
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_writer import AccessLogWriter
+
+
+def test_records_are_coalesced_into_batches():
+    batches = []
+
+    async def run():
+        writer = AccessLogWriter(batches.append, lambda r: None, batch_size=4, flush_interval=0.05)
+        for i in range(10):
+            writer.submit({"n": i})
+        await asyncio.sleep(0.2)
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(run())
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert writer.stats["inserted"] == 10
+
+
+def test_failed_batch_and_overflow_are_spilled():
+    spilled = []
+
+    def failing(records):
+        raise ConnectionError("offline")
+
+    async def run():
+        writer = AccessLogWriter(failing, spilled.extend, max_queue=2, batch_size=10, flush_interval=0.05)
+        for i in range(3):
+            writer.submit({"n": i})  # third one overflows the queue
+        await writer.stop()
+
+    asyncio.run(run())
+    assert sorted(r["n"] for r in spilled) == [0, 1, 2]
+
+
+def test_stop_writes_the_batch_being_collected():
+    batches = []
+
+    async def run():
+        writer = AccessLogWriter(batches.append, lambda r: None, batch_size=10, flush_interval=30)
+        for i in range(3):
+            writer.submit({"n": i})
+        await asyncio.sleep(0.05)  # The background task has taken all three off the queue
+        assert writer.pending() == 0
+        await writer.stop()
+
+    asyncio.run(run())
+    assert [r["n"] for b in batches for r in b] == [0, 1, 2]
+
+
+def test_failed_spill_does_not_stop_the_writer():
+    attempts = []
+
+    def flaky(records):
+        attempts.append(len(records))
+        if len(attempts) == 1:
+            raise ConnectionError("offline")
+
+    def broken_journal(records):
+        raise OSError("disk full")
+
+    async def run():
+        writer = AccessLogWriter(flaky, broken_journal, batch_size=2, flush_interval=0.02)
+        writer.submit({"n": 0})
+        await asyncio.sleep(0.1)
+        writer.submit({"n": 1})
+        await asyncio.sleep(0.1)
+        assert not writer._task.done()
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(run())
+    assert writer.stats["lost"] == 1 and writer.stats["inserted"] == 1
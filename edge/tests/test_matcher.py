@@ -0,0 +1,130 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matcher
+from matcher import ExactMatcher, IVFMatcher, RowSubset, build_matcher, classify_match, top_k
+
+
+def gallery(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, 128)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_top_k_matches_full_sort():
+    d = np.array([0.9, 0.1, 0.5, 0.3, 0.7])
+    assert top_k(d, 2).tolist() == [1, 3]
+    assert top_k(d, 10).tolist() == [1, 3, 2, 4, 0]
+
+
+def test_exact_matches_face_distance_semantics():
+    vectors = gallery(50)
+    probe = vectors[7] + 0.01
+    idx, dist = ExactMatcher(vectors).search(probe, k=2)
+    expected = np.linalg.norm(vectors - probe, axis=1)
+    assert idx[0] == 7
+    assert dist.tolist() == np.sort(expected)[:2].tolist()
+
+
+def test_ivf_agrees_with_exact_on_near_duplicates():
+    vectors = gallery(4000)
+    exact, ivf = ExactMatcher(vectors), IVFMatcher(vectors, nprobe=8)
+    rng = np.random.default_rng(1)
+    for row in rng.choice(len(vectors), 25, replace=False):
+        probe = vectors[row] + rng.normal(scale=0.01, size=128).astype(np.float32)
+        assert ivf.search(probe)[0][0] == exact.search(probe)[0][0] == row
+
+
+def test_build_matcher_falls_back_to_exact_for_small_galleries(monkeypatch):
+    monkeypatch.setattr(matcher, "IVF_MIN_SIZE", 100)
+    assert build_matcher(gallery(10), backend="ivf").backend == "exact"
+    first = build_matcher(gallery(200), backend="ivf")
+    second = build_matcher(gallery(210, seed=3), backend="ivf", previous=first)
+    assert second.backend == "ivf"
+    assert second.centroids is first.centroids
+
+
+def test_empty_gallery():
+    idx, dist = ExactMatcher(np.empty((0, 128), dtype=np.float32)).search(np.zeros(128))
+    assert len(idx) == 0 and len(dist) == 0
+
+
+def test_search_groups_ranks_people_not_templates():
+    vectors = gallery(6)
+    # Two near-identical templates of person 0 would look "ambiguous" per row.
+    vectors[1] = vectors[0] + 0.001
+    groups = np.array([0, 0, 1, 2, 3, 4])
+    probe = vectors[0]
+    for m in (ExactMatcher(vectors, groups=groups), IVFMatcher(vectors, groups=groups, nlist=2, nprobe=2)):
+        people, dist, rows = m.search_groups(probe, k=2)
+        assert people[0] == 0 and rows[0] == 0
+        assert people[1] != 0
+        assert dist[1] > 0.5
+
+
+def test_batch_search_matches_single_probe_search():
+    vectors = gallery(300)
+    groups = np.arange(300) // 3
+    m = ExactMatcher(vectors, groups=groups)
+    probes = vectors[[5, 100, 250]] + 0.005
+    for probe, (people, dist, rows) in zip(probes, m.search_groups_batch(probes, k=2)):
+        single = m.search_groups(probe, k=2)
+        assert people.tolist() == single[0].tolist()
+        assert rows.tolist() == single[2].tolist()
+        assert np.allclose(dist, single[1], atol=1e-4)
+
+
+def test_quantized_rerank_matches_exact_distances():
+    vectors = gallery(3000)
+    groups = np.arange(3000) // 3
+    exact = ExactMatcher(vectors, groups=groups)
+    rng = np.random.default_rng(2)
+    probes = vectors[rng.choice(len(vectors), 20, replace=False)] + rng.normal(scale=0.02, size=(20, 128)).astype(np.float32)
+    for dtype in ("int8", "float16"):
+        quantized = build_matcher(vectors, groups=groups, backend=dtype)
+        assert quantized.backend == dtype and quantized.codes.nbytes <= vectors.nbytes // 2
+        for probe, batched in zip(probes, quantized.search_groups_batch(probes)):
+            expected = exact.search_groups(probe)
+            found = quantized.search_groups(probe)
+            assert found[0].tolist() == batched[0].tolist() == expected[0].tolist()
+            assert np.allclose(found[1], expected[1], atol=1e-6)  # Re-ranked in float32
+
+
+def test_quantized_handles_empty_gallery():
+    empty = build_matcher(np.empty((0, 128), dtype=np.float32), backend="int8")
+    assert len(empty.search_groups(gallery(1)[0])[0]) == 0
+    assert len(empty.search(gallery(1)[0])[0]) == 0
+
+
+def test_subset_search_matches_a_matcher_built_on_those_rows(monkeypatch):
+    monkeypatch.setattr(matcher, "IVF_MIN_SIZE", 100)
+    vectors = gallery(900)
+    groups = np.arange(900) // 3
+    rows = np.flatnonzero(groups % 2 == 0)  # Every other person
+    subset = RowSubset(rows, groups)
+    reference = ExactMatcher(vectors[rows], groups=groups[rows])
+    probes = vectors[[0, 7, 601]] + 0.01  # Row 7 (person 2) is in scope, 601 (person 200) too
+    for backend in ("exact", "ivf", "int8"):
+        m = build_matcher(vectors, groups=groups, backend=backend)
+        for probe, batched in zip(probes, m.search_groups_batch(probes, k=2, subset=subset)):
+            people, dist, found = m.search_groups(probe, k=2, subset=subset)
+            expected = reference.search_groups(probe, k=2)
+            assert people.tolist() == batched[0].tolist()
+            assert set(found.tolist()) <= set(rows.tolist())
+            # Runner-up on random vectors is noise for the approximate backends; the match itself is not.
+            n = 2 if backend == "exact" else 1
+            assert people[:n].tolist() == expected[0][:n].tolist()
+            assert found[:n].tolist() == rows[expected[2][:n]].tolist()
+            assert np.allclose(dist[:n], expected[1][:n], atol=1e-5)
+    assert len(build_matcher(vectors, backend="int8").search_groups(probes[0], subset=RowSubset([], groups))[0]) == 0
+
+
+def test_classify_match_applies_threshold_and_ambiguity_gap():
+    assert classify_match([0.30, 0.50]) == "MATCH"
+    assert classify_match([0.30]) == "MATCH"
+    assert classify_match([0.50, 0.70]) == "NOT_RECOGNIZED"
+    assert classify_match([0.40, 0.42]) == "AMBIGUOUS_MATCH"
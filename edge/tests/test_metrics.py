@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry, VerifyTrace, VERIFY_SECONDS, VERIFY_STAGE_SECONDS
+
+
+def test_text_exposition():
+    registry = Registry()
+    ops = registry.counter("ble_ops_total", "Door commands.", ("command", "result"))
+    ops.inc(command="ON", result="ok")
+    ops.inc(2, command="ON", result="ok")
+    latency = registry.histogram("op_seconds", "Latency.", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    registry.callback("queue_depth", "Depth.", lambda: 7)
+    registry.callback("broken", "Raises.", lambda: 1 / 0)
+
+    text = registry.render()
+    assert "# TYPE ble_ops_total counter" in text
+    assert 'ble_ops_total{command="ON",result="ok"} 3' in text
+    assert 'op_seconds_bucket{le="0.1"} 1' in text
+    assert 'op_seconds_bucket{le="1.0"} 2' in text
+    assert 'op_seconds_bucket{le="+Inf"} 2' in text
+    assert "op_seconds_count 2" in text
+    assert "queue_depth 7" in text
+    assert "broken" not in text
+
+
+def test_verify_trace_records_stages_under_outcome():
+    trace = VerifyTrace("test_endpoint")
+    trace.mark("read")
+    trace.mark("encode")
+    trace.finish("NO_FACE")
+    stages = "\n".join(VERIFY_STAGE_SECONDS.render())
+    assert 'verify_stage_seconds_count{endpoint="test_endpoint",stage="encode",outcome="NO_FACE"} 1' in stages
+    assert 'verify_seconds_count{endpoint="test_endpoint",outcome="NO_FACE"} 1' in "\n".join(VERIFY_SECONDS.render())
+    assert set(trace.latencies_ms()) == {"read", "encode", "total"}
@@ -0,0 +1,155 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import GallerySnapshot
+from partitions import PartitionIndex, Partitions, PartitionState, UnknownDevice
+
+
+class FakeQuery:
+    """Just enough of the supabase query builder for gte/gt/order/limit/range."""
+
+    def __init__(self, rows, missing=False, keys=()):
+        self.rows = rows
+        self.missing = missing
+        self.keys = keys
+
+    def select(self, *_):
+        return self
+
+    def gte(self, col, value):
+        return FakeQuery([r for r in self.rows if value == "epoch" or r[col] >= value], self.missing)
+
+    def gt(self, col, value):
+        return FakeQuery([r for r in self.rows if r[col] > value], self.missing)
+
+    def order(self, col, desc=False):
+        keys = self.keys + (col,)  # A later order() breaks ties, as in PostgREST
+        return FakeQuery(sorted(self.rows, key=lambda r: tuple(r[k] for k in keys), reverse=desc), self.missing, keys)
+
+    def limit(self, n):
+        return FakeQuery(self.rows[:n], self.missing)
+
+    def range(self, start, end):
+        return FakeQuery(self.rows[start:end + 1], self.missing)
+
+    def execute(self):
+        if self.missing:
+            raise Exception('relation "public.partition_members" does not exist (42P01)')
+        return self
+
+    @property
+    def data(self):
+        return self.rows
+
+
+class FakeClient:
+    def __init__(self, tables, missing=False):
+        self.tables = tables
+        self.missing = missing
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, []), self.missing)
+
+
+def member(emp, partition, ts="2026-01-01T00:00:00"):
+    return {"employee_id": emp, "partition": partition, "updated_at": ts}
+
+
+def device(device_id, parts, ts="2026-01-01T00:00:00"):
+    return {"device_id": device_id, "site_id": "HQ", "door_id": device_id, "partitions": parts, "updated_at": ts}
+
+
+@pytest.fixture
+def snapshot():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(6, 128)).astype(np.float32)
+    employees = ["A", "A", "B", "C", "D", "D"]
+    metadata = [{"employee_id": e, "template_id": f"t{i}", "name": e} for i, e in enumerate(employees)]
+    return GallerySnapshot.build(vectors, metadata, version=1)
+
+
+def test_scope_only_scans_partition_members(tmp_path, snapshot):
+    index = PartitionIndex({"A": {"site:HQ"}, "D": {"site:HQ", "door:lab"}, "B": {"site:Annex"}},
+                           {"front": {"site_id": "HQ", "door_id": "front", "partitions": ("site:HQ",)}}, version=1)
+    partitions = Partitions(PartitionState(str(tmp_path / "p.json")))
+    partitions.publish(index)
+
+    scope = partitions.searcher(snapshot, "front")
+    assert scope.rows.tolist() == [0, 1, 4, 5]
+    _, _, rows = scope.search_groups(snapshot.vectors[2], k=2)  # B's own template is out of scope
+    assert set(rows.tolist()) <= {0, 1, 4, 5}
+    assert scope.search_groups_batch(snapshot.vectors[[4]], k=1)[0][2].tolist() == [4]
+    assert partitions.searcher(snapshot, "front") is scope  # Cached per (snapshot, index) version
+    assert partitions.searcher(snapshot, "unmapped") is snapshot.matcher
+
+    partitions.strict = True
+    with pytest.raises(UnknownDevice):
+        partitions.searcher(snapshot, "unmapped")
+
+
+def test_scopes_share_the_snapshot_matcher_and_survive_untouched_deltas(tmp_path, snapshot):
+    index = PartitionIndex({"A": {"site:HQ"}, "D": {"site:HQ"}, "B": {"site:Annex"}, "C": {"site:Annex"}},
+                           {"front": {"site_id": "HQ", "door_id": "front", "partitions": ("site:HQ",)},
+                            "annex": {"site_id": "Annex", "door_id": "annex", "partitions": ("site:Annex",)}},
+                           version=1)
+    partitions = Partitions(PartitionState(str(tmp_path / "p.json")))
+    partitions.publish(index)
+    partitions.warm(snapshot)
+    front, annex = partitions.searcher(snapshot, "front"), partitions.searcher(snapshot, "annex")
+    assert front.matcher is snapshot.matcher  # No per-scope copy of the rows
+
+    # Drop B's template (row 2): the HQ scope is carried over with shifted rows, Annex is rebuilt.
+    patched = snapshot.patched([], [{"employee_id": "B", "template_id": None}], version=2)
+    carried = partitions.searcher(patched, "front")
+    assert carried.subset.order is front.subset.order
+    assert carried.rows.tolist() == [0, 1, 3, 4]
+    assert partitions.searcher(patched, "annex").rows.tolist() == [2]
+    _, _, rows = carried.search_groups(patched.vectors[3], k=1)
+    assert rows.tolist() == [3] and patched.metadata[3]["employee_id"] == "D"
+
+
+def test_full_then_delta_sync_updates_index_incrementally(tmp_path, snapshot):
+    tables = {
+        "partition_members": [member("A", "site:HQ"), member("B", "site:HQ")],
+        "partition_member_deletions": [],
+        "devices": [device("front", ["site:HQ"])],
+    }
+    client = FakeClient(tables)
+    state_path = str(tmp_path / "p.json")
+    partitions = Partitions(PartitionState(state_path))
+    assert partitions.sync(client) == 3
+    assert partitions.index.employees_in(("site:HQ",)) == {"A", "B"}
+    version = partitions.index.version
+
+    assert partitions.sync(client) == 0  # Boundary rows re-read by the inclusive mark are not changes
+    assert partitions.index.version == version
+
+    tables["partition_members"] = [member("B", "site:HQ"), member("C", "site:HQ", "2026-01-02T00:00:00")]
+    tables["partition_member_deletions"] = [
+        {"id": 1, "employee_id": "A", "partition": "site:HQ", "deleted_at": "2026-01-02T00:00:00"}]
+    tables["devices"].append(device("lab", ["door:lab"], "2026-01-02T00:00:00"))
+    assert partitions.sync(client) == 3
+    assert partitions.index.employees_in(("site:HQ",)) == {"B", "C"}
+    assert partitions.searcher(snapshot, "front").rows.tolist() == [2, 3]
+
+    reopened = PartitionState(state_path)  # Offline restart keeps the index and the marks
+    assert reopened.index.employees_in(("site:HQ",)) == {"B", "C"}
+    assert reopened.index.device_partitions("lab") == ("door:lab",)
+    assert reopened.deletions_since == 1
+
+
+def test_missing_tables_fall_back_to_whole_gallery(tmp_path, snapshot):
+    partitions = Partitions(PartitionState(str(tmp_path / "p.json")))
+    assert partitions.sync(FakeClient({}, missing=True)) is None
+    assert not partitions.available
+    assert partitions.searcher(snapshot, "front") is snapshot.matcher
+
+
+def test_rows_for_employees(snapshot):
+    assert snapshot.rows_for_employees(["D", "B", "nobody"]).tolist() == [2, 4, 5]
+    assert snapshot.rows_for_employees([]).tolist() == []
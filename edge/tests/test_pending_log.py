@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pending_log import PendingLogQueue, is_permanent_error
+
+
+def test_append_assigns_client_ids_and_flush_drains(tmp_path):
+    queue = PendingLogQueue(str(tmp_path / "pending"))
+    ids = [queue.append({"employee_id": f"E{i}", "status": "success"}) for i in range(7)]
+    assert len(set(ids)) == 7
+
+    chunks = []
+    assert queue.flush(chunks.append, chunk_size=3) == 7
+    assert [len(c) for c in chunks] == [3, 3, 1]
+    assert [r["id"] for c in chunks for r in c] == ids
+    assert len(queue) == 0
+    assert os.path.getsize(queue.path) == 0
+
+
+def test_failed_chunk_is_replayed_with_same_ids(tmp_path):
+    queue = PendingLogQueue(str(tmp_path / "pending"))
+    for i in range(4):
+        queue.append({"employee_id": f"E{i}"})
+    calls = []
+
+    def flaky(records):
+        calls.append([r["id"] for r in records])
+        if len(calls) == 2:
+            raise ConnectionError("offline")
+
+    with pytest.raises(ConnectionError):
+        queue.flush(flaky, chunk_size=2)
+    assert len(queue) == 2
+
+    queue.flush(flaky, chunk_size=2)
+    assert calls[2] == calls[1]  # Same client UUIDs -> server-side upsert is a no-op on overlap
+
+
+def test_recovery_truncates_torn_line_and_keeps_offset(tmp_path):
+    prefix = str(tmp_path / "pending")
+    queue = PendingLogQueue(prefix)
+    for i in range(3):
+        queue.append({"employee_id": f"E{i}"})
+    records, end = queue.read_batch(1)
+    queue.commit(end)
+    queue.close()
+    with open(prefix + ".jsonl", "ab") as f:
+        f.write(b'{"employee_id": "torn')
+
+    reopened = PendingLogQueue(prefix)
+    records, _ = reopened.read_batch()
+    assert [r["employee_id"] for r in records] == ["E1", "E2"]
+
+
+def test_legacy_json_is_imported(tmp_path):
+    legacy = tmp_path / "pending_logs.json"
+    legacy.write_text(json.dumps([{"employee_id": "OLD"}]))
+    queue = PendingLogQueue(str(tmp_path / "pending"), legacy_path=str(legacy))
+    assert not legacy.exists()
+    assert queue.read_batch()[0][0]["employee_id"] == "OLD"
+
+
+def test_backlog_count_tracks_appends_and_commits(tmp_path):
+    prefix = str(tmp_path / "pending")
+    queue = PendingLogQueue(prefix)
+    for i in range(5):
+        queue.append({"employee_id": f"E{i}"})
+    _, end = queue.read_batch(2)
+    queue.commit(end)
+    assert len(queue) == 3
+    queue.close()
+    assert len(PendingLogQueue(prefix)) == 3
+
+
+class CheckViolation(Exception):
+    code = "23514"
+
+
+def test_permanently_rejected_records_are_isolated_and_dead_lettered(tmp_path):
+    queue = PendingLogQueue(str(tmp_path / "pending"))
+    for i in range(10):
+        queue.append({"n": i, "status": "spoof" if i in (3, 8) else "success"})
+    inserted = []
+
+    def insert(records):
+        if any(r["status"] == "spoof" for r in records):
+            raise CheckViolation('new row violates check constraint "access_logs_status_check"')
+        inserted.extend(records)
+
+    assert queue.flush(insert, chunk_size=5) == 8
+    assert sorted(r["n"] for r in inserted) == [0, 1, 2, 4, 5, 6, 7, 9]
+    assert len(queue) == 0 and queue.dead_lettered == 2
+    with open(queue.dead_letter_path) as f:
+        dead = [json.loads(line) for line in f]
+    assert [d["record"]["n"] for d in dead] == [3, 8] and "check constraint" in dead[0]["error"]
+
+
+def test_transient_errors_are_not_dead_lettered():
+    assert is_permanent_error(CheckViolation())
+    assert not is_permanent_error(ConnectionError("Server disconnected"))
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from photo_upload import PhotoUploader
+
+
+def test_failed_upload_is_retried_in_background():
+    attempts = []
+
+    def upload(path, data):
+        attempts.append(path)
+        if len(attempts) < 3:
+            raise ConnectionError("uplink down")
+
+    async def run():
+        uploader = PhotoUploader(upload, retry_delay=0.01)
+        uploader.begin("faces/a.jpg", b"jpeg")
+        assert uploader.pending() == 1  # caller does not wait for the upload
+        await uploader.stop()
+        return uploader
+
+    uploader = asyncio.run(run())
+    assert attempts == ["faces/a.jpg"] * 3
+    assert uploader.stats == {"uploaded": 1, "failed": 0, "retried": 2, "discarded": 0}
+
+
+def test_gives_up_after_max_retries():
+    def upload(path, data):
+        raise ConnectionError("uplink down")
+
+    async def run():
+        uploader = PhotoUploader(upload, max_retries=1, retry_delay=0.01)
+        uploader.begin("faces/a.jpg", b"jpeg")
+        await uploader.stop()
+        return uploader.stats
+
+    assert asyncio.run(run())["failed"] == 1
+
+
+def test_discard_removes_an_object_that_was_already_stored():
+    removed = []
+    started, release = threading.Event(), threading.Event()
+
+    def upload(path, data):
+        started.set()
+        release.wait(1)
+
+    async def run():
+        uploader = PhotoUploader(upload, remove=removed.append)
+        uploader.begin("faces/a.jpg", b"jpeg")
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 1)
+        uploader.discard("faces/a.jpg")  # rejected while the upload is in flight
+        release.set()
+        await asyncio.wait(list(uploader._tasks.values()))
+        uploader._executor.shutdown(wait=True)
+        return uploader.stats
+
+    stats = asyncio.run(run())
+    assert removed == ["faces/a.jpg"]
+    assert stats["uploaded"] == 0 and stats["discarded"] == 1
+
+
+def test_discard_stops_retrying():
+    attempts = []
+
+    def upload(path, data):
+        attempts.append(path)
+        raise ConnectionError("uplink down")
+
+    async def run():
+        uploader = PhotoUploader(upload, retry_delay=0.05)
+        uploader.begin("faces/a.jpg", b"jpeg")
+        await asyncio.sleep(0.01)
+        uploader.discard("faces/a.jpg")
+        await uploader.stop()
+
+    asyncio.run(run())
+    assert attempts == ["faces/a.jpg"]
@@ -0,0 +1,68 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reprocess_biometrics
+from reprocess_biometrics import Checkpoint, reencode
+
+TEMPLATES = [{"id": f"t{i}", "employee_id": f"E{i}", "image_url": f"https://x/{i}.jpg"} for i in range(7)]
+
+
+def fake_encode(data, take_largest=False):
+    if data == b"3":
+        return "NO_FACE", None, 0
+    return "OK", np.full(128, int(data), dtype=np.float32), 1
+
+
+def download(url):
+    name = url.rsplit("/", 1)[1].split(".")[0]
+    if name == "5":
+        raise ConnectionError("flaky")
+    if name == "6":
+        raise FileNotFoundError(url)
+    return name.encode()
+
+
+def run(client, checkpoint):
+    with ThreadPoolExecutor(4) as downloads, ThreadPoolExecutor(2) as encoders:
+        return reencode(TEMPLATES, client, checkpoint, download, encoders, downloads, max_in_flight=3, batch_size=2)
+
+
+def test_reencode_batches_checkpoints_and_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(reprocess_biometrics, "_encode_photo", fake_encode)
+    client = MagicMock()
+    path = str(tmp_path / "ckpt.jsonl")
+
+    checkpoint = Checkpoint(path)
+    report = run(client, checkpoint)
+    checkpoint.close()
+    assert report["counts"] == {"DOWNLOAD_FAILED": 1, "DOWNLOAD_MISSING": 1, "NO_FACE": 1, "REENCODED": 4}
+    updates = client.table.return_value.update.return_value.eq.call_args_list
+    assert sorted(call.args[1] for call in updates) == ["t0", "t1", "t2", "t4"]
+    client.table.return_value.upsert.assert_not_called()  # Update-only: never re-inserts a template
+
+    # Second run only retries the transient download failure
+    client.reset_mock()
+    checkpoint = Checkpoint(path)
+    report = run(client, checkpoint)
+    checkpoint.close()
+    assert report["total"] == 1 and report["counts"] == {"DOWNLOAD_FAILED": 1}
+    assert Checkpoint(path, restart=True).done == {}
+
+
+def test_templates_deleted_during_the_run_are_skipped_not_reinserted(tmp_path, monkeypatch):
+    monkeypatch.setattr(reprocess_biometrics, "_encode_photo", fake_encode)
+    client = MagicMock()
+    eq = client.table.return_value.update.return_value.eq
+    eq.side_effect = lambda col, value: MagicMock(**{"execute.return_value.data": [] if value == "t1" else [{"id": value}]})
+
+    checkpoint = Checkpoint(str(tmp_path / "ckpt.jsonl"))
+    report = run(client, checkpoint)
+    assert report["counts"]["TEMPLATE_GONE"] == 1 and report["counts"]["REENCODED"] == 3
+    assert checkpoint.done["t1"] == "TEMPLATE_GONE"
+    checkpoint.close()
@@ -0,0 +1,73 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sessions import SessionTracker, box_iou
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+BOX = (100, 300, 300, 100)
+
+
+def tracker(clock, **kwargs):
+    return SessionTracker(**{"accept_frames": 2, "instant_distance": 0.25, "window": 3.0,
+                             "idle_timeout": 2.0, "max_seconds": 10.0, "min_iou": 0.3, "clock": clock, **kwargs})
+
+
+def test_accepts_after_consistent_frames_then_follows_the_face():
+    clock = Clock()
+    sessions = tracker(clock)
+    assert not sessions.vote("door-1", "EMP-1", 0.40, BOX)
+    clock.now = 0.5
+    assert sessions.vote("door-1", "EMP-1", 0.38, BOX)
+    session = sessions.accept("door-1", "EMP-1", "Asha", 0.38)
+
+    clock.now = 1.0
+    assert sessions.follow("door-1", (110, 310, 310, 110))  # Same face, moved slightly
+    assert session.summary() == {"id": session.id, "state": "accepted", "frames": 3, "skipped": 1}
+    assert not sessions.follow("door-1", (0, 60, 60, 0))    # Someone else: caller ends the session
+    assert not sessions.follow("door-1", None)              # Face left
+    assert sessions.end("door-1", "face_left") is session
+    assert sessions.accepted("door-1") is None
+
+
+def test_one_close_match_is_enough_and_other_employees_break_the_streak():
+    clock = Clock()
+    sessions = tracker(clock)
+    assert sessions.vote("door-1", "EMP-1", 0.20, BOX)  # Below instant_distance
+    other = tracker(clock)
+    assert not other.vote("door-2", "EMP-1", 0.40, BOX)
+    assert not other.vote("door-2", "EMP-2", 0.40, BOX)
+    other.fail("door-2", "AMBIGUOUS_MATCH", "EMP-2", 0.41, BOX)
+    assert not other.vote("door-2", "EMP-2", 0.40, BOX)
+    clock.now = 5.0  # Outside the window: the old vote no longer counts
+    assert not other.vote("door-2", "EMP-2", 0.40, BOX)
+
+
+def test_expire_ends_idle_and_aged_sessions():
+    clock = Clock()
+    sessions = tracker(clock)
+    sessions.fail("idle", "NOT_RECOGNIZED", "EMP-9", 0.6)
+    sessions.vote("busy", "EMP-1", 0.2, BOX)
+    sessions.accept("busy", "EMP-1", "Asha", 0.2)
+    for t in range(1, 12):
+        clock.now = float(t)
+        sessions.follow("busy", BOX)
+        ended = sessions.expire()
+        if t == 3:
+            assert [(s.device_id, s.end_reason, s.closest) for s in ended] == [("idle", "idle", (0.6, "EMP-9"))]
+    assert ended[0].device_id == "busy" and ended[0].end_reason == "max_age"
+    assert len(sessions) == 0
+
+
+def test_box_iou():
+    assert box_iou(BOX, BOX) == 1.0
+    assert box_iou(BOX, (0, 50, 50, 0)) == 0.0
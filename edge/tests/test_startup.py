@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startup import Startup
+
+
+def test_ready_once_required_phases_succeed():
+    loaded = []
+
+    async def warm():
+        await asyncio.sleep(0.01)
+        loaded.append("encoder")
+
+    def optional():
+        raise RuntimeError("no key")
+
+    async def run():
+        startup = Startup()
+        task = startup.start([("gallery", lambda: loaded.append("gallery"), True),
+                              ("encoder", warm, True),
+                              ("liveness", optional, False)])
+        assert not startup.ready
+        await task
+        return startup
+
+    startup = asyncio.run(run())
+    assert startup.ready and sorted(loaded) == ["encoder", "gallery"]
+    report = startup.report()
+    assert report["phases"]["encoder"]["status"] == "ok" and report["phases"]["encoder"]["seconds"] >= 0.01
+    assert report["phases"]["liveness"] == {"status": "failed", "required": False,
+                                           "seconds": report["phases"]["liveness"]["seconds"], "error": "no key"}
+    assert report["seconds_to_ready"] is not None
+
+
+def test_required_failure_keeps_engine_not_ready():
+    def broken():
+        raise OSError("store unreadable")
+
+    async def run():
+        startup = Startup()
+        await startup.start([("gallery", broken, True)])
+        return startup
+
+    startup = asyncio.run(run())
+    assert not startup.ready
+    assert startup.report()["phases"]["gallery"]["error"] == "store unreadable"
@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import template_store
+from template_store import FaceTemplateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = FaceTemplateStore(str(tmp_path / "templates"))
+    yield s
+    s.close()
+
+
+def test_put_and_reload_without_parsing_embeddings(tmp_path, store):
+    store.put("EMP-1", np.full(128, 0.5).tolist(), name="Asha", role="employee")
+    store.put("EMP-2", json.dumps([0.25] * 128), name="Ravi")
+    store.close()
+
+    reopened = FaceTemplateStore(str(tmp_path / "templates"))
+    assert [m["employee_id"] for m in reopened.metadata()] == ["EMP-1", "EMP-2"]
+    assert reopened.vectors().shape == (2, 128)
+    assert reopened.vectors()[1][0] == pytest.approx(0.25)
+    reopened.close()
+
+
+def test_put_replaces_previous_template(store):
+    store.put("EMP-1", [0.1] * 128)
+    store.put("EMP-1", [0.9] * 128)
+    assert len(store) == 1
+    assert store.vectors()[0][0] == pytest.approx(0.9)
+
+
+def test_delete_is_tombstoned_and_survives_reload(tmp_path, store):
+    store.put("EMP-1", [0.1] * 128)
+    store.put("EMP-2", [0.2] * 128)
+    assert store.delete("EMP-1") == 1
+    store.close()
+
+    reopened = FaceTemplateStore(str(tmp_path / "templates"))
+    assert [m["employee_id"] for m in reopened.metadata()] == ["EMP-2"]
+    reopened.close()
+
+
+def test_grows_and_compacts(monkeypatch, store):
+    monkeypatch.setattr(template_store, "COMPACT_MIN_TOMBSTONES", 8)
+    for i in range(300):
+        store.put(f"EMP-{i}", [float(i)] * 128)
+    for i in range(200):
+        store.delete(f"EMP-{i}")
+    assert len(store) == 100
+    assert store._count < 300  # compaction dropped tombstoned rows
+    assert store.vectors()[0][0] == pytest.approx(200.0)
+
+
+def test_replace_all_skips_invalid_records(store):
+    count = store.replace_all([
+        {"employee_id": "EMP-1", "face_embedding": json.dumps([0.1] * 128), "name": "A"},
+        {"employee_id": "EMP-2", "face_embedding": "not-json"},
+        {"employee_id": "EMP-3", "face_embedding": [0.1] * 12},
+    ])
+    assert count == 1
+    assert store.metadata() == [
+        {"employee_id": "EMP-1", "template_id": None, "name": "A", "role": None, "updated_at": None}
+    ]
+
+
+def test_add_keeps_most_recent_templates(tmp_path, store):
+    for i in range(4):
+        store.add("EMP-1", [float(i)] * 128, template_id=f"T{i}", max_templates=3)
+    store.add("EMP-2", [9.0] * 128, template_id="X")
+    assert store.template_count("EMP-1") == 3
+    assert store.get_template("T0") is None
+    store.close()
+
+    reopened = FaceTemplateStore(str(tmp_path / "templates"))
+    assert [m["template_id"] for m in reopened.metadata()] == ["T1", "T2", "T3", "X"]
+    reopened.close()
+
+
+def test_add_with_known_template_id_replaces_that_row(store):
+    store.add("EMP-1", [0.1] * 128, template_id="T1")
+    store.add("EMP-1", [0.2] * 128, template_id="T2")
+    store.add("EMP-1", [0.3] * 128, template_id="T1", max_templates=None)
+    assert store.template_count("EMP-1") == 2
+    assert store.vectors()[-1][0] == pytest.approx(0.3)
+
+
+def test_delete_template_leaves_other_templates(store):
+    store.add("EMP-1", [0.1] * 128, template_id="T1")
+    store.add("EMP-1", [0.2] * 128, template_id="T2")
+    assert store.delete_template("T1") is True
+    assert store.delete_template("T1") is False
+    assert [m["template_id"] for m in store.metadata()] == ["T2"]
+
+
+def test_iter_vectors_streams_live_rows(tmp_path):
+    store = FaceTemplateStore(str(tmp_path / "t"))
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        store.add(f"EMP-{i}", rng.normal(size=128).tolist(), template_id=f"T{i}")
+    store.delete("EMP-3")
+    blocks = list(store.iter_vectors(chunk_rows=4))
+    assert [len(b) for b in blocks] == [4, 4, 1]
+    assert np.array_equal(np.vstack(blocks), store.vectors())
+    assert store.metadata()[0] is store.metadata()[0]  # Shared, not copied per call
@@ -0,0 +1,135 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import template_sync
+from template_sync import SyncState, fetch_all_templates, fetch_template_changes
+
+
+class FakeQuery:
+    """Just enough of the supabase query builder for gte/gt/order/range."""
+
+    def __init__(self, rows, keys=()):
+        self.rows = rows
+        self.keys = keys
+
+    def select(self, *_):
+        return self
+
+    def gte(self, col, value):
+        return FakeQuery([r for r in self.rows if value == "epoch" or r[col] >= value])
+
+    def gt(self, col, value):
+        return FakeQuery([r for r in self.rows if r[col] > value])
+
+    def order(self, col, desc=False):
+        keys = self.keys + (col,)  # A later order() breaks ties, as in PostgREST
+        return FakeQuery(sorted(self.rows, key=lambda r: tuple(r[k] for k in keys), reverse=desc), keys)
+
+    def range(self, start, end):
+        return FakeQuery(self.rows[start:end + 1])
+
+    def execute(self):
+        return self
+
+    @property
+    def data(self):
+        return self.rows
+
+
+class FakeClient:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return FakeQuery(self.tables.get(name, []))
+
+
+def template(emp_id, ts, template_id=None):
+    return {"id": template_id or f"{emp_id}-T", "employee_id": emp_id, "embedding": [0.1] * 128, "updated_at": ts,
+            "employees": {"name": emp_id.lower(), "role": "employee"}}
+
+
+def test_fetches_only_rows_past_the_marks(tmp_path):
+    client = FakeClient({
+        "face_templates": [template("EMP-1", "2026-01-01T00:00:00"), template("EMP-2", "2026-01-02T00:00:00")],
+        "face_template_deletions": [
+            {"id": 1, "employee_id": "EMP-0", "deleted_at": "2025-12-31T00:00:00"},
+            {"id": 2, "employee_id": "EMP-9", "deleted_at": "2026-01-03T00:00:00"},
+        ],
+    })
+    state = SyncState(str(tmp_path / "sync.json"))
+    state.templates_since = "2026-01-02T00:00:00"
+    state.deletions_since = 1
+
+    upserts, deleted, templates_mark, deletions_mark = fetch_template_changes(client, state)
+
+    assert [r["employee_id"] for r in upserts] == ["EMP-2"]
+    assert deleted == [{"employee_id": "EMP-9", "template_id": None}]
+    assert templates_mark == "2026-01-02T00:00:00"
+    assert deletions_mark == 2
+
+
+def test_reenrolment_after_delete_wins(tmp_path):
+    client = FakeClient({
+        "face_templates": [template("EMP-1", "2026-01-05T00:00:00")],
+        "face_template_deletions": [{"id": 7, "employee_id": "EMP-1", "deleted_at": "2026-01-04T00:00:00"}],
+    })
+    state = SyncState(str(tmp_path / "sync.json"))
+    state.templates_since = "2026-01-01T00:00:00"
+    state.deletions_since = 6
+
+    upserts, deleted, _, _ = fetch_template_changes(client, state)
+
+    assert [r["employee_id"] for r in upserts] == ["EMP-1"]
+    assert deleted == [{"employee_id": "EMP-1", "template_id": None}]
+
+
+def test_template_level_deletion_only_drops_that_template(tmp_path):
+    client = FakeClient({
+        "face_templates": [
+            template("EMP-1", "2026-01-02T00:00:00", "T1"),
+            template("EMP-1", "2026-01-02T00:00:00", "T2"),
+        ],
+        "face_template_deletions": [
+            {"id": 3, "employee_id": "EMP-1", "template_id": "T1", "deleted_at": "2026-01-03T00:00:00"},
+        ],
+    })
+    state = SyncState(str(tmp_path / "sync.json"))
+    state.templates_since, state.deletions_since = "2026-01-01T00:00:00", 2
+
+    upserts, deleted, _, _ = fetch_template_changes(client, state)
+
+    assert [r["template_id"] for r in upserts] == ["T2"]
+    assert deleted == [{"employee_id": "EMP-1", "template_id": "T1"}]
+
+
+def test_state_round_trips(tmp_path):
+    path = str(tmp_path / "sync.json")
+    state = SyncState(path)
+    assert not state.ready
+    state.templates_since, state.deletions_since = "2026-01-01T00:00:00", 4
+    state.save()
+    assert SyncState(path).deletions_since == 4
+    state.reset()
+    assert not SyncState(path).ready
+
+
+def test_full_pull_reads_every_page(monkeypatch):
+    monkeypatch.setattr(template_sync, "PAGE_SIZE", 2)
+    rows = [template(f"EMP-{i}", f"2026-01-0{i}T00:00:00", template_id=f"T{i}") for i in range(1, 6)]
+    records, mark = fetch_all_templates(FakeClient({"face_templates": rows[::-1]}))
+
+    assert [r["template_id"] for r in records] == ["T1", "T2", "T3", "T4", "T5"]
+    assert mark == "2026-01-05T00:00:00"
+
+
+def test_delta_pages_break_timestamp_ties_by_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(template_sync, "PAGE_SIZE", 2)
+    rows = [template(f"EMP-{i}", "2026-01-01T00:00:00", template_id=f"T{i}") for i in (3, 1, 5, 2, 4)]
+    state = SyncState(str(tmp_path / "sync.json"))
+
+    upserts, _, _, _ = fetch_template_changes(FakeClient({"face_templates": rows}), state)
+
+    assert [r["template_id"] for r in upserts] == ["T1", "T2", "T3", "T4", "T5"]
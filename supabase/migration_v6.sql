@@ -0,0 +1,40 @@
+-- migration_v6.sql: Delta Sync Support for face_templates
+-- Edge terminals pull only rows changed since their last high-water mark
+-- instead of re-downloading the whole table every sync cycle.
+
+-- 1. Row change timestamp (reuses update_updated_at_column() from migration_v2)
+ALTER TABLE public.face_templates
+ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone DEFAULT timezone('utc'::text, now());
+
+UPDATE public.face_templates SET updated_at = now() WHERE updated_at IS NULL;
+
+DROP TRIGGER IF EXISTS update_face_templates_updated_at ON public.face_templates;
+CREATE TRIGGER update_face_templates_updated_at
+    BEFORE UPDATE ON public.face_templates
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_face_templates_updated_at ON public.face_templates (updated_at);
+
+-- 2. Deletion journal so terminals can evict templates removed upstream
+CREATE TABLE IF NOT EXISTS public.face_template_deletions (
+    id bigserial PRIMARY KEY,
+    employee_id text NOT NULL,
+    deleted_at timestamp with time zone DEFAULT timezone('utc'::text, now())
+);
+
+CREATE INDEX IF NOT EXISTS idx_face_template_deletions_deleted_at ON public.face_template_deletions (deleted_at);
+
+CREATE OR REPLACE FUNCTION record_face_template_deletion()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO public.face_template_deletions (employee_id) VALUES (old.employee_id);
+    RETURN old;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_face_template_deleted ON public.face_templates;
+CREATE TRIGGER tr_face_template_deleted
+    AFTER DELETE ON public.face_templates
+    FOR EACH ROW
+    EXECUTE FUNCTION record_face_template_deletion();
@@ -0,0 +1,20 @@
+-- migration_v7.sql: Multiple Face Templates per Employee
+-- Terminals match against up to MAX_TEMPLATES_PER_EMPLOYEE templates per person
+-- (different lighting, glasses, ...) instead of forcing a re-enrollment.
+
+-- 1. Drop the one-template-per-employee uniqueness used by upsert(on_conflict="employee_id")
+ALTER TABLE public.face_templates DROP CONSTRAINT IF EXISTS face_templates_employee_id_key;
+DROP INDEX IF EXISTS face_templates_employee_id_key;
+CREATE INDEX IF NOT EXISTS idx_face_templates_employee_id ON public.face_templates (employee_id, updated_at DESC);
+
+-- 2. Journal which template was deleted so edge delta sync can evict just that row
+ALTER TABLE public.face_template_deletions ADD COLUMN IF NOT EXISTS template_id text;
+
+CREATE OR REPLACE FUNCTION record_face_template_deletion()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO public.face_template_deletions (employee_id, template_id)
+    VALUES (old.employee_id, old.id::text);
+    RETURN old;
+END;
+$$ LANGUAGE plpgsql;
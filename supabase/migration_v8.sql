@@ -0,0 +1,68 @@
+-- migration_v8.sql: Per-Site / Per-Door Gallery Partitions
+-- Each terminal identifies itself (device_id) and only matches against the
+-- employees allowed through its door instead of the whole workforce.
+-- Partition keys are free-form text, e.g. 'site:HQ' or 'door:HQ-main'.
+-- Terminals sync both tables incrementally, like face_templates (migration_v6).
+
+-- 1. Device identity -> site, door and the partitions it scans
+CREATE TABLE IF NOT EXISTS public.devices (
+    device_id text PRIMARY KEY,
+    site_id text,
+    door_id text,
+    partitions text[] NOT NULL DEFAULT '{}',
+    updated_at timestamp with time zone DEFAULT timezone('utc'::text, now())
+);
+
+DROP TRIGGER IF EXISTS update_devices_updated_at ON public.devices;
+CREATE TRIGGER update_devices_updated_at
+    BEFORE UPDATE ON public.devices
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_devices_updated_at ON public.devices (updated_at);
+
+-- 2. Membership index: which partitions an employee belongs to
+CREATE TABLE IF NOT EXISTS public.partition_members (
+    employee_id text NOT NULL REFERENCES public.employees(employee_id) ON DELETE CASCADE,
+    partition text NOT NULL,
+    updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()),
+    PRIMARY KEY (employee_id, partition)
+);
+
+DROP TRIGGER IF EXISTS update_partition_members_updated_at ON public.partition_members;
+CREATE TRIGGER update_partition_members_updated_at
+    BEFORE UPDATE ON public.partition_members
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_partition_members_updated_at ON public.partition_members (updated_at);
+CREATE INDEX IF NOT EXISTS idx_partition_members_partition ON public.partition_members (partition);
+
+-- 3. Deletion journal so terminals can drop memberships removed upstream
+--    (including the cascade from employees); removed devices are picked up by
+--    the periodic full reconcile
+CREATE TABLE IF NOT EXISTS public.partition_member_deletions (
+    id bigserial PRIMARY KEY,
+    employee_id text NOT NULL,
+    partition text NOT NULL,
+    deleted_at timestamp with time zone DEFAULT timezone('utc'::text, now())
+);
+
+CREATE OR REPLACE FUNCTION record_partition_member_deletion()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO public.partition_member_deletions (employee_id, partition)
+    VALUES (old.employee_id, old.partition);
+    RETURN old;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_partition_member_deleted ON public.partition_members;
+CREATE TRIGGER tr_partition_member_deleted
+    AFTER DELETE ON public.partition_members
+    FOR EACH ROW
+    EXECUTE FUNCTION record_partition_member_deletion();
+
+-- 4. Devices default to the whole gallery until they are given partitions:
+--    INSERT INTO public.devices (device_id, site_id, door_id, partitions)
+--    VALUES ('terminal_01', 'HQ', 'HQ-main', ARRAY['site:HQ']);
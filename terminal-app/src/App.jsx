@@ -8,6 +8,7 @@ import { BleClient } from '@capacitor-community/bluetooth-le';
 
 // Production API Configuration
 const API_BASE = import.meta.env?.VITE_API_BASE_URL || 'https://smart-door-backend-50851729985.asia-south1.run.app';
+const DEVICE_ID = import.meta.env?.VITE_DEVICE_ID || 'terminal_01'; // Selects this door's gallery partitions
 const RESET_DELAY = 5; // seconds
 
 const BLE_MAC = '58:8C:81:CC:65:29';
@@ -278,6 +279,7 @@ export default function App() {
             try {
                 const form = new FormData();
                 form.append('file', blob, 'face.jpg');
+                form.append('device_id', DEVICE_ID);
 
                 const res = await axios.post(`${API_BASE}/api/biometrics/face/verify`, form, {
                     headers: { 'Content-Type': 'multipart/form-data' },